@@ -0,0 +1,124 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+# RSS held by many parser instances, as parsers and as FrozenCryptoConfig
+# snapshots. Every scenario runs in a fresh interpreter.
+#
+#   python benchmarks/memory.py [--count 10000] [--keys 10]
+
+import argparse
+import gc
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.cryptoconfigparser import (AESCipher, AESCryptoConfigParser,  # noqa
+                                    FrozenCryptoConfig, SSMCryptoConfigParser)
+
+PARSERS = {'aes': AESCryptoConfigParser, 'ssm': SSMCryptoConfigParser}
+SCENARIOS = ('aes-parser', 'aes-frozen', 'ssm-parser', 'ssm-frozen')
+SECTIONS = ('database', 'cache', 'queue', 'storage', 'mail', 'api')
+
+
+def rss() -> int:
+    # resident bytes now, not the peak
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+            # end with
+        # end if
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+    # end def
+
+
+def tenant_config(tenant: int, cipher: AESCipher) -> str:
+    # one template: plain options repeat across tenants, secrets differ
+    lines = ['[settings]',
+             'encrypted_options=' + ','.join(
+                 f'{section}.password' for section in SECTIONS)]
+    for section in SECTIONS:
+        lines += [f'[{section}]',
+                  f'host={section}.internal',
+                  'port=5432',
+                  'timeout=30',
+                  'pool_size=10',
+                  f'user=tenant{tenant}',
+                  f'password={cipher.encrypt(f"{section}{tenant}").decode()}',
+                  f'token=file:{cipher.encrypt(f"token{tenant}").decode()}']
+        # end for
+    return '\n'.join(lines) + '\n'
+    # end def
+
+
+def measure(scenario: str, count: int, keys: int) -> int:
+    parser_name, _, form = scenario.partition('-')
+    parser_class = PARSERS[parser_name]
+    key_strings = [f'{i:032d}' for i in range(keys)]
+    texts = [tenant_config(i, AESCipher(key_strings[i % keys]))
+             for i in range(count)]
+    gc.collect()
+    before = rss()
+
+    held = []
+    for i, text in enumerate(texts):
+        # a key per parser, as read from a key file or a secret
+        parser = parser_class.from_string(text, key=key_strings[i % keys])
+        held.append(parser if form == 'parser'
+                    else FrozenCryptoConfig(parser))
+        # end for
+    gc.collect()
+    used = rss() - before
+
+    # the snapshots still decrypt
+    assert held[-1].decrypt('api', 'password') == f'api{count - 1}'
+    return used
+    # end def
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--keys', type=int, default=10,
+                        help='distinct keys across the instances')
+    parser.add_argument('--scenario', choices=SCENARIOS, default=None)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        print(measure(args.scenario, args.count, args.keys))
+        return 0
+        # end if
+
+    results = {}
+    for scenario in SCENARIOS:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__),
+             '--scenario', scenario, '--count', str(args.count),
+             '--keys', str(args.keys)],
+            check=True, capture_output=True, text=True).stdout
+        results[scenario] = int(output.split()[-1])
+        # end for
+
+    print(f'{args.count} instances, {args.keys} distinct keys, '
+          f'{len(SECTIONS) * 7} options each')
+    print(f'{"scenario":<14}{"MiB":>10}{"MiB per 10,000":>16}'
+          f'{"bytes each":>12}')
+    for scenario, used in results.items():
+        print(f'{scenario:<14}{used / 2 ** 20:>10.1f}'
+              f'{used * 10000 / args.count / 2 ** 20:>16.1f}'
+              f'{used // args.count:>12}')
+        # end for
+    return 0
+    # end def
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+    # end if
@@ -6,25 +6,92 @@
 # ---------------------------------------------------------------------------
 
 import base64
+import binascii
 import codecs
+import copy
+import dataclasses
+import hashlib
+import hmac
+import json
+import logging
+import os
 import sys
-from configparser import RawConfigParser
+import threading
+import time
+import typing
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from configparser import (Interpolation, NoOptionError, NoSectionError,
+                          RawConfigParser)
 from pathlib import Path
+from typing import (Any, Callable, Dict, Iterable, List, NamedTuple, Tuple,
+                    Type)
 
 from Crypto import Random
 from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
 from Crypto.Util import Padding
 
+from . import KeyFile
+from .KeyProvider import (SCHEME_SEPARATOR, KeyProvider, get_provider_class,
+                          split_scheme)
+from .LazySections import SectionIndex, SectionProxies
+from .Profiler import Profiler, TraceRecorder
+from .SecretBuffer import SecretBuffer
+
+_UNSET = object()
+# AESCipher.share(): one cipher per distinct key, keyed by an HMAC of the
+# key under a per-process salt, so the registry never holds key digests
+# that mean anything outside the process
+_SHARED_CIPHERS = weakref.WeakValueDictionary()
+_SHARED_SALT = Random.get_random_bytes(32)
+_SHARED_LOCK = threading.Lock()
+
+
+class PrefetchResult(NamedTuple):
+    count: int
+    elapsed: float
+    errors: Dict[Tuple[str, str], BaseException]
+
 
 class AESCryptoConfigParser(RawConfigParser):
 
     SETTING_SECTION_KEY = 'settings'
     KEYFILE_OPTION_KEY = 'key_file'
+    KEY_FORMAT_OPTION_KEY = 'key_format'
+    ENCRYPTED_OPTIONS_OPTION_KEY = 'encrypted_options'
+    DETERMINISTIC_OPTION_KEY = 'deterministic'
+    DECRYPT_CACHE_SIZE_OPTION_KEY = 'decrypt_cache_size'
+    DECRYPT_CACHE_TTL_OPTION_KEY = 'decrypt_cache_ttl'
+    LEGACY_BARE_OPTION_KEY = 'legacy_bare'
+    DECRYPT_CACHE_SIZE = 1024
+    DECRYPT_CACHE_TTL = 300.0
+    PREFETCH_WORKERS = 8
+    PREFETCH_CHUNK_SIZE = 20
+    LAZY_CACHE_SIZE = 128
+    # typed values returned from the decrypt cache without a copy
+    IMMUTABLE_KINDS = ('str', 'int', 'float', 'bool', 'bytes')
 
-    def __init__(self, config_path: str = None, encoding: str = None):
+    def __init__(self, config_path: str = None, encoding: str = None,
+                 lazy: bool = False):
         super(AESCryptoConfigParser, self).__init__()
 
         self.__cipher = None
+        self.__providers = {}
+        self.__init_lock = threading.RLock()
+        self.__cache_lock = threading.Lock()
+        self.__decrypted = OrderedDict()
+        self.__deduplicated = OrderedDict()
+        # bumped by clear_decrypt_cache() so that a decrypt that started
+        # before it cannot store its stale plaintext afterwards
+        self.__generation = 0
+        self.__profiler = None
+        self.__legacy_bare = None
+        self.__config_path = None
+        self.__key_file = None
+        self.__lazy = lazy
         self.__encoding = sys.getdefaultencoding()
         if encoding:
             self.__encoding = encoding
@@ -36,15 +103,96 @@ class AESCryptoConfigParser(RawConfigParser):
                 # end if
 
             self.reset_config(config_path, self.__encoding)
+            self.apply_settings()
+            # end if
+        # end def
 
-            if self.has_option(self.SETTING_SECTION_KEY,
-                               self.KEYFILE_OPTION_KEY):
-                # load key
-                self.load_key_file(
-                    self.get(
-                        self.SETTING_SECTION_KEY,
-                        self.KEYFILE_OPTION_KEY))
-                # end if
+    def apply_settings(self):
+        # called once the config is read; subclasses pick up their
+        # own [settings] options here
+        if self.__cipher is None and self.has_option(
+                self.SETTING_SECTION_KEY, self.KEYFILE_OPTION_KEY):
+            # load key
+            self.load_key_file(
+                self.get(
+                    self.SETTING_SECTION_KEY,
+                    self.KEYFILE_OPTION_KEY))
+            # end if
+        # end def
+
+    @classmethod
+    def from_string(cls, string: str, encoding: str = None, key=None,
+                    source: str = '<string>', **kwargs):
+        parser = cls(encoding=encoding, **kwargs)
+        parser.read_string(string, source)
+        parser.__apply_memory_settings(key)
+        return parser
+        # end def
+
+    @classmethod
+    def from_bytes(cls, data: bytes, encoding: str = None, key=None,
+                   source: str = '<bytes>', **kwargs):
+        return cls.from_string(
+            codecs.decode(data, encoding or sys.getdefaultencoding()),
+            encoding, key, source, **kwargs)
+        # end def
+
+    @classmethod
+    def from_dict(cls, dictionary: Dict[str, Dict[str, Any]],
+                  encoding: str = None, key=None,
+                  source: str = '<dict>', **kwargs):
+        parser = cls(encoding=encoding, **kwargs)
+        parser.read_dict(dictionary, source)
+        parser.__apply_memory_settings(key)
+        return parser
+        # end def
+
+    @classmethod
+    def from_fileobj(cls, fileobj, encoding: str = None, key=None,
+                     source: str = None, **kwargs):
+        parser = cls(encoding=encoding, **kwargs)
+        if isinstance(fileobj.read(0), bytes):
+            fileobj = codecs.getreader(parser.encoding)(fileobj)
+            # end if
+        parser.read_file(fileobj, source)
+        parser.__apply_memory_settings(key)
+        return parser
+        # end def
+
+    def __apply_memory_settings(self, key):
+        # an explicit key wins over [settings] key_file,
+        # so the disk is not touched at all
+        if key is not None:
+            self.load_key(key)
+            # end if
+        self.apply_settings()
+        # end def
+
+    def get_key_format(self) -> str:
+        # [settings] key_format: text (default), binary or base64
+        return self.get(self.SETTING_SECTION_KEY, self.KEY_FORMAT_OPTION_KEY,
+                        fallback=KeyFile.KEY_FORMAT_TEXT)
+        # end def
+
+    key_format = property(get_key_format)
+
+    def get_profiler(self) -> Profiler:
+        # the one set on the parser, else the one active in this context,
+        # looked up on every call
+        return self.__profiler or Profiler.current()
+        # end def
+
+    def set_profiler(self, value: Profiler):
+        self.__profiler = value
+        # end def
+
+    profiler = property(get_profiler, set_profiler)
+
+    def _profile_call(self, operation: str):
+        # attributes a remote call or key file read to the running trace
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.record_call(operation)
             # end if
         # end def
 
@@ -67,10 +215,32 @@ class AESCryptoConfigParser(RawConfigParser):
     def set_key_file(self, value: str):
         self.__key_file = value
         self.__cipher = None
+        self.clear_decrypt_cache()
         # end def
 
     key_file = property(get_key_file, set_key_file)
 
+    def get_lazy(self) -> bool:
+        return self.__lazy
+        # end def
+
+    lazy = property(get_lazy)
+
+    def get_interpolation(self) -> Interpolation:
+        return self._interpolation
+        # end def
+
+    def set_interpolation(self, value: Interpolation):
+        # e.g. SecretInterpolation() to resolve ${section:option}
+        if value is None:
+            value = Interpolation()
+            # end if
+        self._interpolation = value
+        self.clear_decrypt_cache()
+        # end def
+
+    interpolation = property(get_interpolation, set_interpolation)
+
     def reset_config(self, config_path: str = None, encoding: str = None):
         if config_path:
             self.__config_path = config_path
@@ -78,6 +248,19 @@ class AESCryptoConfigParser(RawConfigParser):
         if encoding:
             self.__encoding = encoding
             # end if
+        self.clear_decrypt_cache()
+
+        # a missing file gives an empty parser, as RawConfigParser.read
+        if self.__lazy and SectionIndex.supports(self.encoding) \
+                and os.path.isfile(self.config_path):
+            # index section offsets now, parse sections on demand
+            self._sections = SectionIndex(
+                self, self.config_path, self.encoding, self.LAZY_CACHE_SIZE)
+            self._proxies = SectionProxies(self)
+            self._defaults.clear()
+            self._defaults.update(self._sections.defaults())
+            return
+            # end if
 
         super(
             AESCryptoConfigParser,
@@ -86,6 +269,32 @@ class AESCryptoConfigParser(RawConfigParser):
             self.encoding)
         # end def
 
+    def _read(self, fp, fpname: str):
+        if isinstance(self._sections, SectionIndex):
+            # read_* changes existing sections in place; keep them
+            with self._sections.pinning_reads():
+                return super(AESCryptoConfigParser, self)._read(fp, fpname)
+                # end with
+            # end if
+        return super(AESCryptoConfigParser, self)._read(fp, fpname)
+        # end def
+
+    def set(self, section: str, option: str, value: str = None):
+        if isinstance(self._sections, SectionIndex):
+            # keep sections changed in memory out of the LRU
+            self._sections.pin(section)
+            # end if
+        super(AESCryptoConfigParser, self).set(section, option, value)
+        # end def
+
+    def remove_option(self, section: str, option: str) -> bool:
+        if isinstance(self._sections, SectionIndex):
+            self._sections.pin(section)
+            # end if
+        return super(AESCryptoConfigParser, self).remove_option(
+            section, option)
+        # end def
+
     def load_key_file(self, key_file_path: str = None):
         if key_file_path:
             if isinstance(key_file_path, Path):
@@ -95,51 +304,915 @@ class AESCryptoConfigParser(RawConfigParser):
             self.key_file = key_file_path
             # end if
 
-        with codecs.open(self.key_file, 'r', self.encoding) as file:
-            self.__key = file.readline().strip()
-            # end with
+        self.__cipher = KeyFile.load_cipher(
+            self.key_file, AESCipher, self.key_format, self.encoding,
+            lambda: self._profile_call('file.read'))
+        self.clear_decrypt_cache()
+        # end def
+
+    def load_key(self, key):
+        # in-memory key source: str, bytes, bytearray or SecretBuffer
+        if isinstance(key, SecretBuffer):
+            # keep the buffer referenced until the cipher has copied it
+            self.__cipher = AESCipher(key.view())
+        else:
+            self.__cipher = AESCipher(key)
+            # end if
+        self.clear_decrypt_cache()
+        # end def
+
+    def get_cipher(self) -> 'AESCipher':
+        # single flight: concurrent first callers wait for one load
+        cipher = self.__cipher
+        if cipher is None:
+            with self.__init_lock:
+                if self.__cipher is None:
+                    self.load_key_file()
+                    # end if
+                cipher = self.__cipher
+                # end with
+            # end if
+        return cipher
+        # end def
+
+    def get_provider(self, scheme: str) -> KeyProvider:
+        provider = self.__providers.get(scheme)
+        if provider is None:
+            with self.__init_lock:
+                if scheme not in self.__providers:
+                    self.__providers[scheme] = get_provider_class(scheme)(
+                        self)
+                    # end if
+                provider = self.__providers[scheme]
+                # end with
+            # end if
+        return provider
+        # end def
+
+    def reset_providers(self):
+        for provider in self.__providers.values():
+            provider.reset()
+            # end for
+        self.clear_decrypt_cache()
+        # end def
+
+    def default_scheme(self, value: str) -> str:
+        # backend for values without a registered "scheme:" prefix
+        return 'file'
+        # end def
+
+    def resolve_scheme(self, value: str) -> Tuple[str, str]:
+        scheme, payload = split_scheme(value)
+        if scheme is None:
+            scheme = self.default_scheme(value)
+            # end if
+        return scheme, payload
+        # end def
+
+    def decrypt_value(self, value: str,
+                      section: str = None, option: str = None) -> str:
+        scheme, payload = self.resolve_scheme(value)
+        return self.get_provider(scheme).decrypt(payload, section, option)
+        # end def
+
+    def get_deterministic(self) -> bool:
+        return self.getboolean(
+            self.SETTING_SECTION_KEY, self.DETERMINISTIC_OPTION_KEY,
+            fallback=False)
+        # end def
+
+    deterministic = property(get_deterministic)
+
+    def get_legacy_bare(self) -> bool:
+        # opt-in: also count unprefixed values shaped like a ciphertext of
+        # the default backend as encrypted; set on the parser (verify
+        # --legacy-bare) or by [settings] legacy_bare
+        if self.__legacy_bare is not None:
+            return self.__legacy_bare
+            # end if
+        return self.getboolean(
+            self.SETTING_SECTION_KEY, self.LEGACY_BARE_OPTION_KEY,
+            fallback=False)
+        # end def
+
+    def set_legacy_bare(self, value: bool):
+        self.__legacy_bare = value
+        # end def
 
-        self.__cipher = AESCipher(self.__key)
+    legacy_bare = property(get_legacy_bare, set_legacy_bare)
+
+    def encrypt_value(self, text: str, deterministic: bool = None) -> str:
+        # ciphertext for the parser's own key; [settings] deterministic
+        # selects SIV so that unchanged values keep their ciphertext
+        if deterministic is None:
+            deterministic = self.deterministic
+            # end if
+        mode = AESCipher.MODE_SIV if deterministic else AESCipher.MODE_CBC
+        return self.get_cipher().encrypt(text, mode).decode()
+        # end def
+
+    def is_deterministic_value(self, value: str) -> bool:
+        _, payload = self.resolve_scheme(value)
+        return AESCipher.is_deterministic(
+            payload.rpartition(SCHEME_SEPARATOR)[2])
         # end def
 
     def decrypt(self, section: str, option: str) -> str:
-        if self.__cipher is None:
-            self.load_key_file()
+        return self._decrypt_typed(section, option, 'str', str)
+        # end def
+
+    def decrypt_secret(self, section: str, option: str,
+                       lock: bool = False) -> SecretBuffer:
+        # never cached; wipe the buffer (or use it in a with block) when done
+        profiler = self.profiler
+        if profiler is None:
+            return self.__decrypt_secret(section, option, lock)
+            # end if
+        with profiler.trace(section, option, 'secret') as trace:
+            return self.__decrypt_secret(section, option, lock, trace)
+            # end with
+        # end def
+
+    def __decrypt_secret(self, section: str, option: str, lock: bool,
+                         trace: TraceRecorder = None) -> SecretBuffer:
+        raw = self.get(section, option, raw=True)
+        scheme, payload = self.resolve_scheme(raw)
+        secret = self.get_provider(scheme).decrypt_secret(
+            payload, section, option, lock)
+        if trace is not None:
+            trace.backend = scheme
+            trace.bytes_in = len(raw)
+            trace.bytes_out = len(secret)
             # end if
+        return secret
+        # end def
+
+    def decrypt_options(self, options: Iterable[Tuple[str, str]]
+                        ) -> Dict[Tuple[str, str], str]:
+        # group by backend so each one can batch its remote calls
+        groups = {}
+        for section, option in options:
+            scheme, payload = self.resolve_scheme(
+                self.get(section, option, raw=True))
+            groups.setdefault(scheme, []).append((payload, section, option))
+            # end for
 
-        raw = self.get(section, option)
-        return self.__cipher.decrypt(raw)
-        # end if
+        decrypted = {}
+        for scheme, items in groups.items():
+            values = self.get_provider(scheme).decrypt_many(items)
+            for (_, section, option), value in zip(items, values):
+                decrypted[(section, option)] = value
+                # end for
+            # end for
+        return decrypted
+        # end def
+
+    def is_encrypted_value(self, value: str) -> bool:
+        # prefixed values whose payload is shaped like that backend's
+        # ciphertext (so file:///var/data is a plain URL); bare values only
+        # with legacy_bare, since plain salts and digests look the same
+        scheme, payload = split_scheme(value)
+        if scheme is None:
+            if not self.legacy_bare:
+                return False
+                # end if
+            scheme = self.default_scheme(value)
+            # end if
+        return get_provider_class(scheme).accepts(payload)
+        # end def
+
+    def __encrypted_listing(self) -> Tuple[set, set]:
+        # [settings] encrypted_options: "section.option" or "section.*"
+        listed = set()
+        wildcard = set()
+        if self.has_option(self.SETTING_SECTION_KEY,
+                           self.ENCRYPTED_OPTIONS_OPTION_KEY):
+            value = self.get(self.SETTING_SECTION_KEY,
+                             self.ENCRYPTED_OPTIONS_OPTION_KEY)
+            for entry in value.replace('\n', ',').split(','):
+                section, sep, option = entry.strip().rpartition('.')
+                if not sep:
+                    continue
+                elif option == '*':
+                    wildcard.add(section)
+                else:
+                    listed.add((section, self.optionxform(option)))
+                    # end if
+                # end for
+            # end if
+        return listed, wildcard
+        # end def
+
+    def encrypted_options(self) -> List[Tuple[str, str]]:
+        # values with a registered "scheme:" prefix, plus the entries of
+        # [settings] encrypted_options (and bare ciphertexts with
+        # legacy_bare)
+        listed, wildcard = self.__encrypted_listing()
+
+        options = []
+        for section in self.sections():
+            if section == self.SETTING_SECTION_KEY:
+                continue
+                # end if
+            for option in self.options(section):
+                if section in wildcard or (section, option) in listed \
+                        or self.is_encrypted_value(
+                            self.get(section, option, raw=True)):
+                    options.append((section, option))
+                    # end if
+                # end for
+            # end for
+        return options
+        # end def
+
+    def is_encrypted(self, section: str, option: str) -> bool:
+        option = self.optionxform(option)
+        if section == self.SETTING_SECTION_KEY \
+                or not self.has_option(section, option):
+            return False
+            # end if
+        listed, wildcard = self.__encrypted_listing()
+        return section in wildcard or (section, option) in listed \
+            or self.is_encrypted_value(self.get(section, option, raw=True))
+        # end def
+
+    def __decrypt_concurrently(self, options: List[Tuple[str, str]],
+                               max_workers: int, chunk_size: int,
+                               store: bool = True
+                               ) -> Tuple[int, Dict[tuple, BaseException]]:
+        # chunks of one backend per task, so each can batch its remote
+        # calls; plaintexts go to the decrypt cache only when store is set
+        generation = self.__generation
+        groups = {}
+        duplicates = []
+        seen = set()
+        for section, option in options:
+            raw = self.get(section, option, raw=True)
+            if raw in seen:
+                # repeated deterministic ciphertext, decrypted once
+                duplicates.append((section, option, raw))
+                continue
+            elif self.is_deterministic_value(raw):
+                seen.add(raw)
+                # end if
+            scheme, payload = self.resolve_scheme(raw)
+            groups.setdefault(scheme, []).append(
+                (payload, section, option, raw))
+            # end for
+
+        def run(scheme: str, items: List[Tuple[str, str, str, str]]):
+            provider = self.get_provider(scheme)
+            try:
+                values = provider.decrypt_many(
+                    [item[:3] for item in items])
+                return [(item, value, None)
+                        for item, value in zip(items, values)]
+            except Exception:
+                # retry one by one to attribute the failure
+                results = []
+                for item in items:
+                    try:
+                        results.append(
+                            (item, provider.decrypt(*item[:3]), None))
+                    except Exception as e:
+                        results.append((item, None, e))
+                        # end try
+                    # end for
+                return results
+                # end try
+            # end def
+
+        count = 0
+        errors = {}
+        values = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(run, scheme, items[i:i + chunk_size])
+                for scheme, items in groups.items()
+                for i in range(0, len(items), chunk_size)]
+            for future in as_completed(futures):
+                for (_, section, option, raw), value, error in future.result():
+                    if error is not None:
+                        errors[(section, option)] = error
+                        values[raw] = error
+                        continue
+                        # end if
+                    if store:
+                        self._cache_store(section, option, 'str', raw, value,
+                                          generation=generation)
+                        # end if
+                    values[raw] = value if store else None
+                    count += 1
+                    # end for
+                # end for
+            # end with
+
+        for section, option, raw in duplicates:
+            if isinstance(values[raw], BaseException):
+                errors[(section, option)] = values[raw]
+                continue
+                # end if
+            if store:
+                self._cache_store(section, option, 'str', raw, values[raw],
+                                  generation=generation)
+                # end if
+            count += 1
+            # end for
+        return count, errors
+        # end def
+
+    def __prefetch(self, options: List[Tuple[str, str]],
+                   max_workers: int, chunk_size: int) -> PrefetchResult:
+        started = time.perf_counter()
+        count, errors = self.__decrypt_concurrently(
+            options, max_workers, chunk_size)
+        result = PrefetchResult(count, time.perf_counter() - started, errors)
+        logger = logging.getLogger(__name__)
+        logger.debug(
+            f'prefetched {result.count} options in {result.elapsed:.3f}s '
+            f'({len(result.errors)} errors)')
+        return result
+        # end def
+
+    def prefetch(self, options: Iterable[Tuple[str, str]] = None,
+                 max_workers: int = None,
+                 chunk_size: int = None) -> 'Future[PrefetchResult]':
+        # runs in the background; wrap with asyncio.wrap_future() to await
+        if options is None:
+            options = self.encrypted_options()
+            # end if
+        options = list(options)
+        max_workers = max_workers or self.PREFETCH_WORKERS
+        chunk_size = chunk_size or self.PREFETCH_CHUNK_SIZE
+
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+                # end if
+            try:
+                future.set_result(
+                    self.__prefetch(options, max_workers, chunk_size))
+            except BaseException as e:
+                future.set_exception(e)
+                # end try
+            # end def
+
+        threading.Thread(
+            target=run, name='cryptoconfigparser-prefetch',
+            daemon=True).start()
+        return future
+        # end def
+
+    def verify_all(self, options: Iterable[Tuple[str, str]] = None,
+                   max_workers: int = None, chunk_size: int = None
+                   ) -> Dict[Tuple[str, str], BaseException]:
+        # decrypts every encrypted option, concurrently and batched like
+        # prefetch(), and returns the ones that fail; nothing is cached,
+        # so a passing check leaves no plaintext behind
+        if options is None:
+            options = self.encrypted_options()
+            # end if
+        _, errors = self.__decrypt_concurrently(
+            list(options), max_workers or self.PREFETCH_WORKERS,
+            chunk_size or self.PREFETCH_CHUNK_SIZE, store=False)
+        return errors
+        # end def
+
+    def get_decrypt_cache_size(self) -> int:
+        # entries kept by the decrypt cache; 0 disables it
+        return self.getint(
+            self.SETTING_SECTION_KEY, self.DECRYPT_CACHE_SIZE_OPTION_KEY,
+            fallback=self.DECRYPT_CACHE_SIZE)
+        # end def
+
+    decrypt_cache_size = property(get_decrypt_cache_size)
+
+    def get_decrypt_cache_ttl(self) -> float:
+        # seconds a decrypted value is kept at most
+        return self.getfloat(
+            self.SETTING_SECTION_KEY, self.DECRYPT_CACHE_TTL_OPTION_KEY,
+            fallback=self.DECRYPT_CACHE_TTL)
+        # end def
+
+    decrypt_cache_ttl = property(get_decrypt_cache_ttl)
+
+    def clear_decrypt_cache(self):
+        with self.__cache_lock:
+            self.__decrypted = OrderedDict()
+            self.__deduplicated = OrderedDict()
+            self.__generation += 1
+            # end with
+        # end def
+
+    def _cache_generation(self) -> int:
+        # take it before decrypting and pass it to _cache_store()
+        return self.__generation
+        # end def
+
+    def __cache_get(self, cache: OrderedDict, key) -> tuple:
+        # caller holds the cache lock
+        cached = cache.get(key)
+        if cached is None:
+            return None
+        elif cached[-1] is not None and time.monotonic() >= cached[-1]:
+            del cache[key]
+            return None
+            # end if
+        cache.move_to_end(key)
+        return cached
+        # end def
+
+    def _cache_lookup(self, section: str, option: str, kind: str,
+                      raw: str) -> Tuple[bool, Any]:
+        # entries stay valid while the stored ciphertext is unchanged
+        # and neither the backend's cache_ttl() nor decrypt_cache_ttl has
+        # elapsed; the least recently used go beyond decrypt_cache_size
+        with self.__cache_lock:
+            cached = self.__cache_get(
+                self.__decrypted, (section, option, kind))
+            # end with
+        if cached is None or cached[0] != raw:
+            return False, None
+            # end if
+        return True, cached[1]
+        # end def
+
+    def __deduplicated_lookup(self, raw: str) -> str:
+        with self.__cache_lock:
+            cached = self.__cache_get(self.__deduplicated, raw)
+            # end with
+        return None if cached is None else cached[0]
+        # end def
+
+    def _cache_ttl(self, raw: str) -> float:
+        # seconds a value decrypted from raw may be cached, None for ever
+        scheme, _ = self.resolve_scheme(raw)
+        return self.get_provider(scheme).cache_ttl()
+        # end def
+
+    def _cache_store(self, section: str, option: str, kind: str,
+                     raw: str, value: Any, ttl=_UNSET,
+                     generation: int = None):
+        # ttl defaults to the backend's cache_ttl() for raw; a store for
+        # an older generation than the cache's is dropped
+        size = self.decrypt_cache_size
+        if size <= 0:
+            return
+            # end if
+        if ttl is _UNSET:
+            ttl = self._cache_ttl(raw)
+            # end if
+        # the same deterministic ciphertext under the same key reference
+        # is the same plaintext, wherever it appears
+        deduplicate = kind == 'str' and ttl is None \
+            and self.is_deterministic_value(raw)
+        ttl = self.decrypt_cache_ttl if ttl is None \
+            else min(ttl, self.decrypt_cache_ttl)
+        expires_at = time.monotonic() + ttl
+
+        with self.__cache_lock:
+            if generation is not None and generation != self.__generation:
+                return
+                # end if
+            self.__decrypted[(section, option, kind)] = (
+                raw, value, expires_at)
+            self.__decrypted.move_to_end((section, option, kind))
+            while len(self.__decrypted) > size:
+                self.__decrypted.popitem(last=False)
+                # end while
+            if deduplicate:
+                self.__deduplicated[raw] = (value, expires_at)
+                self.__deduplicated.move_to_end(raw)
+                while len(self.__deduplicated) > size:
+                    self.__deduplicated.popitem(last=False)
+                    # end while
+                # end if
+            # end with
+        # end def
+
+    def _decrypt_typed(self, section: str, option: str, kind: str,
+                       converter: Callable[[str], Any],
+                       fallback=_UNSET, plaintext: str = None) -> Any:
+        profiler = self.profiler
+        if profiler is None:
+            return self.__decrypt_typed(
+                section, option, kind, converter, fallback, plaintext)
+            # end if
+        with profiler.trace(section, option, kind) as trace:
+            return self.__decrypt_typed(
+                section, option, kind, converter, fallback, plaintext, trace)
+            # end with
+        # end def
+
+    def __decrypt_typed(self, section: str, option: str, kind: str,
+                        converter: Callable[[str], Any], fallback,
+                        plaintext: str, trace: TraceRecorder = None) -> Any:
+        try:
+            raw = self.get(section, option, raw=True)
+        except (NoSectionError, NoOptionError):
+            if fallback is _UNSET:
+                raise
+                # end if
+            return fallback
+            # end try
+        if trace is not None:
+            trace.backend = self.resolve_scheme(raw)[0]
+            trace.bytes_in = len(raw)
+            # end if
+
+        generation = self.__generation
+        hit, value = self._cache_lookup(section, option, kind, raw)
+        if not hit and plaintext is None and kind == 'str':
+            plaintext = self.__deduplicated_lookup(raw)
+            hit = plaintext is not None
+            if not hit:
+                plaintext = self.decrypt_value(raw, section, option)
+                # end if
+            value = converter(plaintext)
+            self._cache_store(section, option, kind, raw, value,
+                              generation=generation)
+        elif not hit:
+            if plaintext is None:
+                # untraced: the typed call is the one that is recorded
+                plaintext = self.__decrypt_typed(
+                    section, option, 'str', str, _UNSET, None)
+                # end if
+            value = converter(plaintext)
+            self._cache_store(section, option, kind, raw, value,
+                              generation=generation)
+            # end if
+
+        if trace is not None:
+            trace.cache_hit = hit
+            trace.bytes_out = len(plaintext) if plaintext is not None \
+                else len(str(value))
+            # end if
+        if kind not in self.IMMUTABLE_KINDS:
+            # the cached object is shared; callers get their own copy
+            value = copy.deepcopy(value)
+            # end if
+        return value
+        # end def
+
+    def decrypt_str(self, section: str, option: str, *,
+                    fallback=_UNSET) -> str:
+        return self._decrypt_typed(section, option, 'str', str, fallback)
+        # end def
+
+    def decrypt_int(self, section: str, option: str, *,
+                    fallback=_UNSET) -> int:
+        return self._decrypt_typed(section, option, 'int', int, fallback)
+        # end def
+
+    def decrypt_float(self, section: str, option: str, *,
+                      fallback=_UNSET) -> float:
+        return self._decrypt_typed(section, option, 'float', float, fallback)
+        # end def
+
+    def decrypt_bool(self, section: str, option: str, *,
+                     fallback=_UNSET) -> bool:
+        return self._decrypt_typed(
+            section, option, 'bool', self._convert_to_boolean, fallback)
+        # end def
+
+    def decrypt_json(self, section: str, option: str, *,
+                     fallback=_UNSET) -> Any:
+        return self._decrypt_typed(
+            section, option, 'json', json.loads, fallback)
+        # end def
+
+    def decrypt_bytes(self, section: str, option: str, *,
+                      fallback=_UNSET) -> bytes:
+        return self._decrypt_typed(
+            section, option, 'bytes',
+            lambda value: value.encode(self.encoding), fallback)
+        # end def
+
+    def __converter_for(self, annotation) -> Tuple[str, Callable[[str], Any]]:
+        origin = typing.get_origin(annotation)
+        if origin is typing.Union:
+            # Optional[X]
+            args = [arg for arg in typing.get_args(annotation)
+                    if arg is not type(None)]
+            if len(args) == 1:
+                return self.__converter_for(args[0])
+                # end if
+            # end if
+        if origin is not None:
+            annotation = origin
+            # end if
+
+        if annotation is bool:
+            return 'bool', self._convert_to_boolean
+        elif annotation is bytes:
+            return 'bytes', lambda value: value.encode(self.encoding)
+        elif annotation in (dict, list, Any):
+            return 'json', json.loads
+        elif annotation in (str, int, float):
+            return annotation.__name__, annotation
+            # end if
+        return f'{annotation.__module__}.{annotation.__qualname__}', annotation
+        # end def
+
+    def bind(self, schema: Type, section: str = None) -> Any:
+        # fields map to options of the same name in `section`;
+        # field(metadata={'section': ..., 'option': ..., 'encrypted': False})
+        # overrides that per field
+        if not dataclasses.is_dataclass(schema):
+            raise TypeError(f'{schema!r} is not a dataclass')
+            # end if
+
+        hints = typing.get_type_hints(schema)
+        targets = []
+        for field in dataclasses.fields(schema):
+            if not field.init:
+                continue
+                # end if
+            targets.append((
+                field,
+                field.metadata.get('section', section),
+                field.metadata.get('option', field.name),
+                field.metadata.get('encrypted', True)))
+            # end for
+
+        # decrypt every present encrypted option in one batched pass
+        plaintexts = {}
+        wanted = [(target_section, option)
+                  for _, target_section, option, encrypted in targets
+                  if encrypted and self.has_option(target_section, option)]
+        try:
+            plaintexts = self.decrypt_options(wanted)
+        except Exception:
+            # fall back to per-option decryption to attribute the failure
+            pass
+            # end try
+
+        values = {}
+        errors = []
+        for field, target_section, option, encrypted in targets:
+            has_default = any(
+                value is not dataclasses.MISSING
+                for value in (field.default, field.default_factory))
+            if not self.has_option(target_section, option):
+                if not has_default:
+                    errors.append(f'{target_section}.{option}: missing')
+                    # end if
+                continue
+                # end if
+
+            kind, converter = self.__converter_for(hints[field.name])
+            try:
+                if encrypted:
+                    values[field.name] = self._decrypt_typed(
+                        target_section, option, kind, converter,
+                        plaintext=plaintexts.get((target_section, option)))
+                else:
+                    values[field.name] = converter(
+                        self.get(target_section, option))
+                    # end if
+            except Exception as e:
+                # never echo the plaintext
+                errors.append(
+                    f'{target_section}.{option}: {type(e).__name__}')
+                # end try
+            # end for
+
+        if errors:
+            raise ValueError(
+                f'cannot bind {schema.__name__}: ' + ', '.join(errors))
+            # end if
+        return schema(**values)
+        # end def
 
 
 class AESCipher(object):
-    def __init__(self, key, block_size=32):
+
+    # MODE_CBC uses a random IV; MODE_SIV is deterministic, so an unchanged
+    # value re-encrypts to the same ciphertext; MODE_GCM is authenticated
+    # with a random nonce. SIV and GCM ciphertexts carry a "siv." / "gcm."
+    # prefix ("." is outside the base64 alphabet) and are detected on
+    # decrypt whatever mode the cipher was created with.
+
+    MODE_CBC = 'cbc'
+    MODE_SIV = 'siv'
+    MODE_GCM = 'gcm'
+    SIV_PREFIX = 'siv.'
+    GCM_PREFIX = 'gcm.'
+    GCM_NONCE_SIZE = 12
+    SIV_KEY_INFO = b'cryptoconfigparser siv'
+
+    # thousands of parsers may each hold one
+    __slots__ = ('_block_size', '__mode', '__siv_key', '__encoding', '__key',
+                 '__weakref__')
+
+    def __init__(self, key, block_size=32, mode: str = MODE_CBC):
+        if mode not in (self.MODE_CBC, self.MODE_SIV, self.MODE_GCM):
+            raise ValueError(f'unknown cipher mode: {mode}')
+            # end if
         self._block_size = block_size
+        self.__mode = mode
+        self.__siv_key = None
         self.__encoding = sys.getdefaultencoding()
-        if len(key) >= block_size:
-            self.__key = key[:block_size]
-            self.__key = self.__key.encode(self.__encoding)
+        # straight into a bytearray, without bytes copies, so that wipe()
+        # can zero the key in place
+        if isinstance(key, str):
+            key = bytearray(key[:block_size], self.__encoding)
+        else:
+            key = bytearray(memoryview(key)[:block_size])
+            # end if
+
+        size = len(key)
+        if size < block_size:
+            # PKCS#7 as Padding.pad, into a buffer of the final size; the
+            # short one is zeroed
+            self.__key = bytearray(block_size)
+            self.__key[:size] = key
+            self.__key[size:] = bytes((block_size - size,)) * (
+                block_size - size)
+            key[:] = bytes(size)
         else:
-            self.__key = Padding.pad(
-                key.encode(
-                    self.__encoding),
-                self._block_size)
+            self.__key = key
+            # end if
+        # end def
+
+    def get_mode(self) -> str:
+        return self.__mode
+        # end def
+
+    mode = property(get_mode)
+
+    @classmethod
+    def share(cls, cipher: 'AESCipher') -> 'AESCipher':
+        # the process-wide cipher for cipher's key and mode; a copy, so
+        # wiping the original does not affect it. Never wipe the result.
+        shared_key = (hmac.digest(_SHARED_SALT, bytes(cipher.__key),
+                                  hashlib.sha256),
+                      cipher._block_size, cipher.__mode)
+        with _SHARED_LOCK:
+            shared = _SHARED_CIPHERS.get(shared_key)
+            if shared is None:
+                shared = cls(bytes(cipher.__key), cipher._block_size,
+                             cipher.__mode)
+                _SHARED_CIPHERS[shared_key] = shared
+                # end if
+            # end with
+        return shared
+        # end def
+
+    @classmethod
+    def ciphertext_mode(cls, enc) -> str:
+        if isinstance(enc, (bytes, bytearray)):
+            enc = enc[:len(cls.SIV_PREFIX)].decode('ascii', 'replace')
+        elif not isinstance(enc, str):
+            return None
+            # end if
+        if enc.startswith(cls.SIV_PREFIX):
+            return cls.MODE_SIV
+        elif enc.startswith(cls.GCM_PREFIX):
+            return cls.MODE_GCM
+            # end if
+        return cls.MODE_CBC
+        # end def
+
+    @classmethod
+    def is_ciphertext(cls, enc: str) -> bool:
+        # shape check only: base64 (after the siv. / gcm. prefix) of at
+        # least one block plus the IV, tag or nonce and tag of the mode
+        mode = cls.ciphertext_mode(enc)
+        if mode is None:
+            return False
+        elif mode != cls.MODE_CBC:
+            enc = enc[len(cls.SIV_PREFIX):]
+            # end if
+        try:
+            size = len(base64.b64decode(enc, validate=True))
+        except (binascii.Error, ValueError):
+            return False
+            # end try
+        if mode == cls.MODE_SIV:
+            return size >= AES.block_size
+        elif mode == cls.MODE_GCM:
+            return size >= cls.GCM_NONCE_SIZE + AES.block_size
+            # end if
+        return size >= 2 * AES.block_size and size % AES.block_size == 0
+        # end def
+
+    @classmethod
+    def is_deterministic(cls, enc) -> bool:
+        return cls.ciphertext_mode(enc) == cls.MODE_SIV
+        # end def
+
+    def __get_siv_key(self) -> bytearray:
+        # separate subkey so CBC and SIV never share key material;
+        # 64 bytes selects AES-256-SIV
+        if self.__siv_key is None:
+            self.__siv_key = bytearray(HKDF(
+                self.__key, 64, b'', SHA256, context=self.SIV_KEY_INFO))
             # end if
+        return self.__siv_key
         # end def
 
-    def encrypt(self, raw):
+    def encrypt(self, raw, mode: str = None):
+        mode = mode or self.__mode
+        if mode == self.MODE_SIV:
+            cipher = AES.new(self.__get_siv_key(), AES.MODE_SIV)
+            body, tag = cipher.encrypt_and_digest(raw.encode(self.__encoding))
+            return self.SIV_PREFIX.encode() + base64.b64encode(tag + body)
+        elif mode == self.MODE_GCM:
+            cipher = AES.new(self.__key, AES.MODE_GCM,
+                             nonce=Random.get_random_bytes(
+                                 self.GCM_NONCE_SIZE))
+            body, tag = cipher.encrypt_and_digest(raw.encode(self.__encoding))
+            return self.GCM_PREFIX.encode() + base64.b64encode(
+                cipher.nonce + body + tag)
+        elif mode != self.MODE_CBC:
+            raise ValueError(f'unknown cipher mode: {mode}')
+            # end if
+
         iv = Random.get_random_bytes(AES.block_size)
         cipher = AES.new(self.__key, AES.MODE_CBC, iv)
         raw = Padding.pad(raw.encode(self.__encoding), self._block_size)
         return base64.b64encode(iv + cipher.encrypt(raw))
         # end def
 
-    def decrypt(self, enc):
+    def __decrypt_siv_into(self, enc, lock: bool) -> SecretBuffer:
+        enc = base64.b64decode(enc[len(self.SIV_PREFIX):])
+        tag = enc[:AES.block_size]
+        body = memoryview(enc)[AES.block_size:]
+        cipher = AES.new(self.__get_siv_key(), AES.MODE_SIV)
+
+        buffer = SecretBuffer(len(body), lock)
+        try:
+            cipher.decrypt_and_verify(body, tag, output=buffer.raw())
+        except BaseException:
+            buffer.wipe()
+            raise
+            # end try
+        return buffer
+        # end def
+
+    def __decrypt_gcm_into(self, enc, lock: bool) -> SecretBuffer:
+        enc = base64.b64decode(enc[len(self.GCM_PREFIX):])
+        nonce = enc[:self.GCM_NONCE_SIZE]
+        body = memoryview(enc)[self.GCM_NONCE_SIZE:-AES.block_size]
+        tag = enc[-AES.block_size:]
+        cipher = AES.new(self.__key, AES.MODE_GCM, nonce=nonce)
+
+        buffer = SecretBuffer(len(body), lock)
+        try:
+            cipher.decrypt_and_verify(body, tag, output=buffer.raw())
+        except BaseException:
+            buffer.wipe()
+            raise
+            # end try
+        return buffer
+        # end def
+
+    def decrypt_into(self, enc, lock: bool = False) -> SecretBuffer:
+        # decrypts straight into a wipeable buffer and unpads in place
+        mode = self.ciphertext_mode(enc)
+        if mode == self.MODE_SIV:
+            return self.__decrypt_siv_into(enc, lock)
+        elif mode == self.MODE_GCM:
+            return self.__decrypt_gcm_into(enc, lock)
+            # end if
+
         enc = base64.b64decode(enc)
         iv = enc[:AES.block_size]
+        body = memoryview(enc)[AES.block_size:]
         cipher = AES.new(self.__key, AES.MODE_CBC, iv)
-        data = Padding.unpad(cipher.decrypt(
-            enc[AES.block_size:]), self._block_size)
-        return data.decode(self.__encoding)
+
+        buffer = SecretBuffer(len(body), lock)
+        try:
+            cipher.decrypt(body, output=buffer.raw())
+            view = buffer.view()
+            padding_length = view[-1] if len(view) else 0
+            if padding_length < 1 or padding_length > min(
+                    self._block_size, len(view)) \
+                    or any(b != padding_length
+                           for b in view[-padding_length:]):
+                raise ValueError('Padding is incorrect.')
+                # end if
+            buffer.truncate(len(view) - padding_length)
+        except BaseException:
+            buffer.wipe()
+            raise
+            # end try
+        return buffer
+        # end def
+
+    def decrypt(self, enc):
+        with self.decrypt_into(enc) as buffer:
+            return buffer.decode(self.__encoding)
+            # end with
+        # end def
+
+    def wipe(self):
+        self.__key[:] = bytes(len(self.__key))
+        if self.__siv_key is not None:
+            self.__siv_key[:] = bytes(len(self.__siv_key))
+            # end if
         # end def
     # end class
@@ -0,0 +1,626 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import base64
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+
+import aws_encryption_sdk
+import boto3
+import botocore.session
+from aws_encryption_sdk import CommitmentPolicy
+from aws_encryption_sdk.structures import MessageHeader
+from botocore.exceptions import ClientError
+
+from .AESCryptoConfigParser import AESCipher
+from .KeyProvider import SCHEME_SEPARATOR, KeyProvider, register_provider
+from .SecretBuffer import SecretBuffer
+
+# BatchGetSecretValue accepts at most 20 ids per request
+SECRET_BATCH_SIZE = 20
+SECRET_FETCH_WORKERS = 8
+# GetParameters accepts at most 10 names per request
+PARAMETER_BATCH_SIZE = 10
+
+
+def fetch_secret_strings(client, secret_ids: Iterable[str]) -> Dict[str, str]:
+    secret_ids = list(dict.fromkeys(secret_ids))
+    results = {}
+    if len(secret_ids) == 0:
+        return results
+        # end if
+
+    if len(secret_ids) == 1:
+        response = client.get_secret_value(SecretId=secret_ids[0])
+        results[secret_ids[0]] = response.get('SecretString')
+    elif hasattr(client, 'batch_get_secret_value'):
+        for i in range(0, len(secret_ids), SECRET_BATCH_SIZE):
+            chunk = secret_ids[i:i + SECRET_BATCH_SIZE]
+            kwargs = {'SecretIdList': chunk}
+            while True:
+                response = client.batch_get_secret_value(**kwargs)
+                for error in response.get('Errors', []):
+                    raise ClientError(
+                        {'Error': {'Code': error.get('ErrorCode'),
+                                   'Message': error.get('Message')}},
+                        'BatchGetSecretValue')
+                    # end for
+                for value in response.get('SecretValues', []):
+                    # the caller may have asked by name or by arn
+                    if value.get('Name') in chunk:
+                        results[value['Name']] = value.get('SecretString')
+                        # end if
+                    if value.get('ARN') in chunk:
+                        results[value['ARN']] = value.get('SecretString')
+                        # end if
+                    # end for
+                if not response.get('NextToken'):
+                    break
+                    # end if
+                kwargs['NextToken'] = response['NextToken']
+                # end while
+            # end for
+    else:
+        # older botocore without BatchGetSecretValue
+        workers = min(len(secret_ids), SECRET_FETCH_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            responses = pool.map(
+                lambda secret_id: client.get_secret_value(
+                    SecretId=secret_id),
+                secret_ids)
+            for secret_id, response in zip(secret_ids, responses):
+                results[secret_id] = response.get('SecretString')
+                # end for
+            # end with
+        # end if
+    return results
+    # end def
+
+
+def _call_recorder(provider: KeyProvider):
+    # botocore before-call handler feeding the parser's profiler
+    def record(model=None, **kwargs):
+        if model is not None:
+            provider.record_call(
+                f'{model.service_model.service_name}.{model.name}')
+            # end if
+        # end def
+    return record
+    # end def
+
+
+class AWSKeyProvider(KeyProvider):
+
+    SERVICE_NAME = None
+
+    def __init__(self, parser):
+        super(AWSKeyProvider, self).__init__(parser)
+        self._client = None
+        # end def
+
+    def region_name(self) -> str:
+        return self.setting('region')
+        # end def
+
+    def get_client(self):
+        client = self._client
+        if client is None:
+            # boto3 sessions are not thread-safe to create concurrently
+            with self._lock:
+                if self._client is None:
+                    session = boto3.session.Session(
+                        profile_name=self.setting('profile'))
+                    self._client = session.client(
+                        service_name=self.SERVICE_NAME,
+                        region_name=self.region_name(),
+                    )
+                    self._client.meta.events.register(
+                        'before-call', _call_recorder(self))
+                    # end if
+                client = self._client
+                # end with
+            # end if
+        return client
+        # end def
+
+    def set_client(self, value):
+        self._client = value
+        # end def
+
+    client = property(get_client, set_client)
+
+    def reset(self):
+        self._client = None
+        # end def
+    # end class
+
+
+@register_provider('secretsmanager')
+class SecretsManagerKeyProvider(AWSKeyProvider):
+
+    # secretsmanager:<ciphertext> uses [settings] secret_name,
+    # secretsmanager:<alias or secret id>:<ciphertext> picks the secret
+
+    SERVICE_NAME = 'secretsmanager'
+    SECRET_KEY_FIELD = 'key'
+
+    def __init__(self, parser):
+        super(SecretsManagerKeyProvider, self).__init__(parser)
+        self.__ciphers = {}
+        # end def
+
+    @classmethod
+    def parse_secrets(cls, value: str) -> Dict[str, str]:
+        # "a, b=prod/team-b" -> {'a': 'a', 'b': 'prod/team-b'}
+        secrets = {}
+        for entry in value.split(','):
+            entry = entry.strip()
+            if len(entry) == 0:
+                continue
+                # end if
+            alias, sep, name = entry.partition('=')
+            if sep:
+                secrets[alias.strip()] = name.strip()
+            else:
+                secrets[entry] = entry
+                # end if
+            # end for
+        return secrets
+        # end def
+
+    def get_aliases(self) -> Dict[str, str]:
+        secrets = self.setting('secrets')
+        if secrets is None:
+            return {}
+        elif isinstance(secrets, str):
+            return self.parse_secrets(secrets)
+            # end if
+        return secrets
+        # end def
+
+    aliases = property(get_aliases)
+
+    @classmethod
+    def accepts(cls, payload: str) -> bool:
+        return AESCipher.is_ciphertext(payload.rpartition(SCHEME_SEPARATOR)[2])
+        # end def
+
+    def resolve(self, payload: str) -> Tuple[str, str]:
+        ref, sep, body = payload.rpartition(SCHEME_SEPARATOR)
+        if not sep:
+            ref = self.setting('secret_name')
+            # end if
+        if ref is None:
+            raise KeyError('no secret_name for unprefixed ciphertext')
+            # end if
+        return self.aliases.get(ref, ref), body
+        # end def
+
+    def load(self, secret_ids: Iterable[str] = None):
+        if secret_ids is None:
+            secret_ids = list(self.aliases.values())
+            if self.setting('secret_name'):
+                secret_ids.append(self.setting('secret_name'))
+                # end if
+            # end if
+
+        secret_ids = list(secret_ids)
+        if all(secret_id in self.__ciphers for secret_id in secret_ids):
+            return
+            # end if
+        with self._lock:
+            # whoever waited here finds the secrets already loaded
+            missing = [secret_id for secret_id in secret_ids
+                       if secret_id not in self.__ciphers]
+            secret_strings = fetch_secret_strings(self.client, missing)
+            for secret_id, secret_string in secret_strings.items():
+                # SecretBinary only, or no key field: get_cipher() raises
+                secret = json.loads(secret_string) if secret_string else {}
+                if self.SECRET_KEY_FIELD in secret:
+                    self.__ciphers[secret_id] = AESCipher(
+                        secret[self.SECRET_KEY_FIELD])
+                    # end if
+                # end for
+            # end with
+        # end def
+
+    def get_cipher(self, secret_id: str) -> AESCipher:
+        if secret_id not in self.__ciphers:
+            self.load([secret_id])
+            # end if
+        if secret_id not in self.__ciphers:
+            raise ValueError(
+                f'secret {secret_id} has no SecretString with a '
+                f'"{self.SECRET_KEY_FIELD}" field')
+            # end if
+        return self.__ciphers[secret_id]
+        # end def
+
+    def local_cipher(self, payload: str) -> AESCipher:
+        secret_id, _ = self.resolve(payload)
+        return self.get_cipher(secret_id)
+        # end def
+
+    def decrypt(self, payload: str,
+                section: str = None, option: str = None) -> str:
+        secret_id, body = self.resolve(payload)
+        return self.get_cipher(secret_id).decrypt(body)
+        # end def
+
+    def decrypt_secret(self, payload: str,
+                       section: str = None, option: str = None,
+                       lock: bool = False) -> SecretBuffer:
+        secret_id, body = self.resolve(payload)
+        return self.get_cipher(secret_id).decrypt_into(body, lock)
+        # end def
+
+    def decrypt_many(self,
+                     items: Iterable[Tuple[str, str, str]]) -> List[str]:
+        resolved = [self.resolve(payload) for payload, _, _ in items]
+        self.load([secret_id for secret_id, _ in resolved])
+        return [self.get_cipher(secret_id).decrypt(body)
+                for secret_id, body in resolved]
+        # end def
+
+    def reset(self):
+        super(SecretsManagerKeyProvider, self).reset()
+        self.__ciphers = {}
+        # end def
+    # end class
+
+
+@register_provider('ssm-param')
+class SSMParameterKeyProvider(AWSKeyProvider):
+
+    # ssm-param:<parameter name>, decrypted by Parameter Store itself.
+    # With [settings] ssm_param_path=/app/prod, "ssm-param:" in [db] password
+    # reads /app/prod/db/password and relative names are joined to the path;
+    # names under the path are loaded together by GetParametersByPath
+
+    SERVICE_NAME = 'ssm'
+    PATH_OPTION_KEY = 'ssm_param_path'
+    TTL_OPTION_KEY = 'ssm_param_ttl'
+    DEFAULT_TTL = 300.0
+    PATH_SEPARATOR = '/'
+
+    def __init__(self, parser):
+        super(SSMParameterKeyProvider, self).__init__(parser)
+        self.__values = {}
+        self.__paths = {}
+        # end def
+
+    def get_root_path(self) -> str:
+        root_path = self.setting(self.PATH_OPTION_KEY)
+        if root_path:
+            root_path = self.PATH_SEPARATOR + root_path.strip(
+                self.PATH_SEPARATOR)
+            # end if
+        return root_path
+        # end def
+
+    root_path = property(get_root_path)
+
+    def get_ttl(self) -> float:
+        return float(self.setting(self.TTL_OPTION_KEY, self.DEFAULT_TTL))
+        # end def
+
+    ttl = property(get_ttl)
+
+    def cache_ttl(self) -> float:
+        return self.ttl
+        # end def
+
+    def resolve(self, payload: str,
+                section: str = None, option: str = None) -> str:
+        if payload.startswith(self.PATH_SEPARATOR):
+            return payload
+            # end if
+
+        root_path = self.root_path
+        if not root_path:
+            return payload
+            # end if
+        if not payload:
+            payload = self.PATH_SEPARATOR.join([section, option])
+            # end if
+        return self.PATH_SEPARATOR.join([root_path, payload])
+        # end def
+
+    def in_root_path(self, name: str) -> bool:
+        root_path = self.root_path
+        return bool(root_path) and name.startswith(
+            root_path + self.PATH_SEPARATOR)
+        # end def
+
+    def __fresh(self, expires_at: float) -> bool:
+        return expires_at is not None and time.monotonic() < expires_at
+        # end def
+
+    def load_path(self, path: str):
+        # one paginated sweep over the whole tree
+        expires_at = time.monotonic() + self.ttl
+        paginator = self.client.get_paginator('get_parameters_by_path')
+        pages = paginator.paginate(
+            Path=path, Recursive=True, WithDecryption=True)
+        for page in pages:
+            for parameter in page.get('Parameters', []):
+                self.__values[parameter['Name']] = (
+                    parameter['Value'], expires_at)
+                # end for
+            # end for
+        self.__paths[path] = expires_at
+        # end def
+
+    def load(self, names: Iterable[str]):
+        names = list(dict.fromkeys(names))
+        if all(self.__fresh(self.__values.get(name, (None, None))[1])
+               for name in names):
+            return
+            # end if
+
+        with self._lock:
+            missing = []
+            for name in names:
+                if self.__fresh(self.__values.get(name, (None, None))[1]):
+                    continue
+                    # end if
+                if self.in_root_path(name):
+                    if not self.__fresh(self.__paths.get(self.root_path)):
+                        self.load_path(self.root_path)
+                        # end if
+                    continue
+                    # end if
+                missing.append(name)
+                # end for
+
+            expires_at = time.monotonic() + self.ttl
+            for i in range(0, len(missing), PARAMETER_BATCH_SIZE):
+                response = self.client.get_parameters(
+                    Names=missing[i:i + PARAMETER_BATCH_SIZE],
+                    WithDecryption=True)
+                for parameter in response.get('Parameters', []):
+                    self.__values[parameter['Name']] = (
+                        parameter['Value'], expires_at)
+                    # end for
+                # end for
+            # end with
+        # end def
+
+    def decrypt(self, payload: str,
+                section: str = None, option: str = None) -> str:
+        name = self.resolve(payload, section, option)
+        self.load([name])
+        if name not in self.__values:
+            raise KeyError(f'parameter not found: {name}')
+            # end if
+        return self.__values[name][0]
+        # end def
+
+    def decrypt_many(self,
+                     items: Iterable[Tuple[str, str, str]]) -> List[str]:
+        items = list(items)
+        self.load([self.resolve(payload, section, option)
+                   for payload, section, option in items])
+        return [self.decrypt(payload, section, option)
+                for payload, section, option in items]
+        # end def
+
+    def reset(self):
+        super(SSMParameterKeyProvider, self).reset()
+        self.__values = {}
+        self.__paths = {}
+        # end def
+    # end class
+
+
+@register_provider('kms')
+class KMSKeyProvider(KeyProvider):
+
+    # kms:<hex ciphertext> made by aws-encryption-sdk under [settings] key_id
+
+    def __init__(self, parser):
+        super(KMSKeyProvider, self).__init__(parser)
+        self.__client = None
+        self.__key_provider = None
+        self.__key_provider_id = None
+        # end def
+
+    def get_client(self):
+        with self._lock:
+            if self.__client is None:
+                policy = CommitmentPolicy.FORBID_ENCRYPT_ALLOW_DECRYPT
+                self.__client = aws_encryption_sdk.EncryptionSDKClient(
+                    commitment_policy=policy)
+                # end if
+            return self.__client
+            # end with
+        # end def
+
+    client = property(get_client)
+
+    def get_key_provider(self):
+        key_id = self.setting('key_id')
+        with self._lock:
+            if self.__key_provider is None \
+                    or self.__key_provider_id != key_id:
+                session = botocore.session.Session()
+                session.register('before-call', _call_recorder(self))
+                self.__key_provider = \
+                    aws_encryption_sdk.StrictAwsKmsMasterKeyProvider(
+                        key_ids=[key_id], botocore_session=session)
+                self.__key_provider_id = key_id
+                # end if
+            return self.__key_provider
+            # end with
+        # end def
+
+    key_provider = property(get_key_provider)
+
+    @classmethod
+    def accepts(cls, payload: str) -> bool:
+        # hex of an Encryption SDK message (format version 1 or 2)
+        try:
+            message = bytes.fromhex(payload)
+        except ValueError:
+            return False
+            # end try
+        return len(message) > 1 and message[0] in (1, 2)
+        # end def
+
+    def encrypt(self, text: str) -> Tuple[str, MessageHeader]:
+        my_ciphertext, encryptor_header = self.client.encrypt(
+            source=text,
+            key_provider=self.key_provider
+        )
+
+        return my_ciphertext.hex(), encryptor_header
+        # end def
+
+    def decrypt(self, payload: str,
+                section: str = None, option: str = None) -> str:
+        my_ciphertext = bytes.fromhex(payload)
+        decrypted, decryptor_header = self.client.decrypt(
+            source=my_ciphertext,
+            key_provider=self.key_provider
+        )
+        logger = logging.getLogger(__name__)
+        logger.debug(decryptor_header)
+
+        if isinstance(decrypted, bytes):
+            decrypted = decrypted.decode(self._parser.encoding)
+            # end if
+        return decrypted
+        # end def
+
+    def reset(self):
+        self.__client = None
+        self.__key_provider = None
+        self.__key_provider_id = None
+        # end def
+    # end class
+
+
+@register_provider('envelope')
+class EnvelopeKeyProvider(AWSKeyProvider):
+
+    # envelope:<gcm ciphertext> under the data key in [settings] data_key,
+    # a KMS CiphertextBlob (base64) wrapped by [settings] key_id. The data
+    # key is unwrapped with one KMS Decrypt call and every value is then
+    # decrypted locally with AES-GCM.
+
+    SERVICE_NAME = 'kms'
+    DATA_KEY_OPTION_KEY = 'data_key'
+    KEY_SPEC = 'AES_256'
+
+    def __init__(self, parser):
+        super(EnvelopeKeyProvider, self).__init__(parser)
+        self.__ciphers = {}
+        # end def
+
+    def region_name(self) -> str:
+        # a key arn names its region
+        region = self.setting('region')
+        key_id = self.setting('key_id')
+        if region is None and key_id and key_id.startswith('arn:'):
+            region = key_id.split(SCHEME_SEPARATOR)[3]
+            # end if
+        return region
+        # end def
+
+    def get_data_key(self) -> str:
+        data_key = self.setting(self.DATA_KEY_OPTION_KEY)
+        if not data_key:
+            raise KeyError('no data_key for envelope ciphertext')
+            # end if
+        return data_key
+        # end def
+
+    data_key = property(get_data_key)
+
+    def load(self, data_key: str, plaintext: bytes = None) -> AESCipher:
+        # plaintext, when the caller already holds it, saves the KMS call
+        cipher = self.__ciphers.get(data_key)
+        if cipher is not None:
+            return cipher
+            # end if
+        with self._lock:
+            if data_key not in self.__ciphers:
+                if plaintext is None:
+                    kwargs = {'CiphertextBlob': base64.b64decode(data_key)}
+                    if self.setting('key_id'):
+                        kwargs['KeyId'] = self.setting('key_id')
+                        # end if
+                    plaintext = self.client.decrypt(**kwargs)['Plaintext']
+                    # end if
+                self.__ciphers[data_key] = AESCipher(
+                    plaintext, mode=AESCipher.MODE_GCM)
+                # end if
+            return self.__ciphers[data_key]
+            # end with
+        # end def
+
+    @classmethod
+    def accepts(cls, payload: str) -> bool:
+        return AESCipher.ciphertext_mode(payload) == AESCipher.MODE_GCM \
+            and AESCipher.is_ciphertext(payload)
+        # end def
+
+    def get_cipher(self) -> AESCipher:
+        return self.load(self.data_key)
+        # end def
+
+    def local_cipher(self, payload: str) -> AESCipher:
+        return self.get_cipher()
+        # end def
+
+    def generate_data_key(self, key_id: str) -> Tuple[str, AESCipher]:
+        response = self.client.generate_data_key(
+            KeyId=key_id, KeySpec=self.KEY_SPEC)
+        data_key = base64.b64encode(response['CiphertextBlob']).decode()
+        return data_key, self.load(data_key, response['Plaintext'])
+        # end def
+
+    def rewrap(self, data_key: str, key_id: str) -> str:
+        # re-encrypts the data key under key_id inside KMS; values
+        # encrypted under it stay valid
+        kwargs = {'CiphertextBlob': base64.b64decode(data_key),
+                  'DestinationKeyId': key_id}
+        if self.setting('key_id'):
+            kwargs['SourceKeyId'] = self.setting('key_id')
+            # end if
+        response = self.client.re_encrypt(**kwargs)
+        rewrapped = base64.b64encode(response['CiphertextBlob']).decode()
+        if data_key in self.__ciphers:
+            self.__ciphers[rewrapped] = self.__ciphers[data_key]
+            # end if
+        return rewrapped
+        # end def
+
+    def encrypt(self, text: str) -> str:
+        encrypted = self.get_cipher().encrypt(text).decode()
+        return f'{self.SCHEME}:{encrypted}'
+        # end def
+
+    def decrypt(self, payload: str,
+                section: str = None, option: str = None) -> str:
+        return self.get_cipher().decrypt(payload)
+        # end def
+
+    def decrypt_secret(self, payload: str,
+                       section: str = None, option: str = None,
+                       lock: bool = False) -> SecretBuffer:
+        return self.get_cipher().decrypt_into(payload, lock)
+        # end def
+
+    def reset(self):
+        super(EnvelopeKeyProvider, self).reset()
+        self.__ciphers = {}
+        # end def
+    # end class
@@ -0,0 +1,153 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import fnmatch
+import os
+import sys
+import tempfile
+from configparser import RawConfigParser
+from typing import Any, Dict, Iterable, Iterator, Type
+
+from .AESCryptoConfigParser import AESCryptoConfigParser
+from .AWSKeyProvider import AWSKeyProvider
+from .KMSCryptoConfigParser import KMSCryptoConfigParser
+from .SSMCryptoConfigParser import SSMCryptoConfigParser
+
+# helpers for tools working over many config files
+
+PARSERS = {
+    'aes': AESCryptoConfigParser,
+    'ssm': SSMCryptoConfigParser,
+    'kms': KMSCryptoConfigParser,
+}
+CONFIG_PATTERNS = ('*.ini', '*.conf', '*.cfg')
+
+
+def detect_parser_class(config_path: str,
+                        encoding: str = None) -> Type[AESCryptoConfigParser]:
+    # [settings] secret_name / secrets -> ssm, key_id -> kms, else aes
+    config = RawConfigParser(interpolation=None)
+    config.read(config_path, encoding)
+    section = AESCryptoConfigParser.SETTING_SECTION_KEY
+    if config.has_option(section, 'secret_name') \
+            or config.has_option(section, 'secrets'):
+        return SSMCryptoConfigParser
+    elif config.has_option(section, 'key_id'):
+        return KMSCryptoConfigParser
+        # end if
+    return AESCryptoConfigParser
+    # end def
+
+
+def open_config(config_path: str, encoding: str = None,
+                parser: str = 'auto', lazy: bool = False,
+                profile: str = None, region: str = None,
+                legacy_bare: bool = False) -> AESCryptoConfigParser:
+    # RawConfigParser.read skips files it cannot open, which would pass a
+    # missing or unreadable file off as an empty config
+    with open(config_path, 'rb'):
+        pass
+        # end with
+    if parser == 'auto':
+        parser_class = detect_parser_class(config_path, encoding)
+    else:
+        parser_class = PARSERS[parser]
+        # end if
+    kwargs = {'encoding': encoding, 'lazy': lazy}
+    if issubclass(parser_class, SSMCryptoConfigParser):
+        kwargs['profile'] = profile
+        if region:
+            kwargs['region'] = region
+            # end if
+        # end if
+    config = parser_class(config_path, **kwargs)
+    if legacy_bare:
+        config.legacy_bare = True
+        # end if
+    return config
+    # end def
+
+
+def share_clients(parser: AESCryptoConfigParser, clients: Dict[tuple, Any],
+                  schemes: Iterable[str]):
+    # one boto3 client per (service, profile, region) for all the parsers
+    # of a run; the client keeps the call hook of the first parser
+    for scheme in schemes:
+        provider = parser.get_provider(scheme)
+        if not isinstance(provider, AWSKeyProvider):
+            continue
+            # end if
+        key = (provider.SERVICE_NAME, provider.setting('profile'),
+               provider.region_name())
+        if key in clients:
+            provider.client = clients[key]
+        else:
+            clients[key] = provider.client
+            # end if
+        # end for
+    # end def
+
+
+def error_name(error: BaseException) -> str:
+    # the type only; messages may quote values
+    error_type = type(error)
+    if error_type.__module__ == 'builtins':
+        return error_type.__qualname__
+        # end if
+    return f'{error_type.__module__}.{error_type.__qualname__}'
+    # end def
+
+
+def walk_configs(paths: Iterable[str],
+                 patterns: Iterable[str] = CONFIG_PATTERNS) -> Iterator[str]:
+    # files are yielded as given, directories are walked in sorted order
+    patterns = tuple(patterns)
+    for path in paths:
+        path = str(path)
+        if not os.path.isdir(path):
+            yield path
+            continue
+            # end if
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if any(fnmatch.fnmatch(name, pattern)
+                       for pattern in patterns):
+                    yield os.path.join(root, name)
+                    # end if
+                # end for
+            # end for
+        # end for
+    # end def
+
+
+def atomic_write(path: str, text: str, encoding: str = None):
+    # readers see the old file or the new one, never a partial write;
+    # the new file keeps the old one's permissions
+    directory = os.path.dirname(os.path.abspath(path))
+    mode = os.stat(path).st_mode if os.path.exists(path) else None
+    descriptor, temp_path = tempfile.mkstemp(
+        prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'w',
+                       encoding=encoding or sys.getdefaultencoding(),
+                       newline='') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+            # end with
+        if mode is not None:
+            os.chmod(temp_path, mode)
+            # end if
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+            # end if
+        raise
+        # end try
+    # end def
@@ -0,0 +1,292 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import sys
+import threading
+import weakref
+from configparser import NoOptionError, NoSectionError, RawConfigParser
+from typing import FrozenSet, List, Tuple
+
+from .AESCryptoConfigParser import AESCipher, AESCryptoConfigParser
+from .KeyProvider import SCHEME_SEPARATOR
+from .SecretBuffer import SecretBuffer
+
+_UNSET = object()
+# configs of the same shape (multi-tenant copies of one template) share
+# one layout
+_LAYOUTS = weakref.WeakValueDictionary()
+_LOCK = threading.Lock()
+
+
+class ConfigLayout(object):
+
+    # interned section and option names, each option's position in the
+    # values tuple of a FrozenCryptoConfig, and for encrypted options the
+    # index of their cipher
+
+    __slots__ = ('__sections', '__positions', '__ciphers', '__weakref__')
+
+    def __init__(self, sections: Tuple[Tuple[str, Tuple[str, ...]], ...],
+                 ciphers: Tuple[Tuple[int, int], ...]):
+        self.__sections = sections
+        self.__positions = {}
+        position = 0
+        for section, options in sections:
+            self.__positions[section] = {
+                option: position + i for i, option in enumerate(options)}
+            position += len(options)
+            # end for
+        self.__ciphers = dict(ciphers)
+        # end def
+
+    @classmethod
+    def shared(cls, sections: Tuple[Tuple[str, Tuple[str, ...]], ...],
+               ciphers: Tuple[Tuple[int, int], ...]) -> 'ConfigLayout':
+        sections = tuple(
+            (sys.intern(section),
+             tuple(sys.intern(option) for option in options))
+            for section, options in sections)
+        key = (sections, ciphers)
+        with _LOCK:
+            layout = _LAYOUTS.get(key)
+            if layout is None:
+                layout = cls(sections, ciphers)
+                _LAYOUTS[key] = layout
+                # end if
+            # end with
+        return layout
+        # end def
+
+    def sections(self) -> List[str]:
+        return [section for section, _ in self.__sections]
+        # end def
+
+    def options(self, section: str) -> List[str]:
+        if section not in self.__positions:
+            raise NoSectionError(section)
+            # end if
+        return list(self.__positions[section])
+        # end def
+
+    def position(self, section: str, option: str) -> int:
+        if section not in self.__positions:
+            raise NoSectionError(section)
+        elif option not in self.__positions[section]:
+            raise NoOptionError(option, section)
+            # end if
+        return self.__positions[section][option]
+        # end def
+
+    def cipher_index(self, position: int) -> int:
+        # None for options that are not encrypted
+        return self.__ciphers.get(position)
+        # end def
+
+    def get_encrypted_positions(self) -> FrozenSet[int]:
+        return frozenset(self.__ciphers)
+        # end def
+
+    encrypted_positions = property(get_encrypted_positions)
+    # end class
+
+
+class FrozenCryptoConfig(object):
+
+    # compact read-only snapshot of a parser: one shared ConfigLayout,
+    # one tuple of raw values (plain values interned) and the shared
+    # ciphers of its encrypted options, looked up when the snapshot is
+    # taken. It holds no providers, clients, caches or plaintexts, and
+    # does not interpolate. Values of backends that decrypt remotely
+    # value by value (kms, ssm-param) cannot be frozen.
+
+    __slots__ = ('__layout', '__values', '__ciphers', '__optionxform')
+
+    def __init__(self, parser: AESCryptoConfigParser):
+        encrypted = set(parser.encrypted_options())
+        sections = []
+        values = []
+        ciphers = []
+        indexes = {}
+        cipher_indexes = []
+        remote = []
+        for section in parser.sections():
+            options = parser.options(section)
+            sections.append((section, tuple(options)))
+            for option in options:
+                raw = parser.get(section, option, raw=True)
+                if (section, option) not in encrypted:
+                    values.append(sys.intern(raw))
+                    continue
+                    # end if
+                scheme, payload = parser.resolve_scheme(raw)
+                cipher = parser.get_provider(scheme).local_cipher(payload)
+                if cipher is None:
+                    remote.append(f'{section}.{option}')
+                    continue
+                    # end if
+                # shared ciphers are unique per key, so identity is enough
+                cipher = AESCipher.share(cipher)
+                index = indexes.setdefault(id(cipher), len(ciphers))
+                if index == len(ciphers):
+                    ciphers.append(cipher)
+                    # end if
+                cipher_indexes.append((len(values), index))
+                values.append(raw)
+                # end for
+            # end for
+        if remote:
+            raise ValueError(
+                f'remotely decrypted values cannot be frozen: '
+                f'{", ".join(remote)}')
+            # end if
+
+        self.__layout = ConfigLayout.shared(
+            tuple(sections), tuple(cipher_indexes))
+        self.__values = tuple(values)
+        self.__ciphers = tuple(ciphers)
+        optionxform = parser.optionxform
+        if getattr(optionxform, '__func__', None) \
+                is RawConfigParser.optionxform:
+            # the default; the bound method would keep the parser alive
+            optionxform = str.lower
+            # end if
+        self.__optionxform = optionxform
+        # end def
+
+    def get_layout(self) -> ConfigLayout:
+        return self.__layout
+        # end def
+
+    layout = property(get_layout)
+
+    def get_ciphers(self) -> Tuple[AESCipher, ...]:
+        return self.__ciphers
+        # end def
+
+    ciphers = property(get_ciphers)
+
+    def sections(self) -> List[str]:
+        return self.__layout.sections()
+        # end def
+
+    def has_section(self, section: str) -> bool:
+        return section in self.__layout.sections()
+        # end def
+
+    def options(self, section: str) -> List[str]:
+        return self.__layout.options(section)
+        # end def
+
+    def has_option(self, section: str, option: str) -> bool:
+        try:
+            self.__layout.position(section, self.__optionxform(option))
+        except (NoSectionError, NoOptionError):
+            return False
+            # end try
+        return True
+        # end def
+
+    def get(self, section: str, option: str, *, fallback=_UNSET) -> str:
+        # the raw value, ciphertexts included
+        try:
+            position = self.__layout.position(
+                section, self.__optionxform(option))
+        except (NoSectionError, NoOptionError):
+            if fallback is _UNSET:
+                raise
+                # end if
+            return fallback
+            # end try
+        return self.__values[position]
+        # end def
+
+    def items(self, section: str) -> List[Tuple[str, str]]:
+        return [(option, self.get(section, option))
+                for option in self.options(section)]
+        # end def
+
+    def is_encrypted(self, section: str, option: str) -> bool:
+        try:
+            position = self.__layout.position(
+                section, self.__optionxform(option))
+        except (NoSectionError, NoOptionError):
+            return False
+            # end try
+        return self.__layout.cipher_index(position) is not None
+        # end def
+
+    def encrypted_options(self) -> List[Tuple[str, str]]:
+        return [(section, option) for section in self.sections()
+                for option in self.options(section)
+                if self.is_encrypted(section, option)]
+        # end def
+
+    def __locate(self, section: str, option: str) -> Tuple[AESCipher, str]:
+        position = self.__layout.position(section, self.__optionxform(option))
+        index = self.__layout.cipher_index(position)
+        if index is None:
+            raise ValueError(f'{section}.{option} is not encrypted')
+            # end if
+        body = self.__values[position].rpartition(SCHEME_SEPARATOR)[2]
+        return self.__ciphers[index], body
+        # end def
+
+    def decrypt(self, section: str, option: str, *, fallback=_UNSET) -> str:
+        # nothing is cached; a snapshot keeps no plaintext
+        try:
+            cipher, body = self.__locate(section, option)
+        except (NoSectionError, NoOptionError):
+            if fallback is _UNSET:
+                raise
+                # end if
+            return fallback
+            # end try
+        return cipher.decrypt(body)
+        # end def
+
+    def decrypt_int(self, section: str, option: str, *,
+                    fallback=_UNSET) -> int:
+        value = self.decrypt(section, option, fallback=fallback)
+        return value if value is fallback else int(value)
+        # end def
+
+    def decrypt_float(self, section: str, option: str, *,
+                      fallback=_UNSET) -> float:
+        value = self.decrypt(section, option, fallback=fallback)
+        return value if value is fallback else float(value)
+        # end def
+
+    def decrypt_bool(self, section: str, option: str, *,
+                     fallback=_UNSET) -> bool:
+        value = self.decrypt(section, option, fallback=fallback)
+        if value is fallback:
+            return value
+        elif value.lower() not in RawConfigParser.BOOLEAN_STATES:
+            raise ValueError(f'Not a boolean: {value}')
+            # end if
+        return RawConfigParser.BOOLEAN_STATES[value.lower()]
+        # end def
+
+    def decrypt_secret(self, section: str, option: str, lock: bool = False,
+                       *, fallback=_UNSET) -> SecretBuffer:
+        try:
+            cipher, body = self.__locate(section, option)
+        except (NoSectionError, NoOptionError):
+            if fallback is _UNSET:
+                raise
+                # end if
+            return fallback
+            # end try
+        return cipher.decrypt_into(body, lock)
+        # end def
+
+    def __repr__(self) -> str:
+        # never the values
+        return (f'<FrozenCryptoConfig {len(self.sections())} sections, '
+                f'{len(self.__values)} options>')
+        # end def
+    # end class
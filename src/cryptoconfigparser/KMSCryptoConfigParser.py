@@ -5,35 +5,38 @@
 # __version__ = '0.9.0'
 # ---------------------------------------------------------------------------
 
-import logging
 from typing import Tuple
 
-import aws_encryption_sdk
-from aws_encryption_sdk import CommitmentPolicy
 from aws_encryption_sdk.structures import MessageHeader
 
-from . import AESCryptoConfigParser
+from .AESCryptoConfigParser import AESCipher, AESCryptoConfigParser
+from .AWSKeyProvider import EnvelopeKeyProvider, KMSKeyProvider
 
 
 class KMSCryptoConfigParser(AESCryptoConfigParser):
 
     SETTING_SECTION_KEY = 'settings'
     KMS_KEY_ID_OPTION_KEY = 'key_id'
+    DATA_KEY_OPTION_KEY = EnvelopeKeyProvider.DATA_KEY_OPTION_KEY
 
     def __init__(self,
                  config_path: str = None,
-                 encoding: str = None):
-        super(KMSCryptoConfigParser, self).__init__(config_path, encoding)
-
+                 encoding: str = None,
+                 lazy: bool = False):
         self.__key_id = None
 
-        if config_path:
-            if self.has_option(self.SETTING_SECTION_KEY,
-                               self.KMS_KEY_ID_OPTION_KEY):
-                # load key_id
-                self.__key_id = self.get(
-                    self.SETTING_SECTION_KEY, self.KMS_KEY_ID_OPTION_KEY)
-                # end if
+        super(KMSCryptoConfigParser, self).__init__(
+            config_path, encoding, lazy)
+        # end def
+
+    def apply_settings(self):
+        super(KMSCryptoConfigParser, self).apply_settings()
+
+        if self.has_option(self.SETTING_SECTION_KEY,
+                           self.KMS_KEY_ID_OPTION_KEY):
+            # load key_id
+            self.__key_id = self.get(
+                self.SETTING_SECTION_KEY, self.KMS_KEY_ID_OPTION_KEY)
             # end if
         # end def
 
@@ -43,51 +46,74 @@ class KMSCryptoConfigParser(AESCryptoConfigParser):
 
     def set_key_id(self, value: str):
         self.__key_id = value
+        self.clear_decrypt_cache()
         # end def
 
     key_id = property(get_key_id, set_key_id)
 
-    def encrypt(self, text: str) -> Tuple[str, MessageHeader]:
-        client = aws_encryption_sdk.EncryptionSDKClient(
-            commitment_policy=CommitmentPolicy.FORBID_ENCRYPT_ALLOW_DECRYPT)
+    def get_data_key(self) -> str:
+        return self.get(self.SETTING_SECTION_KEY, self.DATA_KEY_OPTION_KEY,
+                        fallback=None)
+        # end def
 
-        kms_key_provider = aws_encryption_sdk.StrictAwsKmsMasterKeyProvider(key_ids=[
-            self.__key_id
-        ])
+    def set_data_key(self, value: str):
+        if not self.has_section(self.SETTING_SECTION_KEY):
+            self.add_section(self.SETTING_SECTION_KEY)
+            # end if
+        self.set(self.SETTING_SECTION_KEY, self.DATA_KEY_OPTION_KEY, value)
+        self.clear_decrypt_cache()
+        # end def
 
-        my_ciphertext, encryptor_header = client.encrypt(
-            source=text,
-            key_provider=kms_key_provider
-        )
+    data_key = property(get_data_key, set_data_key)
 
-        return my_ciphertext.hex(), encryptor_header
+    def __store_key_id(self, key_id: str):
+        if not self.has_section(self.SETTING_SECTION_KEY):
+            self.add_section(self.SETTING_SECTION_KEY)
+            # end if
+        self.set(self.SETTING_SECTION_KEY, self.KMS_KEY_ID_OPTION_KEY, key_id)
+        self.key_id = key_id
         # end def
 
-    def decrypt(self, section: str, option: str) -> str:
+    def encrypt(self, text: str) -> Tuple[str, MessageHeader]:
+        return self.get_provider(KMSKeyProvider.SCHEME).encrypt(text)
+        # end def
 
-        decrypted = None
+    def generate_data_key(self, key_id: str = None) -> str:
+        # new envelope data key under key_id, stored in [settings] data_key
+        if key_id is not None:
+            self.__store_key_id(key_id)
+            # end if
         if self.__key_id is None:
-            decrypted = super(
-                KMSCryptoConfigParser,
-                self).decrypt(
-                section,
-                option)
-        else:
-            raw = self.get(section, option)
-            my_ciphertext = bytes.fromhex(raw)
-            client = aws_encryption_sdk.EncryptionSDKClient(
-                commitment_policy=CommitmentPolicy.FORBID_ENCRYPT_ALLOW_DECRYPT)
-
-            kms_key_provider = aws_encryption_sdk.StrictAwsKmsMasterKeyProvider(key_ids=[
-                self.__key_id
-            ])
-            decrypted, decryptor_header = client.decrypt(
-                source=my_ciphertext,
-                key_provider=kms_key_provider
-            )
-            logger = logging.getLogger(__name__)
-            logger.debug(decryptor_header)
+            raise ValueError('key_id is required to generate a data key')
+            # end if
+        data_key, _ = self.get_provider(
+            EnvelopeKeyProvider.SCHEME).generate_data_key(self.__key_id)
+        self.data_key = data_key
+        return data_key
+        # end def
+
+    def encrypt_envelope(self, text: str) -> str:
+        # local AES-GCM under the data key, no KMS call per value
+        return self.get_provider(EnvelopeKeyProvider.SCHEME).encrypt(text)
+        # end def
+
+    def rewrap_data_key(self, key_id: str) -> str:
+        # key rotation: only [settings] data_key and key_id change,
+        # the values stay as they are
+        rewrapped = self.get_provider(EnvelopeKeyProvider.SCHEME).rewrap(
+            self.data_key, key_id)
+        self.__store_key_id(key_id)
+        self.data_key = rewrapped
+        return rewrapped
+        # end def
+
+    def default_scheme(self, value: str) -> str:
+        if self.data_key is not None \
+                and AESCipher.ciphertext_mode(value) == AESCipher.MODE_GCM:
+            return EnvelopeKeyProvider.SCHEME
+        elif self.__key_id is None:
+            return super(KMSCryptoConfigParser, self).default_scheme(value)
             # end if
-        return decrypted
+        return KMSKeyProvider.SCHEME
         # end def
     # end class
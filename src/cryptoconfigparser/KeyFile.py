@@ -0,0 +1,156 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import base64
+import codecs
+import os
+import stat
+import sys
+import threading
+import warnings
+from typing import Any, Callable, Dict, Tuple
+
+# text: first line, decoded (the original format)
+# binary: the raw bytes of the file
+# base64: first line, base64 decoded
+KEY_FORMAT_TEXT = 'text'
+KEY_FORMAT_BINARY = 'binary'
+KEY_FORMAT_BASE64 = 'base64'
+KEY_FORMATS = (KEY_FORMAT_TEXT, KEY_FORMAT_BINARY, KEY_FORMAT_BASE64)
+
+# (path, format, encoding) -> ((inode, mtime, size, mode), key bytearray)
+_CACHE: Dict[tuple, Tuple[tuple, bytearray]] = {}
+_CHECKED = set()
+# one lock per cache key so that only one caller reads a cold key file
+_LOADING: Dict[tuple, threading.Lock] = {}
+_LOCK = threading.Lock()
+
+
+class InsecureKeyFileWarning(UserWarning):
+    pass
+    # end class
+
+
+def read_key(path: str, key_format: str = KEY_FORMAT_TEXT,
+             encoding: str = None):
+    if key_format not in KEY_FORMATS:
+        raise ValueError(f'unknown key format: {key_format}')
+        # end if
+    with open(path, 'rb') as file:
+        data = file.read()
+        # end with
+
+    if key_format == KEY_FORMAT_BINARY:
+        return data
+        # end if
+    lines = codecs.decode(
+        data, encoding or sys.getdefaultencoding()).splitlines()
+    line = lines[0].strip() if lines else ''
+    if key_format == KEY_FORMAT_BASE64:
+        return base64.b64decode(line, validate=True)
+        # end if
+    return line
+    # end def
+
+
+def check_permissions(path: str, status: os.stat_result = None) -> bool:
+    # warns once per file and mode when group or others can access the key
+    if sys.platform == 'win32':
+        return True
+        # end if
+    status = status or os.stat(path)
+    checked = (path, status.st_ino, status.st_mode)
+    secure = not status.st_mode & (stat.S_IRWXG | stat.S_IRWXO)
+    with _LOCK:
+        if checked in _CHECKED:
+            return secure
+            # end if
+        _CHECKED.add(checked)
+        # end with
+    if not secure:
+        warnings.warn(
+            f'key file {path} is accessible by group or others '
+            f'(mode {stat.S_IMODE(status.st_mode):o}); chmod 600 it',
+            InsecureKeyFileWarning, stacklevel=3)
+        # end if
+    return secure
+    # end def
+
+
+def _key_buffer(data) -> bytearray:
+    # text keys are encoded as AESCipher encodes str keys
+    if isinstance(data, str):
+        return bytearray(data, sys.getdefaultencoding())
+        # end if
+    return bytearray(data)
+    # end def
+
+
+def _wipe(data: bytearray):
+    data[:] = bytes(len(data))
+    # end def
+
+
+def load_cipher(path: str, cipher_class: Callable[[Any], Any],
+                key_format: str = KEY_FORMAT_TEXT, encoding: str = None,
+                on_read: Callable[[], None] = None):
+    # the key is read once per file and process and reused while the file
+    # keeps its inode, mtime and size, so a repeated load costs one stat
+    # call. Every caller gets its own cipher, so wiping it leaves the
+    # other parsers and later loads intact. The cached key is a bytearray
+    # that is zeroed when the file changes and by clear_key_cache().
+    path = os.path.abspath(path)
+    status = os.stat(path)
+    check_permissions(path, status)
+    version = (status.st_ino, status.st_mtime_ns, status.st_size,
+               status.st_mode)
+    key = (path, key_format, encoding)
+    with _LOCK:
+        # ciphers are built under the lock, so a concurrent clear cannot
+        # zero the key while it is copied
+        cached = _CACHE.get(key)
+        if cached is not None and cached[0] == version:
+            return cipher_class(cached[1])
+            # end if
+        loading = _LOADING.setdefault(key, threading.Lock())
+        # end with
+
+    with loading:
+        with _LOCK:
+            cached = _CACHE.get(key)
+            if cached is not None and cached[0] == version:
+                return cipher_class(cached[1])
+                # end if
+            # end with
+
+        if on_read is not None:
+            on_read()
+            # end if
+        data = _key_buffer(read_key(path, key_format, encoding))
+        with _LOCK:
+            stale = _CACHE.get(key)
+            _CACHE[key] = (version, data)
+            if stale is not None:
+                _wipe(stale[1])
+                # end if
+            cipher = cipher_class(data)
+            # end with
+        # end with
+    return cipher
+    # end def
+
+
+def clear_key_cache():
+    with _LOCK:
+        for _, data in _CACHE.values():
+            _wipe(data)
+            # end for
+        _CACHE.clear()
+        _CHECKED.clear()
+        _LOADING.clear()
+        # end with
+    # end def
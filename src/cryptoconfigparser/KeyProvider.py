@@ -0,0 +1,154 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import threading
+from typing import Dict, Iterable, List, Tuple, Type
+
+from .SecretBuffer import SecretBuffer
+
+SCHEME_SEPARATOR = ':'
+
+_PROVIDERS: Dict[str, Type['KeyProvider']] = {}
+
+
+class KeyProvider(object):
+
+    SETTING_SECTION_KEY = 'settings'
+    SCHEME = None
+    # parser properties that setting() reads before [settings]
+    PARSER_SETTINGS = ('region', 'profile', 'secret_name', 'secrets',
+                       'key_id', 'data_key')
+
+    def __init__(self, parser):
+        self._parser = parser
+        # guards lazy loads so that concurrent first calls load once
+        self._lock = threading.RLock()
+        # end def
+
+    def get_parser(self):
+        return self._parser
+        # end def
+
+    parser = property(get_parser)
+
+    def setting(self, name: str, fallback=None):
+        # parser properties listed in PARSER_SETTINGS (e.g.
+        # SSMCryptoConfigParser.region) win over the [settings] section;
+        # other attributes and methods of the parser are never read
+        value = None
+        if name in self.PARSER_SETTINGS:
+            value = getattr(self._parser, name, None)
+            if callable(value):
+                value = None
+                # end if
+            # end if
+        if value is None and self._parser.has_option(
+                self.SETTING_SECTION_KEY, name):
+            value = self._parser.get(self.SETTING_SECTION_KEY, name)
+            # end if
+        if value is None:
+            value = fallback
+            # end if
+        return value
+        # end def
+
+    def decrypt(self, payload: str,
+                section: str = None, option: str = None) -> str:
+        raise NotImplementedError()
+        # end def
+
+    @classmethod
+    def accepts(cls, payload: str) -> bool:
+        # whether payload looks like a value of this backend; used to tell
+        # encrypted values from plain ones, never to decrypt
+        return True
+        # end def
+
+    def local_cipher(self, payload: str):
+        # the AESCipher that decrypts payload in-process (the ciphertext is
+        # the part after the last ":"), None for backends that decrypt
+        # remotely value by value
+        return None
+        # end def
+
+    def decrypt_secret(self, payload: str,
+                       section: str = None, option: str = None,
+                       lock: bool = False) -> SecretBuffer:
+        # backends that decrypt locally override this to skip the str copy
+        return SecretBuffer.from_str(
+            self.decrypt(payload, section, option),
+            self._parser.encoding, lock)
+        # end def
+
+    def decrypt_many(self,
+                     items: Iterable[Tuple[str, str, str]]) -> List[str]:
+        # items are (payload, section, option); backends that can batch
+        # remote calls override this
+        return [self.decrypt(payload, section, option)
+                for payload, section, option in items]
+        # end def
+
+    def record_call(self, operation: str):
+        # report a remote call or key read, e.g. "kms.Decrypt", to the
+        # parser's profiler
+        self._parser._profile_call(operation)
+        # end def
+
+    def cache_ttl(self) -> float:
+        # seconds a parser may keep plaintexts from this backend,
+        # None for as long as the ciphertext is unchanged
+        return None
+        # end def
+
+    def reset(self):
+        pass
+        # end def
+    # end class
+
+
+def register_provider(scheme: str, provider_class: Type[KeyProvider] = None):
+    def register(cls: Type[KeyProvider]) -> Type[KeyProvider]:
+        if SCHEME_SEPARATOR in scheme:
+            raise ValueError(f'invalid scheme: {scheme}')
+            # end if
+        cls.SCHEME = scheme
+        _PROVIDERS[scheme] = cls
+        return cls
+        # end def
+
+    if provider_class is not None:
+        return register(provider_class)
+        # end if
+    return register
+    # end def
+
+
+def unregister_provider(scheme: str):
+    _PROVIDERS.pop(scheme, None)
+    # end def
+
+
+def get_provider_class(scheme: str) -> Type[KeyProvider]:
+    if scheme not in _PROVIDERS:
+        raise KeyError(f'unknown key provider: {scheme}')
+        # end if
+    return _PROVIDERS[scheme]
+    # end def
+
+
+def provider_schemes() -> List[str]:
+    return list(_PROVIDERS.keys())
+    # end def
+
+
+def split_scheme(value: str) -> Tuple[str, str]:
+    scheme, sep, payload = value.partition(SCHEME_SEPARATOR)
+    if sep and scheme in _PROVIDERS:
+        return scheme, payload
+        # end if
+    return None, value
+    # end def
@@ -0,0 +1,282 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import codecs
+import mmap
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from configparser import (DuplicateSectionError, RawConfigParser,
+                          SectionProxy)
+from typing import Dict, Iterator, List, Tuple
+
+# candidate header lines start with "[" in the first column; the parser's
+# SECTCRE decides, after inline comments are stripped as configparser does
+HEADER_RE = re.compile(rb'^\[[^\n]*', re.MULTILINE)
+
+
+class SectionIndex(MutableMapping):
+
+    # stands in for RawConfigParser._sections: one pass records the byte
+    # span of every section, sections are parsed on first access and kept
+    # in a bounded LRU. Sections changed in memory, or touched by a read_*
+    # call, are pinned so that eviction never drops them. The file must be
+    # replaced, not rewritten in place, while the index is in use. Only
+    # encodings that write "[" and newlines as single ASCII bytes are
+    # supported (see supports()).
+
+    def __init__(self, parser: RawConfigParser, path: str,
+                 encoding: str, cache_size: int = 128):
+        self.__parser = parser
+        self.__path = path
+        self.__encoding = encoding
+        self.__cache_size = cache_size
+        self.__spans: Dict[str, List[Tuple[int, int]]] = {}
+        self.__cache = OrderedDict()
+        self.__pinned = {}
+        self.__lock = threading.RLock()
+        self.__pin_reads = 0
+        self.__data = b''
+
+        with open(path, 'rb') as file:
+            try:
+                self.__data = mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                pass
+                # end try
+            # end with
+        self.__build()
+        # end def
+
+    @staticmethod
+    def supports(encoding: str) -> bool:
+        # utf-16 and the like need the eager parser
+        name = codecs.lookup(encoding).name
+        return name == 'utf-8-sig' or '[\n'.encode(name) == b'[\n'
+        # end def
+
+    def __header(self, line: bytes) -> str:
+        # the section name as RawConfigParser._read would see it, or None
+        value = line.decode(self.__encoding)
+        if value.strip().startswith(tuple(self.__parser._comment_prefixes)):
+            return None
+            # end if
+        comment_start = len(value)
+        for prefix in self.__parser._inline_comment_prefixes:
+            index = value.find(prefix)
+            while index > 0 and not value[index - 1].isspace():
+                index = value.find(prefix, index + 1)
+                # end while
+            if index != -1:
+                comment_start = min(comment_start, index)
+                # end if
+            # end for
+        match = self.__parser.SECTCRE.match(value[:comment_start].strip())
+        return match.group('header') if match else None
+        # end def
+
+    def __build(self):
+        data = self.__data
+        starts = [match.start() for match in HEADER_RE.finditer(data)]
+        if data[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8 \
+                and codecs.lookup(self.__encoding).name == 'utf-8-sig' \
+                and data[len(codecs.BOM_UTF8):][:1] == b'[':
+            # the header on the first line, after the BOM
+            starts.insert(0, len(codecs.BOM_UTF8))
+            # end if
+
+        headers = []
+        for start in starts:
+            end = data.find(b'\n', start)
+            name = self.__header(data[start:end if end != -1 else len(data)])
+            if name is not None:
+                headers.append((name, start))
+                # end if
+            # end for
+        for i, (name, start) in enumerate(headers):
+            end = len(data)
+            if i + 1 < len(headers):
+                end = headers[i + 1][1]
+                # end if
+            if name in self.__spans and self.__parser._strict:
+                raise DuplicateSectionError(name, self.__path)
+                # end if
+            self.__spans.setdefault(name, []).append((start, end))
+            # end for
+        # end def
+
+    def get_path(self) -> str:
+        return self.__path
+        # end def
+
+    path = property(get_path)
+
+    def get_cached_count(self) -> int:
+        return len(self.__cache)
+        # end def
+
+    cached_count = property(get_cached_count)
+
+    def __scratch(self) -> RawConfigParser:
+        parser = self.__parser
+        scratch = RawConfigParser(
+            allow_no_value=parser._allow_no_value,
+            delimiters=parser._delimiters,
+            comment_prefixes=parser._comment_prefixes,
+            inline_comment_prefixes=parser._inline_comment_prefixes,
+            strict=parser._strict,
+            empty_lines_in_values=parser._empty_lines_in_values,
+            default_section=parser.default_section)
+        scratch.optionxform = parser.optionxform
+        return scratch
+        # end def
+
+    def parse(self, name: str) -> dict:
+        text = ''.join(
+            self.__data[start:end].decode(self.__encoding)
+            for start, end in self.__spans[name])
+        scratch = self.__scratch()
+        scratch.read_string(text, self.__path)
+        if name == self.__parser.default_section:
+            return dict(scratch._defaults)
+            # end if
+        return scratch._sections[name]
+        # end def
+
+    def pin(self, name: str):
+        with self.__lock:
+            if name in self.__pinned or name not in self:
+                return
+                # end if
+            self.__pinned[name] = self[name]
+            self.__cache.pop(name, None)
+            # end with
+        # end def
+
+    @contextmanager
+    def pinning_reads(self):
+        # RawConfigParser._read changes the sections it looks up in place
+        with self.__lock:
+            self.__pin_reads += 1
+            # end with
+        try:
+            yield self
+        finally:
+            with self.__lock:
+                self.__pin_reads -= 1
+                # end with
+            # end try
+        # end def
+
+    def __getitem__(self, name: str) -> dict:
+        with self.__lock:
+            if name in self.__pinned:
+                return self.__pinned[name]
+                # end if
+            if name in self.__cache:
+                if self.__pin_reads:
+                    self.__pinned[name] = self.__cache.pop(name)
+                    return self.__pinned[name]
+                    # end if
+                self.__cache.move_to_end(name)
+                return self.__cache[name]
+                # end if
+            if name not in self.__spans:
+                raise KeyError(name)
+                # end if
+
+            section = self.parse(name)
+            if self.__pin_reads:
+                self.__pinned[name] = section
+                return section
+                # end if
+            self.__cache[name] = section
+            while len(self.__cache) > self.__cache_size:
+                self.__cache.popitem(last=False)
+                # end while
+            return section
+            # end with
+        # end def
+
+    def __setitem__(self, name: str, value: dict):
+        with self.__lock:
+            self.__pinned[name] = value
+            self.__cache.pop(name, None)
+            # end with
+        # end def
+
+    def __delitem__(self, name: str):
+        with self.__lock:
+            if name not in self:
+                raise KeyError(name)
+                # end if
+            self.__spans.pop(name, None)
+            self.__pinned.pop(name, None)
+            self.__cache.pop(name, None)
+            # end with
+        # end def
+
+    def __contains__(self, name) -> bool:
+        if name in self.__pinned:
+            return True
+            # end if
+        return name in self.__spans and name != self.__parser.default_section
+        # end def
+
+    def __iter__(self) -> Iterator[str]:
+        for name in list(self.__spans.keys()):
+            if name != self.__parser.default_section:
+                yield name
+                # end if
+            # end for
+        for name in list(self.__pinned.keys()):
+            if name not in self.__spans:
+                yield name
+                # end if
+            # end for
+        # end def
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+        # end def
+
+    def defaults(self) -> dict:
+        if self.__parser.default_section not in self.__spans:
+            return {}
+            # end if
+        return self.parse(self.__parser.default_section)
+        # end def
+    # end class
+
+
+class SectionProxies(dict):
+
+    # stands in for RawConfigParser._proxies without keeping a proxy
+    # for every indexed section
+
+    def __init__(self, parser: RawConfigParser):
+        super(SectionProxies, self).__init__()
+        self.__parser = parser
+        self[parser.default_section] = SectionProxy(
+            parser, parser.default_section)
+        # end def
+
+    def __missing__(self, name: str) -> SectionProxy:
+        if name in self.__parser._sections:
+            return SectionProxy(self.__parser, name)
+            # end if
+        raise KeyError(name)
+        # end def
+
+    def __delitem__(self, name: str):
+        self.pop(name, None)
+        # end def
+    # end class
@@ -0,0 +1,533 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import base64
+import json
+import os
+import random
+import struct
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+ACCOUNT_ID = '111122223333'
+# BatchGetSecretValue / GetParameters request limits
+SECRET_BATCH_LIMIT = 20
+PARAMETER_BATCH_LIMIT = 10
+PARAMETER_PAGE_SIZE = 10
+
+
+class LocalAWSError(Exception):
+
+    def __init__(self, code: str, message: str = '', status: int = 400):
+        super(LocalAWSError, self).__init__(f'{code}: {message}')
+        self.code = code
+        self.message = message
+        self.status = status
+        # end def
+    # end class
+
+
+class LocalAWS(object):
+
+    # in-process stand-in for Secrets Manager, SSM Parameter Store and KMS
+    # speaking the AWS JSON 1.1 protocol. Used as a context manager it
+    # points boto3 (and aws-encryption-sdk) at itself through
+    # AWS_ENDPOINT_URL with dummy credentials:
+    #
+    #   with LocalAWS(latency=0.02) as aws:
+    #       aws.add_secret('prod/app', {'key': key})
+    #       config = SSMCryptoConfigParser('app.conf', 'utf-8')
+    #
+    # KMS ciphertexts are only meaningful to the instance that made them.
+
+    ENV_KEYS = ('AWS_ENDPOINT_URL', 'AWS_ACCESS_KEY_ID',
+                'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN',
+                'AWS_DEFAULT_REGION', 'AWS_PROFILE', 'AWS_MAX_ATTEMPTS',
+                'AWS_IGNORE_CONFIGURED_ENDPOINT_URLS')
+
+    def __init__(self, region: str = 'ap-northeast-1',
+                 latency: float = 0.0, throttle_rate: float = 0.0,
+                 max_attempts: int = None, host: str = '127.0.0.1',
+                 port: int = 0, seed: int = None):
+        self.__region = region
+        self.__latency = latency
+        self.__throttle_rate = throttle_rate
+        self.__max_attempts = max_attempts
+        self.__address = (host, port)
+        self.__random = random.Random(seed)
+        self.__lock = threading.RLock()
+        self.__server = None
+        self.__thread = None
+        self.__environ = None
+
+        self.__secrets: Dict[str, Tuple[str, str]] = {}
+        self.__parameters: Dict[str, Tuple[str, str, int]] = {}
+        self.__keys: Dict[str, bytes] = {}
+        self.__faults: Dict[str, list] = {}
+        self.__calls = Counter()
+
+        self.__handlers = {
+            'secretsmanager.GetSecretValue': self.__get_secret_value,
+            'secretsmanager.BatchGetSecretValue':
+                self.__batch_get_secret_value,
+            'AmazonSSM.GetParameter': self.__get_parameter,
+            'AmazonSSM.GetParameters': self.__get_parameters,
+            'AmazonSSM.GetParametersByPath': self.__get_parameters_by_path,
+            'TrentService.GenerateDataKey': self.__generate_data_key,
+            'TrentService.Encrypt': self.__encrypt,
+            'TrentService.Decrypt': self.__decrypt,
+            'TrentService.ReEncrypt': self.__re_encrypt,
+        }
+        # end def
+
+    # -- settings ----------------------------------------------------------
+
+    def get_region(self) -> str:
+        return self.__region
+        # end def
+
+    region = property(get_region)
+
+    def get_latency(self) -> float:
+        return self.__latency
+        # end def
+
+    def set_latency(self, value: float):
+        self.__latency = value
+        # end def
+
+    latency = property(get_latency, set_latency)
+
+    def get_throttle_rate(self) -> float:
+        return self.__throttle_rate
+        # end def
+
+    def set_throttle_rate(self, value: float):
+        self.__throttle_rate = value
+        # end def
+
+    throttle_rate = property(get_throttle_rate, set_throttle_rate)
+
+    def get_endpoint_url(self) -> str:
+        if self.__server is None:
+            return None
+            # end if
+        host, port = self.__server.server_address[:2]
+        return f'http://{host}:{port}'
+        # end def
+
+    endpoint_url = property(get_endpoint_url)
+
+    def get_calls(self) -> Counter:
+        # "service.Operation" -> number of requests, injected faults included
+        with self.__lock:
+            return Counter(self.__calls)
+            # end with
+        # end def
+
+    calls = property(get_calls)
+
+    def reset_calls(self):
+        with self.__lock:
+            self.__calls.clear()
+            # end with
+        # end def
+
+    # -- fixtures ----------------------------------------------------------
+
+    def add_secret(self, name: str, value) -> str:
+        # value is the SecretString; dicts are stored as JSON
+        if not isinstance(value, str):
+            value = json.dumps(value)
+            # end if
+        arn = (f'arn:aws:secretsmanager:{self.__region}:{ACCOUNT_ID}'
+               f':secret:{name}-{uuid.uuid4().hex[:6]}')
+        with self.__lock:
+            self.__secrets[name] = (arn, value)
+            # end with
+        return arn
+        # end def
+
+    def add_parameter(self, name: str, value: str,
+                      secure: bool = True) -> str:
+        parameter_type = 'SecureString' if secure else 'String'
+        with self.__lock:
+            version = self.__parameters.get(name, (None, None, 0))[2] + 1
+            self.__parameters[name] = (value, parameter_type, version)
+            # end with
+        return name
+        # end def
+
+    def create_key(self, key_id: str = None) -> str:
+        key_id = key_id or str(uuid.uuid4())
+        arn = f'arn:aws:kms:{self.__region}:{ACCOUNT_ID}:key/{key_id}'
+        with self.__lock:
+            self.__keys[arn] = get_random_bytes(32)
+            # end with
+        return arn
+        # end def
+
+    def inject_error(self, operation: str, code: str = 'InternalFailure',
+                     status: int = 500, count: int = 1,
+                     message: str = 'injected error'):
+        # the next <count> calls of "service.Operation" (e.g.
+        # "secretsmanager.GetSecretValue", "TrentService.Decrypt") fail
+        with self.__lock:
+            self.__faults.setdefault(operation, []).extend(
+                [LocalAWSError(code, message, status)] * count)
+            # end with
+        # end def
+
+    def clear_errors(self):
+        with self.__lock:
+            self.__faults.clear()
+            # end with
+        # end def
+
+    # -- server ------------------------------------------------------------
+
+    def start(self) -> 'LocalAWS':
+        if self.__server is not None:
+            return self
+            # end if
+        self.__server = ThreadingHTTPServer(self.__address, _Handler)
+        self.__server.daemon_threads = True
+        self.__server.local_aws = self
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever,
+            name='cryptoconfigparser-localaws', daemon=True)
+        self.__thread.start()
+        return self
+        # end def
+
+    def stop(self):
+        if self.__server is None:
+            return
+            # end if
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+        self.__server = None
+        self.__thread = None
+        # end def
+
+    def environ(self) -> Dict[str, str]:
+        environ = {
+            'AWS_ENDPOINT_URL': self.endpoint_url,
+            'AWS_ACCESS_KEY_ID': 'testing',
+            'AWS_SECRET_ACCESS_KEY': 'testing',
+            'AWS_DEFAULT_REGION': self.__region,
+        }
+        if self.__max_attempts is not None:
+            environ['AWS_MAX_ATTEMPTS'] = str(self.__max_attempts)
+            # end if
+        return environ
+        # end def
+
+    def __enter__(self) -> 'LocalAWS':
+        self.start()
+        self.__environ = {key: os.environ.get(key) for key in self.ENV_KEYS}
+        for key in self.ENV_KEYS:
+            os.environ.pop(key, None)
+            # end for
+        os.environ.update(self.environ())
+        return self
+        # end def
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for key, value in self.__environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+                # end if
+            # end for
+        self.stop()
+        # end def
+
+    def handle(self, target: str, request: dict) -> dict:
+        with self.__lock:
+            self.__calls[target] += 1
+            faults = self.__faults.get(target)
+            fault = faults.pop(0) if faults else None
+            throttled = self.__random.random() < self.__throttle_rate
+            # end with
+
+        if self.__latency:
+            time.sleep(self.__latency)
+            # end if
+        if fault is not None:
+            raise fault
+            # end if
+        if throttled:
+            raise LocalAWSError('ThrottlingException', 'Rate exceeded')
+            # end if
+        if target not in self.__handlers:
+            raise LocalAWSError('UnknownOperationException', target)
+            # end if
+        return self.__handlers[target](request)
+        # end def
+
+    # -- secrets manager ---------------------------------------------------
+
+    def __find_secret(self, secret_id: str) -> Tuple[str, str, str]:
+        with self.__lock:
+            for name, (arn, value) in self.__secrets.items():
+                if secret_id in (name, arn):
+                    return name, arn, value
+                    # end if
+                # end for
+            # end with
+        raise LocalAWSError(
+            'ResourceNotFoundException',
+            "Secrets Manager can't find the specified secret.")
+        # end def
+
+    def __secret_value(self, secret_id: str) -> dict:
+        name, arn, value = self.__find_secret(secret_id)
+        return {'ARN': arn, 'Name': name, 'SecretString': value,
+                'VersionId': str(uuid.uuid5(uuid.NAMESPACE_URL, arn + value)),
+                'VersionStages': ['AWSCURRENT']}
+        # end def
+
+    def __get_secret_value(self, request: dict) -> dict:
+        return self.__secret_value(request['SecretId'])
+        # end def
+
+    def __batch_get_secret_value(self, request: dict) -> dict:
+        secret_ids = request.get('SecretIdList', [])
+        if len(secret_ids) > SECRET_BATCH_LIMIT:
+            raise LocalAWSError(
+                'ValidationException',
+                f'SecretIdList accepts at most {SECRET_BATCH_LIMIT} ids')
+            # end if
+        values = []
+        errors = []
+        for secret_id in secret_ids:
+            try:
+                values.append(self.__secret_value(secret_id))
+            except LocalAWSError as e:
+                errors.append({'SecretId': secret_id, 'ErrorCode': e.code,
+                               'Message': e.message})
+                # end try
+            # end for
+        return {'SecretValues': values, 'Errors': errors}
+        # end def
+
+    # -- parameter store ---------------------------------------------------
+
+    def __parameter(self, name: str, with_decryption: bool) -> dict:
+        value, parameter_type, version = self.__parameters[name]
+        if parameter_type == 'SecureString' and not with_decryption:
+            value = base64.b64encode(value.encode('utf-8')).decode()
+            # end if
+        return {'Name': name, 'Type': parameter_type, 'Value': value,
+                'Version': version,
+                'ARN': (f'arn:aws:ssm:{self.__region}:{ACCOUNT_ID}'
+                        f':parameter/{name.lstrip("/")}')}
+        # end def
+
+    def __get_parameter(self, request: dict) -> dict:
+        name = request['Name']
+        with self.__lock:
+            if name not in self.__parameters:
+                raise LocalAWSError('ParameterNotFound', name)
+                # end if
+            return {'Parameter': self.__parameter(
+                name, request.get('WithDecryption', False))}
+            # end with
+        # end def
+
+    def __get_parameters(self, request: dict) -> dict:
+        names = request.get('Names', [])
+        if len(names) > PARAMETER_BATCH_LIMIT:
+            raise LocalAWSError(
+                'ValidationException',
+                f'Names accepts at most {PARAMETER_BATCH_LIMIT} names')
+            # end if
+        parameters = []
+        invalid = []
+        with self.__lock:
+            for name in names:
+                if name in self.__parameters:
+                    parameters.append(self.__parameter(
+                        name, request.get('WithDecryption', False)))
+                else:
+                    invalid.append(name)
+                    # end if
+                # end for
+            # end with
+        return {'Parameters': parameters, 'InvalidParameters': invalid}
+        # end def
+
+    def __get_parameters_by_path(self, request: dict) -> dict:
+        path = '/' + request['Path'].strip('/')
+        prefix = path.rstrip('/') + '/'
+        recursive = request.get('Recursive', False)
+        page_size = request.get('MaxResults', PARAMETER_PAGE_SIZE)
+        start = int(request.get('NextToken') or 0)
+        with self.__lock:
+            names = sorted(
+                name for name in self.__parameters
+                if name.startswith(prefix) and (
+                    recursive or '/' not in name[len(prefix):]))
+            page = [self.__parameter(
+                name, request.get('WithDecryption', False))
+                for name in names[start:start + page_size]]
+            # end with
+        response = {'Parameters': page}
+        if start + page_size < len(names):
+            response['NextToken'] = str(start + page_size)
+            # end if
+        return response
+        # end def
+
+    # -- kms ---------------------------------------------------------------
+
+    def __find_key(self, key_id: str) -> Tuple[str, bytes]:
+        with self.__lock:
+            for arn, key in self.__keys.items():
+                if key_id in (arn, arn.rpartition('/')[2]):
+                    return arn, key
+                    # end if
+                # end for
+            # end with
+        raise LocalAWSError('NotFoundException', f'Key {key_id} not found')
+        # end def
+
+    @staticmethod
+    def __context(request: dict, name: str = 'EncryptionContext') -> bytes:
+        return json.dumps(request.get(name) or {}, sort_keys=True).encode()
+        # end def
+
+    def __wrap(self, key_id: str, plaintext: bytes, context: bytes) -> bytes:
+        # blob: arn length, arn, nonce, ciphertext, tag
+        arn, key = self.__find_key(key_id)
+        cipher = AES.new(key, AES.MODE_GCM)
+        cipher.update(context)
+        body, tag = cipher.encrypt_and_digest(plaintext)
+        encoded = arn.encode()
+        return b''.join((struct.pack('>H', len(encoded)), encoded,
+                         cipher.nonce, body, tag))
+        # end def
+
+    def __unwrap(self, blob: bytes, context: bytes,
+                 key_id: str = None) -> Tuple[str, bytes]:
+        try:
+            length = struct.unpack('>H', blob[:2])[0]
+            arn = blob[2:2 + length].decode()
+            nonce = blob[2 + length:2 + length + 16]
+            body = blob[2 + length + 16:-16]
+            tag = blob[-16:]
+            _, key = self.__find_key(arn)
+        except (struct.error, UnicodeDecodeError, LocalAWSError):
+            raise LocalAWSError('InvalidCiphertextException', '')
+            # end try
+        if key_id is not None and self.__find_key(key_id)[0] != arn:
+            raise LocalAWSError('IncorrectKeyException', key_id)
+            # end if
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(context)
+        try:
+            return arn, cipher.decrypt_and_verify(body, tag)
+        except ValueError:
+            raise LocalAWSError('InvalidCiphertextException', '')
+            # end try
+        # end def
+
+    @staticmethod
+    def __blob(request: dict, name: str) -> bytes:
+        return base64.b64decode(request[name])
+        # end def
+
+    @staticmethod
+    def __encode(data: bytes) -> str:
+        return base64.b64encode(data).decode()
+        # end def
+
+    def __generate_data_key(self, request: dict) -> dict:
+        size = request.get('NumberOfBytes')
+        if size is None:
+            size = {'AES_128': 16, 'AES_256': 32}[
+                request.get('KeySpec', 'AES_256')]
+            # end if
+        arn, _ = self.__find_key(request['KeyId'])
+        plaintext = get_random_bytes(size)
+        blob = self.__wrap(arn, plaintext, self.__context(request))
+        return {'KeyId': arn, 'Plaintext': self.__encode(plaintext),
+                'CiphertextBlob': self.__encode(blob)}
+        # end def
+
+    def __encrypt(self, request: dict) -> dict:
+        arn, _ = self.__find_key(request['KeyId'])
+        blob = self.__wrap(arn, self.__blob(request, 'Plaintext'),
+                           self.__context(request))
+        return {'KeyId': arn, 'CiphertextBlob': self.__encode(blob)}
+        # end def
+
+    def __decrypt(self, request: dict) -> dict:
+        arn, plaintext = self.__unwrap(
+            self.__blob(request, 'CiphertextBlob'),
+            self.__context(request), request.get('KeyId'))
+        return {'KeyId': arn, 'Plaintext': self.__encode(plaintext)}
+        # end def
+
+    def __re_encrypt(self, request: dict) -> dict:
+        source_arn, plaintext = self.__unwrap(
+            self.__blob(request, 'CiphertextBlob'),
+            self.__context(request, 'SourceEncryptionContext'),
+            request.get('SourceKeyId'))
+        arn, _ = self.__find_key(request['DestinationKeyId'])
+        blob = self.__wrap(
+            arn, plaintext,
+            self.__context(request, 'DestinationEncryptionContext'))
+        return {'KeyId': arn, 'SourceKeyId': source_arn,
+                'CiphertextBlob': self.__encode(blob)}
+        # end def
+    # end class
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        target = self.headers.get('X-Amz-Target', '')
+        try:
+            request = json.loads(body or b'{}')
+            status, response = 200, self.server.local_aws.handle(
+                target, request)
+        except LocalAWSError as e:
+            status, response = e.status, {'__type': e.code,
+                                          'message': e.message}
+        except (KeyError, ValueError) as e:
+            status, response = 400, {'__type': 'ValidationException',
+                                     'message': str(e)}
+            # end try
+
+        payload = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('x-amzn-RequestId', str(uuid.uuid4()))
+        self.end_headers()
+        self.wfile.write(payload)
+        # end def
+
+    def log_message(self, format, *args):
+        pass
+        # end def
+    # end class
@@ -0,0 +1,169 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import os
+from typing import Dict
+
+from . import KeyFile
+from .AESCryptoConfigParser import AESCipher
+from .KeyProvider import SCHEME_SEPARATOR, KeyProvider, register_provider
+from .SecretBuffer import SecretBuffer
+
+
+@register_provider('file')
+class FileKeyProvider(KeyProvider):
+
+    # file:<ciphertext> uses [settings] key_file,
+    # file:<key file path>:<ciphertext> names the key file explicitly;
+    # key files are cached process-wide by KeyFile
+
+    @classmethod
+    def accepts(cls, payload: str) -> bool:
+        # not a file:// URL
+        return not payload.startswith('//') and AESCipher.is_ciphertext(
+            payload.rpartition(SCHEME_SEPARATOR)[2])
+        # end def
+
+    def get_cipher(self, key_file_path: str = None) -> AESCipher:
+        if not key_file_path:
+            return self._parser.get_cipher()
+            # end if
+
+        return KeyFile.load_cipher(
+            key_file_path, AESCipher, self._parser.key_format,
+            self._parser.encoding, lambda: self.record_call('file.read'))
+        # end def
+
+    def local_cipher(self, payload: str) -> AESCipher:
+        return self.get_cipher(payload.rpartition(SCHEME_SEPARATOR)[0])
+        # end def
+
+    def decrypt(self, payload: str,
+                section: str = None, option: str = None) -> str:
+        key_file_path, _, body = payload.rpartition(SCHEME_SEPARATOR)
+        return self.get_cipher(key_file_path).decrypt(body)
+        # end def
+
+    def decrypt_secret(self, payload: str,
+                       section: str = None, option: str = None,
+                       lock: bool = False) -> SecretBuffer:
+        key_file_path, _, body = payload.rpartition(SCHEME_SEPARATOR)
+        return self.get_cipher(key_file_path).decrypt_into(body, lock)
+        # end def
+    # end class
+
+
+@register_provider('env')
+class EnvKeyProvider(KeyProvider):
+
+    # env:<ciphertext> reads the key from [settings] key_env,
+    # env:<variable>:<ciphertext> names the variable explicitly
+
+    KEY_ENV_OPTION_KEY = 'key_env'
+    DEFAULT_KEY_ENV = 'CRYPTOCONFIGPARSER_KEY'
+
+    def __init__(self, parser):
+        super(EnvKeyProvider, self).__init__(parser)
+        self.__ciphers = {}
+        # end def
+
+    @classmethod
+    def accepts(cls, payload: str) -> bool:
+        return AESCipher.is_ciphertext(payload.rpartition(SCHEME_SEPARATOR)[2])
+        # end def
+
+    def get_cipher(self, variable: str = None) -> AESCipher:
+        if not variable:
+            variable = self.setting(
+                self.KEY_ENV_OPTION_KEY, self.DEFAULT_KEY_ENV)
+            # end if
+
+        if variable not in self.__ciphers:
+            if variable not in os.environ:
+                raise KeyError(f'environment variable is not set: {variable}')
+                # end if
+            self.__ciphers[variable] = AESCipher(os.environ[variable])
+            # end if
+        return self.__ciphers[variable]
+        # end def
+
+    def local_cipher(self, payload: str) -> AESCipher:
+        return self.get_cipher(payload.rpartition(SCHEME_SEPARATOR)[0])
+        # end def
+
+    def decrypt(self, payload: str,
+                section: str = None, option: str = None) -> str:
+        variable, _, body = payload.rpartition(SCHEME_SEPARATOR)
+        return self.get_cipher(variable).decrypt(body)
+        # end def
+
+    def decrypt_secret(self, payload: str,
+                       section: str = None, option: str = None,
+                       lock: bool = False) -> SecretBuffer:
+        variable, _, body = payload.rpartition(SCHEME_SEPARATOR)
+        return self.get_cipher(variable).decrypt_into(body, lock)
+        # end def
+
+    def reset(self):
+        self.__ciphers = {}
+        # end def
+    # end class
+
+
+@register_provider('local')
+class LocalKeyProvider(KeyProvider):
+
+    # in-process test double: local:<key name>:<ciphertext>
+    # with keys registered through LocalKeyProvider.add_key()
+
+    KEYS: Dict[str, AESCipher] = {}
+
+    @classmethod
+    def add_key(cls, name: str, key: str):
+        cls.KEYS[name] = AESCipher(key)
+        # end def
+
+    @classmethod
+    def remove_key(cls, name: str):
+        cls.KEYS.pop(name, None)
+        # end def
+
+    @classmethod
+    def encrypt(cls, name: str, text: str) -> str:
+        encrypted = cls.KEYS[name].encrypt(text).decode()
+        return f'{cls.SCHEME}:{name}:{encrypted}'
+        # end def
+
+    @classmethod
+    def accepts(cls, payload: str) -> bool:
+        return AESCipher.is_ciphertext(payload.rpartition(SCHEME_SEPARATOR)[2])
+        # end def
+
+    def get_cipher(self, name: str) -> AESCipher:
+        if name not in self.KEYS:
+            raise KeyError(f'unknown local key: {name}')
+            # end if
+        return self.KEYS[name]
+        # end def
+
+    def local_cipher(self, payload: str) -> AESCipher:
+        return self.get_cipher(payload.rpartition(SCHEME_SEPARATOR)[0])
+        # end def
+
+    def decrypt(self, payload: str,
+                section: str = None, option: str = None) -> str:
+        name, _, body = payload.rpartition(SCHEME_SEPARATOR)
+        return self.get_cipher(name).decrypt(body)
+        # end def
+
+    def decrypt_secret(self, payload: str,
+                       section: str = None, option: str = None,
+                       lock: bool = False) -> SecretBuffer:
+        name, _, body = payload.rpartition(SCHEME_SEPARATOR)
+        return self.get_cipher(name).decrypt_into(body, lock)
+        # end def
+    # end class
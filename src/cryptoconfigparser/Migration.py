@@ -0,0 +1,572 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import asyncio
+import base64
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from typing import (Callable, Dict, Iterable, List, NamedTuple, Optional,
+                    Tuple)
+
+import boto3
+
+from . import KeyFile
+from .AESCryptoConfigParser import AESCipher, AESCryptoConfigParser
+from .Fleet import (CONFIG_PATTERNS, atomic_write, error_name, open_config,
+                    walk_configs)
+from .KeyProvider import SCHEME_SEPARATOR, split_scheme
+
+# backends whose values each cost a network round trip
+PIPELINED_SCHEMES = ('kms',)
+# references rather than ciphertexts; the plaintext lives in the backend
+SKIPPED_SCHEMES = ('ssm-param',)
+KMS_CONCURRENCY = 16
+
+SECTION_RE = re.compile(r'^\s*\[(?P<header>[^\]]+)\]')
+OPTION_RE = re.compile(
+    r'^(?P<key>[^\s\[#;=:][^=:]*?)(?P<delimiter>\s*[=:]\s*)(?P<value>.*?)'
+    r'(?P<trailer>\s*)$')
+
+_KMS_CLIENTS = {}
+
+
+class MigrationTarget(NamedTuple):
+    # key_file: re-encrypt under this key file (CBC, or SIV when
+    # deterministic); envelope_key_id: one new KMS data key per file, or
+    # with rewrap the file's data key re-encrypted under envelope_key_id
+    # and the values left as they are
+    key_file: str = None
+    key_format: str = KeyFile.KEY_FORMAT_TEXT
+    deterministic: bool = False
+    envelope_key_id: str = None
+    region: str = None
+    rewrap: bool = False
+
+
+class FileResult(NamedTuple):
+    path: str
+    status: str
+    values: int
+    unchanged: int
+    elapsed: float
+    error: str
+
+
+class MigrationReport(NamedTuple):
+    files: int
+    migrated: int
+    unchanged: int
+    resumed: int
+    values: int
+    errors: Dict[str, str]
+    elapsed: float
+
+
+def rewrite_values(text: str, replacements: Dict[Tuple[str, str], str],
+                   settings: Dict[str, str] = None,
+                   optionxform: Callable[[str], str] = str.lower,
+                   settings_section: str = 'settings') -> Tuple[str, int]:
+    # replaces option values line by line, leaving every other line,
+    # comment and line ending as it was; settings are updated in place or
+    # added after the [settings] header
+    pending = dict(settings or {})
+    lines = text.splitlines(keepends=True)
+    newline = '\n'
+    if lines and lines[0].endswith('\r\n'):
+        newline = '\r\n'
+        # end if
+
+    output = []
+    settings_at = None
+    section = None
+    applied = 0
+    for line in lines:
+        body = line.rstrip('\r\n')
+        ending = line[len(body):]
+        match = SECTION_RE.match(body)
+        if match:
+            section = match.group('header').strip()
+            output.append(line)
+            if section == settings_section and settings_at is None:
+                settings_at = len(output)
+                # end if
+            continue
+            # end if
+
+        match = OPTION_RE.match(body) if section is not None else None
+        if match:
+            key = optionxform(match.group('key').strip())
+            value = None
+            if section == settings_section and key in pending:
+                value = pending.pop(key)
+            elif (section, key) in replacements:
+                value = replacements[(section, key)]
+                applied += 1
+                # end if
+            if value is not None:
+                line = ''.join((match.group('key'), match.group('delimiter'),
+                                value, match.group('trailer'), ending))
+                # end if
+            # end if
+        output.append(line)
+        # end for
+
+    added = [f'{key}={value}{newline}' for key, value in pending.items()]
+    if added and settings_at is not None:
+        output[settings_at:settings_at] = added
+    elif added:
+        if output and not output[-1].endswith('\n'):
+            output[-1] += newline
+            # end if
+        output = [f'[{settings_section}]{newline}'] + added + [newline] \
+            + output
+        # end if
+    return ''.join(output), applied
+    # end def
+
+
+async def decrypt_pipelined(config: AESCryptoConfigParser,
+                            options: List[Tuple[str, str]],
+                            concurrency: int = KMS_CONCURRENCY
+                            ) -> Tuple[Dict[tuple, str],
+                                       Dict[tuple, BaseException]]:
+    # per-value remote decrypts through a bounded queue, so at most
+    # <concurrency> calls are in flight and the producer never runs ahead
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    plaintexts = {}
+    errors = {}
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        async def consume():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                    # end if
+                try:
+                    plaintexts[item] = await loop.run_in_executor(
+                        executor, config.decrypt, *item)
+                except Exception as e:
+                    errors[item] = e
+                    # end try
+                # end while
+            # end def
+
+        consumers = [asyncio.ensure_future(consume())
+                     for i in range(concurrency)]
+        for item in options:
+            await queue.put(item)
+            # end for
+        for consumer in consumers:
+            await queue.put(None)
+            # end for
+        await asyncio.gather(*consumers)
+        # end with
+    return plaintexts, errors
+    # end def
+
+
+def decrypt_all(config: AESCryptoConfigParser,
+                options: List[Tuple[str, str]],
+                concurrency: int = KMS_CONCURRENCY
+                ) -> Tuple[Dict[tuple, str], Dict[tuple, BaseException]]:
+    local = []
+    remote = []
+    for section, option in options:
+        scheme, _ = config.resolve_scheme(
+            config.get(section, option, raw=True))
+        if scheme in PIPELINED_SCHEMES:
+            remote.append((section, option))
+        else:
+            local.append((section, option))
+            # end if
+        # end for
+
+    plaintexts = {}
+    errors = {}
+    try:
+        # batched per backend
+        plaintexts.update(config.decrypt_options(local))
+    except Exception:
+        for section, option in local:
+            try:
+                plaintexts[(section, option)] = config.decrypt(
+                    section, option)
+            except Exception as e:
+                errors[(section, option)] = e
+                # end try
+            # end for
+        # end try
+    if remote:
+        decrypted, failed = asyncio.run(
+            decrypt_pipelined(config, remote, concurrency))
+        plaintexts.update(decrypted)
+        errors.update(failed)
+        # end if
+    return plaintexts, errors
+    # end def
+
+
+def _kms_client(profile: str, region: str):
+    key = (profile, region)
+    if key not in _KMS_CLIENTS:
+        _KMS_CLIENTS[key] = boto3.session.Session(
+            profile_name=profile).client('kms', region_name=region)
+        # end if
+    return _KMS_CLIENTS[key]
+    # end def
+
+
+def target_cipher(config: AESCryptoConfigParser, target: MigrationTarget,
+                  profile: str = None
+                  ) -> Tuple[AESCipher, str, Dict[str, str], str]:
+    # cipher, mode, [settings] updates and value scheme for one file
+    section = config.SETTING_SECTION_KEY
+    if target.envelope_key_id:
+        region = target.region
+        if region is None and target.envelope_key_id.startswith('arn:'):
+            region = target.envelope_key_id.split(SCHEME_SEPARATOR)[3]
+            # end if
+        response = _kms_client(profile, region).generate_data_key(
+            KeyId=target.envelope_key_id, KeySpec='AES_256')
+        settings = {
+            'key_id': target.envelope_key_id,
+            'data_key': base64.b64encode(
+                response['CiphertextBlob']).decode()}
+        cipher = AESCipher(response['Plaintext'], mode=AESCipher.MODE_GCM)
+        return cipher, AESCipher.MODE_GCM, settings, 'envelope'
+        # end if
+
+    cipher = KeyFile.load_cipher(
+        target.key_file, AESCipher, target.key_format, config.encoding)
+    settings = {config.KEYFILE_OPTION_KEY: target.key_file}
+    if target.key_format != KeyFile.KEY_FORMAT_TEXT or config.has_option(
+            section, config.KEY_FORMAT_OPTION_KEY):
+        settings[config.KEY_FORMAT_OPTION_KEY] = target.key_format
+        # end if
+    if target.deterministic or config.has_option(
+            section, config.DETERMINISTIC_OPTION_KEY):
+        settings[config.DETERMINISTIC_OPTION_KEY] = str(
+            target.deterministic).lower()
+        # end if
+    mode = AESCipher.MODE_SIV if target.deterministic else AESCipher.MODE_CBC
+    return cipher, mode, settings, 'file'
+    # end def
+
+
+def format_value(config: AESCryptoConfigParser, raw: str,
+                 encrypted: str, scheme: str) -> str:
+    # unprefixed values stay unprefixed when the parser would route them
+    # to the new backend anyway
+    if split_scheme(raw)[0] is None and scheme == 'file' \
+            and config.default_scheme(encrypted) == scheme:
+        return encrypted
+        # end if
+    return f'{scheme}{SCHEME_SEPARATOR}{encrypted}'
+    # end def
+
+
+def rewrap_file(config: AESCryptoConfigParser, path: str,
+                target: MigrationTarget, dry_run: bool = False) -> FileResult:
+    # key rotation for envelope configs: only [settings] key_id and
+    # data_key are rewritten, so the values count as unchanged
+    if getattr(config, 'data_key', None) is None:
+        return FileResult(path, 'error', 0, 0, 0.0, 'no data key to rewrap')
+        # end if
+    config.rewrap_data_key(target.envelope_key_id)
+    settings = {config.KMS_KEY_ID_OPTION_KEY: config.key_id,
+                config.DATA_KEY_OPTION_KEY: config.data_key}
+    with open(path, encoding=config.encoding, newline='') as file:
+        text = file.read()
+        # end with
+    text, _ = rewrite_values(text, {}, settings, config.optionxform,
+                             config.SETTING_SECTION_KEY)
+    if not dry_run:
+        atomic_write(path, text, config.encoding)
+        # end if
+    return FileResult(path, 'migrated', 0, len(config.encrypted_options()),
+                      0.0, None)
+    # end def
+
+
+def migrate_file(path: str, target: MigrationTarget, encoding: str = None,
+                 parser: str = 'auto',
+                 kms_concurrency: int = KMS_CONCURRENCY,
+                 dry_run: bool = False, profile: str = None,
+                 region: str = None, legacy_bare: bool = False
+                 ) -> FileResult:
+    # runs in a worker process; errors name section.option and the
+    # exception type only, never a value
+    started = time.perf_counter()
+
+    def result(status: str, values: int = 0, unchanged: int = 0,
+               error: str = None) -> FileResult:
+        return FileResult(path, status, values, unchanged,
+                          time.perf_counter() - started, error)
+        # end def
+
+    try:
+        config = open_config(path, encoding, parser, profile=profile,
+                             region=region, legacy_bare=legacy_bare)
+        if target.rewrap:
+            return rewrap_file(config, path, target, dry_run)._replace(
+                elapsed=time.perf_counter() - started)
+            # end if
+        options = []
+        for section, option in config.encrypted_options():
+            raw = config.get(section, option, raw=True)
+            scheme, _ = config.resolve_scheme(raw)
+            if scheme not in SKIPPED_SCHEMES and '\n' not in raw:
+                options.append((section, option))
+                # end if
+            # end for
+        if not options:
+            return result('unchanged')
+            # end if
+
+        plaintexts, errors = decrypt_all(config, options, kms_concurrency)
+        if errors:
+            return result('error', error=', '.join(
+                f'{section}.{option}: {error_name(error)}'
+                for (section, option), error in errors.items()))
+            # end if
+
+        cipher, mode, settings, scheme = target_cipher(
+            config, target, profile)
+        replacements = {}
+        unchanged = 0
+        for section, option in options:
+            raw = config.get(section, option, raw=True)
+            value = format_value(
+                config, raw,
+                cipher.encrypt(plaintexts[(section, option)], mode).decode(),
+                scheme)
+            if value == raw:
+                # deterministic ciphertext under the same key
+                unchanged += 1
+                continue
+                # end if
+            replacements[(section, config.optionxform(option))] = value
+            # end for
+        if not replacements:
+            return result('unchanged', unchanged=unchanged)
+            # end if
+
+        with open(path, encoding=config.encoding, newline='') as file:
+            text = file.read()
+            # end with
+        text, applied = rewrite_values(
+            text, replacements, settings, config.optionxform,
+            config.SETTING_SECTION_KEY)
+        if not dry_run:
+            atomic_write(path, text, config.encoding)
+            # end if
+        return result('migrated', applied, unchanged)
+    except Exception as e:
+        return result('error', error=error_name(e))
+        # end try
+    # end def
+
+
+class Migrator(object):
+
+    # walks files and directories, migrates each file in a worker process
+    # (workers=0 runs in-process) and records finished files in a JSON
+    # lines state file, so that an interrupted run resumes where it
+    # stopped. Files changed since they were recorded are done again.
+
+    REPORT_INTERVAL = 5.0
+
+    def __init__(self, target: MigrationTarget, workers: int = None,
+                 kms_concurrency: int = KMS_CONCURRENCY,
+                 state_path: str = None, encoding: str = None,
+                 parser: str = 'auto', dry_run: bool = False,
+                 profile: str = None, region: str = None,
+                 legacy_bare: bool = False,
+                 progress: Callable[[str], None] = None):
+        if not target.key_file and not target.envelope_key_id:
+            raise ValueError(
+                'a target key_file or envelope_key_id is required')
+            # end if
+        self.__target = target
+        self.__workers = os.cpu_count() if workers is None else workers
+        self.__kms_concurrency = kms_concurrency
+        self.__state_path = state_path
+        self.__encoding = encoding
+        self.__parser = parser
+        self.__dry_run = dry_run
+        self.__profile = profile
+        self.__region = region
+        self.__legacy_bare = legacy_bare
+        self.__progress = progress
+        # end def
+
+    def get_target(self) -> MigrationTarget:
+        return self.__target
+        # end def
+
+    target = property(get_target)
+
+    def __load_state(self) -> Dict[str, Tuple[int, int]]:
+        done = {}
+        if not self.__state_path or not os.path.exists(self.__state_path):
+            return done
+            # end if
+        with open(self.__state_path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn last line of an interrupted run
+                    continue
+                    # end try
+                done[entry['path']] = (entry['mtime_ns'], entry['size'])
+                # end for
+            # end with
+        return done
+        # end def
+
+    @staticmethod
+    def __version(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            status = os.stat(path)
+        except OSError:
+            return None
+            # end try
+        return status.st_mtime_ns, status.st_size
+        # end def
+
+    def __record(self, state, result: FileResult):
+        if state is None or result.status == 'error' or self.__dry_run:
+            return
+            # end if
+        mtime_ns, size = self.__version(result.path)
+        state.write(json.dumps({
+            'path': os.path.abspath(result.path), 'status': result.status,
+            'mtime_ns': mtime_ns, 'size': size}) + '\n')
+        state.flush()
+        # end def
+
+    def __report(self, done: int, total: int, values: int, errors: int,
+                 started: float, final: bool = False):
+        if self.__progress is None:
+            return
+            # end if
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        line = (f'{done}/{total} files, {values} values, '
+                f'{done / elapsed:.1f} files/s, '
+                f'{values / elapsed:.1f} values/s, {errors} errors')
+        if final:
+            line += f', {elapsed:.1f}s'
+        elif done:
+            line += f', eta {(total - done) * elapsed / done:.0f}s'
+            # end if
+        self.__progress(line)
+        # end def
+
+    def __arguments(self, path: str) -> tuple:
+        return (path, self.__target, self.__encoding, self.__parser,
+                self.__kms_concurrency, self.__dry_run, self.__profile,
+                self.__region, self.__legacy_bare)
+        # end def
+
+    def __results(self, paths: List[str]) -> Iterable[FileResult]:
+        if self.__workers == 0:
+            for path in paths:
+                yield migrate_file(*self.__arguments(path))
+                # end for
+            return
+            # end if
+
+        # bounded submission keeps memory flat for very large fleets
+        limit = self.__workers * 4
+        with ProcessPoolExecutor(max_workers=self.__workers) as executor:
+            pending = set()
+            for path in paths:
+                pending.add(executor.submit(
+                    migrate_file, *self.__arguments(path)))
+                if len(pending) >= limit:
+                    finished, pending = wait(
+                        pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        yield future.result()
+                        # end for
+                    # end if
+                # end for
+            while pending:
+                finished, pending = wait(
+                    pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    yield future.result()
+                    # end for
+                # end while
+            # end with
+        # end def
+
+    def run(self, paths: Iterable[str],
+            patterns: Iterable[str] = CONFIG_PATTERNS) -> MigrationReport:
+        started = time.perf_counter()
+        done = self.__load_state()
+        files = list(walk_configs(paths, patterns))
+        todo = []
+        for path in files:
+            version = self.__version(path)
+            # paths that cannot be read are left to migrate_file, which
+            # reports them as errors
+            if version is None or done.get(os.path.abspath(path)) != version:
+                todo.append(path)
+                # end if
+            # end for
+
+        state = None
+        if self.__state_path and not self.__dry_run:
+            state = open(self.__state_path, 'a')
+            # end if
+        migrated = unchanged = values = 0
+        errors = {}
+        last_report = started
+        try:
+            for count, result in enumerate(self.__results(todo), 1):
+                if result.status == 'error':
+                    errors[result.path] = result.error
+                elif result.status == 'migrated':
+                    migrated += 1
+                else:
+                    unchanged += 1
+                    # end if
+                values += result.values
+                self.__record(state, result)
+                if time.perf_counter() - last_report >= self.REPORT_INTERVAL:
+                    last_report = time.perf_counter()
+                    self.__report(count, len(todo), values, len(errors),
+                                  started)
+                    # end if
+                # end for
+        finally:
+            if state is not None:
+                state.close()
+                # end if
+            # end try
+
+        self.__report(len(todo), len(todo), values, len(errors), started,
+                      final=True)
+        return MigrationReport(
+            len(files), migrated, unchanged, len(files) - len(todo), values,
+            errors, time.perf_counter() - started)
+        # end def
+    # end class
+
+
+def print_progress(line: str):
+    print(line, file=sys.stderr, flush=True)
+    # end def
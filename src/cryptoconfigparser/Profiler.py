@@ -0,0 +1,236 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+
+_ACTIVE = contextvars.ContextVar('cryptoconfigparser_profiler', default=None)
+
+
+class DecryptTrace(NamedTuple):
+    section: str
+    option: str
+    kind: str
+    backend: str
+    cache_hit: bool
+    calls: Tuple[str, ...]
+    bytes_in: int
+    bytes_out: int
+    start: float
+    wall: float
+    cpu: float
+    thread: int
+    error: str
+
+    def get_name(self) -> str:
+        if self.section is None:
+            return self.kind
+            # end if
+        return f'{self.section}.{self.option}'
+        # end def
+
+    name = property(get_name)
+    # end class
+
+
+class TraceRecorder(object):
+
+    # mutable side of a trace while the call is running
+
+    def __init__(self, section: str, option: str, kind: str):
+        self.section = section
+        self.option = option
+        self.kind = kind
+        self.backend = None
+        self.cache_hit = False
+        self.calls = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # end def
+    # end class
+
+
+class Profiler(object):
+
+    # collects one DecryptTrace per decrypt call of the parsers it is
+    # attached to. Remote calls (botocore before-call) and key file reads
+    # are attributed to the innermost trace running on the same thread;
+    # calls made outside any trace (e.g. prefetch workers) are counted in
+    # untraced_calls. Parsers used inside activate() report to it, unless
+    # a profiler is set on the parser itself.
+
+    def __init__(self):
+        self.__traces: List[DecryptTrace] = []
+        self.__untraced = Counter()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__origin = time.perf_counter()
+        # end def
+
+    @classmethod
+    def current(cls) -> 'Profiler':
+        return _ACTIVE.get()
+        # end def
+
+    @contextmanager
+    def activate(self) -> Iterator['Profiler']:
+        token = _ACTIVE.set(self)
+        try:
+            yield self
+        finally:
+            _ACTIVE.reset(token)
+            # end try
+        # end def
+
+    def __stack(self) -> List[TraceRecorder]:
+        if not hasattr(self.__local, 'stack'):
+            self.__local.stack = []
+            # end if
+        return self.__local.stack
+        # end def
+
+    @contextmanager
+    def trace(self, section: str, option: str,
+              kind: str) -> Iterator[TraceRecorder]:
+        recorder = TraceRecorder(section, option, kind)
+        stack = self.__stack()
+        stack.append(recorder)
+        error = None
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            yield recorder
+        except BaseException as e:
+            # the type only; messages may quote values
+            error = type(e).__name__
+            raise
+        finally:
+            cpu = time.thread_time() - cpu_started
+            wall = time.perf_counter() - started
+            stack.pop()
+            trace = DecryptTrace(
+                recorder.section, recorder.option, recorder.kind,
+                recorder.backend, recorder.cache_hit,
+                tuple(recorder.calls), recorder.bytes_in, recorder.bytes_out,
+                started - self.__origin, wall, cpu,
+                threading.get_ident(), error)
+            with self.__lock:
+                self.__traces.append(trace)
+                # end with
+            # end try
+        # end def
+
+    def record_call(self, operation: str):
+        stack = self.__stack()
+        if stack:
+            stack[-1].calls.append(operation)
+        else:
+            with self.__lock:
+                self.__untraced[operation] += 1
+                # end with
+            # end if
+        # end def
+
+    def get_traces(self) -> List[DecryptTrace]:
+        with self.__lock:
+            return list(self.__traces)
+            # end with
+        # end def
+
+    traces = property(get_traces)
+
+    def get_untraced_calls(self) -> Counter:
+        with self.__lock:
+            return Counter(self.__untraced)
+            # end with
+        # end def
+
+    untraced_calls = property(get_untraced_calls)
+
+    def clear(self):
+        with self.__lock:
+            self.__traces = []
+            self.__untraced = Counter()
+            # end with
+        # end def
+
+    def summary(self, slowest: int = 10) -> Dict[str, Any]:
+        traces = self.traces
+        backends = {}
+        for trace in traces:
+            stats = backends.setdefault(trace.backend or '-', {
+                'count': 0, 'cache_hits': 0, 'remote_calls': 0,
+                'errors': 0, 'wall': 0.0, 'cpu': 0.0})
+            stats['count'] += 1
+            stats['cache_hits'] += int(trace.cache_hit)
+            stats['remote_calls'] += len(trace.calls)
+            stats['errors'] += int(trace.error is not None)
+            stats['wall'] += trace.wall
+            stats['cpu'] += trace.cpu
+            # end for
+        ranked = sorted(traces, key=lambda trace: trace.wall, reverse=True)
+        return {
+            'count': len(traces),
+            'cache_hits': sum(int(trace.cache_hit) for trace in traces),
+            'remote_calls': dict(Counter(
+                call for trace in traces for call in trace.calls)),
+            'untraced_calls': dict(self.untraced_calls),
+            'wall': sum(trace.wall for trace in traces),
+            'backends': backends,
+            'slowest': [
+                {'name': trace.name, 'kind': trace.kind,
+                 'backend': trace.backend, 'wall': trace.wall,
+                 'calls': list(trace.calls)}
+                for trace in ranked[:slowest]],
+        }
+        # end def
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'summary': self.summary(),
+            'traces': [dict(trace._asdict(), calls=list(trace.calls))
+                       for trace in self.traces],
+        }
+        # end def
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        # chrome://tracing / Perfetto "complete" events in microseconds
+        pid = os.getpid()
+        events = []
+        for trace in self.traces:
+            events.append({
+                'name': trace.name, 'cat': trace.backend or trace.kind,
+                'ph': 'X', 'pid': pid, 'tid': trace.thread,
+                'ts': trace.start * 1e6, 'dur': trace.wall * 1e6,
+                'args': {'kind': trace.kind, 'cache_hit': trace.cache_hit,
+                         'calls': list(trace.calls),
+                         'bytes_in': trace.bytes_in,
+                         'bytes_out': trace.bytes_out,
+                         'cpu_ms': trace.cpu * 1e3, 'error': trace.error}})
+            # end for
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        # end def
+
+    def write(self, path: str, format: str = 'json'):
+        if format == 'chrome':
+            report = self.to_chrome_trace()
+        elif format == 'json':
+            report = self.to_json()
+        else:
+            raise ValueError(f'unknown report format: {format}')
+            # end if
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+            # end with
+        # end def
+    # end class
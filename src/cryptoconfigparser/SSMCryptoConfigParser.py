@@ -5,26 +5,26 @@
 # __version__ = '0.9.0'
 # ---------------------------------------------------------------------------
 
-import json
+from typing import Dict
 
-import boto3
-
-from . import AESCipher, AESCryptoConfigParser
+from .AESCryptoConfigParser import AESCipher, AESCryptoConfigParser
+from .AWSKeyProvider import SecretsManagerKeyProvider
+from .KeyProvider import SCHEME_SEPARATOR
 
 
 class SSMCryptoConfigParser(AESCryptoConfigParser):
 
     SETTING_SECTION_KEY = 'settings'
     SECRET_NAME_OPTION_KEY = 'secret_name'
+    SECRETS_OPTION_KEY = 'secrets'
 
     def __init__(self,
                  config_path: str = None,
                  encoding: str = None,
                  profile: str = None,
-                 region: str = None):
-        super(SSMCryptoConfigParser, self).__init__(config_path, encoding)
-
-        self.__cipher = None
+                 region: str = None,
+                 lazy: bool = False):
+        self.__secrets = {}
         self.__profile = None
         self.__secret_name = None
         self.__region = 'ap-northeast-1'
@@ -35,14 +35,28 @@ class SSMCryptoConfigParser(AESCryptoConfigParser):
             self.__region = region
             # end if
 
-        if config_path:
-            if self.has_option(self.SETTING_SECTION_KEY,
-                               self.SECRET_NAME_OPTION_KEY):
-                # load key
-                self.__secret_name = self.get(
-                    self.SETTING_SECTION_KEY, self.SECRET_NAME_OPTION_KEY)
-                self.load_secret()
-                # end if
+        super(SSMCryptoConfigParser, self).__init__(
+            config_path, encoding, lazy)
+        # end def
+
+    def apply_settings(self):
+        super(SSMCryptoConfigParser, self).apply_settings()
+
+        if self.has_option(self.SETTING_SECTION_KEY,
+                           self.SECRETS_OPTION_KEY):
+            self.__secrets = SecretsManagerKeyProvider.parse_secrets(
+                self.get(
+                    self.SETTING_SECTION_KEY,
+                    self.SECRETS_OPTION_KEY))
+            # end if
+        if self.has_option(self.SETTING_SECTION_KEY,
+                           self.SECRET_NAME_OPTION_KEY):
+            # load key
+            self.__secret_name = self.get(
+                self.SETTING_SECTION_KEY, self.SECRET_NAME_OPTION_KEY)
+            # end if
+        if self.__secret_name or self.__secrets:
+            self.load_secret()
             # end if
         # end def
 
@@ -52,11 +66,22 @@ class SSMCryptoConfigParser(AESCryptoConfigParser):
 
     def set_secret_name(self, value: str):
         self.__secret_name = value
-        self.__cipher = None
+        self.clear_decrypt_cache()
         # end def
 
     secret_name = property(get_secret_name, set_secret_name)
 
+    def get_secrets(self) -> Dict[str, str]:
+        return dict(self.__secrets)
+        # end def
+
+    def set_secrets(self, value: Dict[str, str]):
+        self.__secrets = dict(value)
+        self.clear_decrypt_cache()
+        # end def
+
+    secrets = property(get_secrets, set_secrets)
+
     def get_profile(self) -> str:
         return self.__profile
         # end def
@@ -91,44 +116,29 @@ class SSMCryptoConfigParser(AESCryptoConfigParser):
             self.region = region
             # end if
 
-        if self.secret_name is None:
+        if self.secret_name is None and len(self.__secrets) == 0:
             return
             # end if
 
-        session = boto3.session.Session(profile_name=self.profile)
-        client = session.client(
-            service_name='secretsmanager',
-            region_name=self.region,
-        )
-
-        get_secret_value_response = client.get_secret_value(
-            SecretId=self.secret_name)
-        if 'SecretString' in get_secret_value_response:
-            secret = json.loads(get_secret_value_response['SecretString'])
-
-            self.__key = secret['key']
-            # end if
-
-        # init cipher
-        self.__cipher = AESCipher(self.__key)
+        # default secret and every alias in one round trip
+        provider = self.get_provider(SecretsManagerKeyProvider.SCHEME)
+        provider.reset()
+        provider.load()
         # end def
 
-    def decrypt(self, section: str, option: str) -> str:
-        if self.__cipher is None:
-            self.load_secret()
+    def is_encrypted_value(self, value: str) -> bool:
+        alias, sep, body = value.rpartition(SCHEME_SEPARATOR)
+        if sep and alias in self.__secrets:
+            return AESCipher.is_ciphertext(body)
             # end if
+        return super(SSMCryptoConfigParser, self).is_encrypted_value(value)
+        # end def
 
-        decrypted = None
-        if self.__cipher is None:
-            decrypted = super(
-                SSMCryptoConfigParser,
-                self).decrypt(
-                section,
-                option)
-        else:
-            raw = self.get(section, option)
-            decrypted = self.__cipher.decrypt(raw)
+    def default_scheme(self, value: str) -> str:
+        alias, sep, _ = value.rpartition(SCHEME_SEPARATOR)
+        if (sep and alias in self.__secrets) or self.__secret_name:
+            return SecretsManagerKeyProvider.SCHEME
             # end if
-        return decrypted
+        return super(SSMCryptoConfigParser, self).default_scheme(value)
         # end def
     # end class
@@ -0,0 +1,158 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import ctypes
+import ctypes.util
+import hmac
+import sys
+
+
+def _memory_lock_functions():
+    try:
+        if sys.platform == 'win32':
+            kernel32 = ctypes.windll.kernel32
+            return kernel32.VirtualLock, kernel32.VirtualUnlock
+            # end if
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        return libc.mlock, libc.munlock
+    except (AttributeError, OSError):
+        return None, None
+        # end try
+    # end def
+
+
+_LOCK, _UNLOCK = _memory_lock_functions()
+
+
+class SecretBuffer(object):
+
+    # mutable plaintext holder that can be zeroed explicitly;
+    # use as a context manager to wipe it deterministically
+
+    def __init__(self, size: int, lock: bool = False):
+        self.__buffer = bytearray(size)
+        self.__length = size
+        self.__pinned = None
+        if lock and size > 0:
+            self.lock()
+            # end if
+        # end def
+
+    @classmethod
+    def from_bytes(cls, data, lock: bool = False) -> 'SecretBuffer':
+        # copies data; wiping the source is the caller's business
+        buffer = cls(len(data), lock)
+        buffer.raw()[:] = data
+        return buffer
+        # end def
+
+    @classmethod
+    def from_str(cls, text: str, encoding: str = None,
+                 lock: bool = False) -> 'SecretBuffer':
+        return cls.from_bytes(
+            text.encode(encoding or sys.getdefaultencoding()), lock)
+        # end def
+
+    def get_locked(self) -> bool:
+        return self.__pinned is not None
+        # end def
+
+    locked = property(get_locked)
+
+    def lock(self) -> bool:
+        # best effort: mlock may be refused by RLIMIT_MEMLOCK
+        if self.__pinned is not None or _LOCK is None \
+                or len(self.__buffer) == 0:
+            return self.locked
+            # end if
+        pinned = (ctypes.c_char * len(self.__buffer)).from_buffer(
+            self.__buffer)
+        result = _LOCK(ctypes.c_void_p(ctypes.addressof(pinned)),
+                       ctypes.c_size_t(len(self.__buffer)))
+        # mlock returns 0 on success, VirtualLock returns non-zero
+        if (result != 0) == (sys.platform == 'win32'):
+            self.__pinned = pinned
+            # end if
+        return self.locked
+        # end def
+
+    def raw(self) -> memoryview:
+        # whole writable buffer, e.g. for pycryptodome's output=
+        return memoryview(self.__buffer)
+        # end def
+
+    def view(self) -> memoryview:
+        return memoryview(self.__buffer)[:self.__length]
+        # end def
+
+    def truncate(self, length: int):
+        if length < 0 or length > self.__length:
+            raise ValueError(f'invalid length: {length}')
+            # end if
+        self.raw()[length:self.__length] = bytes(self.__length - length)
+        self.__length = length
+        # end def
+
+    def tobytes(self) -> bytes:
+        # an immutable copy that cannot be wiped
+        return self.view().tobytes()
+        # end def
+
+    def decode(self, encoding: str = None) -> str:
+        return str(self.view(), encoding or sys.getdefaultencoding())
+        # end def
+
+    def wipe(self):
+        self.raw()[:] = bytes(len(self.__buffer))
+        self.__length = 0
+        if self.__pinned is not None:
+            _UNLOCK(ctypes.c_void_p(ctypes.addressof(self.__pinned)),
+                    ctypes.c_size_t(len(self.__buffer)))
+            self.__pinned = None
+            # end if
+        # end def
+
+    def __len__(self) -> int:
+        return self.__length
+        # end def
+
+    def __bytes__(self) -> bytes:
+        return self.tobytes()
+        # end def
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, SecretBuffer):
+            other = other.view()
+            # end if
+        if not isinstance(other, (bytes, bytearray, memoryview)):
+            return NotImplemented
+            # end if
+        return hmac.compare_digest(self.view(), other)
+        # end def
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'<SecretBuffer length={self.__length} locked={self.locked}>'
+        # end def
+
+    def __enter__(self) -> 'SecretBuffer':
+        return self
+        # end def
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wipe()
+        # end def
+
+    def __del__(self):
+        try:
+            self.wipe()
+        except Exception:
+            pass
+            # end try
+        # end def
+    # end class
@@ -0,0 +1,154 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import re
+import threading
+from configparser import (MAX_INTERPOLATION_DEPTH, Interpolation,
+                          InterpolationDepthError, InterpolationError,
+                          InterpolationMissingOptionError,
+                          InterpolationSyntaxError, NoOptionError,
+                          NoSectionError)
+from typing import List, Tuple
+
+
+class InterpolationCycleError(InterpolationError):
+
+    def __init__(self, option: str, section: str, chain: List[str]):
+        msg = ('Interpolation cycle detected: ' + ' -> '.join(chain))
+        super(InterpolationCycleError, self).__init__(option, section, msg)
+        self.chain = chain
+        # end def
+    # end class
+
+
+class SecretInterpolation(Interpolation):
+
+    # ${section:option} / ${option} like ExtendedInterpolation, but
+    # encrypted references are decrypted through the parser (and its
+    # decrypt cache). Composite values are memoized in the parser's
+    # decrypt cache together with the raw values they were built from,
+    # so a change to any referenced option invalidates them.
+
+    KIND = 'interpolated'
+    TOKEN_RE = re.compile(r'\$(\$|\{([^}]*)\})?')
+
+    def __init__(self):
+        self.__local = threading.local()
+        # end def
+
+    def __frames(self) -> List[Tuple[tuple, list]]:
+        if not hasattr(self.__local, 'frames'):
+            self.__local.frames = []
+            # end if
+        return self.__local.frames
+        # end def
+
+    @staticmethod
+    def __raw(parser, section: str, option: str) -> str:
+        try:
+            return parser.get(section, option, raw=True)
+        except (NoSectionError, NoOptionError):
+            return None
+            # end try
+        # end def
+
+    def before_get(self, parser, section: str, option: str, value: str,
+                   defaults) -> str:
+        if value is None or '$' not in value:
+            return value
+            # end if
+
+        frames = self.__frames()
+        key = (id(parser), section, parser.optionxform(option))
+        if any(frame_key == key for frame_key, _ in frames):
+            chain = [f'{frame_key[1]}:{frame_key[2]}'
+                     for frame_key, _ in frames]
+            raise InterpolationCycleError(
+                option, section, chain + [f'{section}:{option}'])
+            # end if
+
+        hit, cached = parser._cache_lookup(section, option, self.KIND, value)
+        if hit and all(self.__raw(parser, dep_section, dep_option) == raw
+                       for dep_section, dep_option, raw in cached[0]):
+            deps, result = cached
+        else:
+            if len(frames) >= MAX_INTERPOLATION_DEPTH:
+                raise InterpolationDepthError(option, section, value)
+                # end if
+            generation = parser._cache_generation()
+            collected = []
+            frames.append((key, collected))
+            try:
+                result = self.__interpolate(
+                    parser, section, option, value, collected)
+            finally:
+                frames.pop()
+                # end try
+            deps = tuple(collected)
+            # a composite expires with the first of its encrypted
+            # references, not with the backend of its own raw value
+            ttls = [parser._cache_ttl(raw) for dep_section, dep_option, raw
+                    in deps if parser.is_encrypted(dep_section, dep_option)]
+            ttls = [ttl for ttl in ttls if ttl is not None]
+            parser._cache_store(
+                section, option, self.KIND, value, (deps, result),
+                min(ttls) if ttls else None, generation)
+            # end if
+
+        # the enclosing value depends on everything this one depends on
+        if frames:
+            frames[-1][1].extend(deps)
+            # end if
+        return result
+        # end def
+
+    def __interpolate(self, parser, section: str, option: str, value: str,
+                      collected: list) -> str:
+        fragments = []
+        position = 0
+        for match in self.TOKEN_RE.finditer(value):
+            fragments.append(value[position:match.start()])
+            position = match.end()
+            if match.group(1) is None:
+                raise InterpolationSyntaxError(
+                    option, section,
+                    f"'$' must be followed by '$' or '{{', found: {value!r}")
+            elif match.group(1) == '$':
+                fragments.append('$')
+                continue
+                # end if
+
+            path = match.group(2).split(':')
+            if len(path) == 1:
+                ref_section, ref_option = section, path[0]
+            elif len(path) == 2:
+                ref_section, ref_option = path
+            else:
+                raise InterpolationSyntaxError(
+                    option, section,
+                    f'More than one ":" found: {match.group(0)!r}')
+                # end if
+
+            raw = self.__raw(parser, ref_section, ref_option)
+            if raw is None:
+                raise InterpolationMissingOptionError(
+                    option, section, value, match.group(2))
+                # end if
+            collected.append((ref_section, ref_option, raw))
+
+            # only references marked by a prefix or encrypted_options (or
+            # bare ones with legacy_bare) are decrypted; the rest is inlined
+            if parser.is_encrypted(ref_section, ref_option):
+                fragments.append(parser.decrypt(ref_section, ref_option))
+            else:
+                fragments.append(parser.get(ref_section, ref_option))
+                # end if
+            # end for
+        fragments.append(value[position:])
+        return ''.join(fragments)
+        # end def
+    # end class
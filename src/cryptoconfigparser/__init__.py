@@ -1,9 +1,43 @@
+from .SecretBuffer import SecretBuffer
 from .AESCryptoConfigParser import AESCipher, AESCryptoConfigParser
+from . import KeyFile
+from .KeyFile import InsecureKeyFileWarning
+from .KeyProvider import (KeyProvider, get_provider_class, provider_schemes,
+                          register_provider, unregister_provider)
+from .LocalKeyProvider import EnvKeyProvider, FileKeyProvider, LocalKeyProvider
+from .AWSKeyProvider import (EnvelopeKeyProvider, KMSKeyProvider,
+                             SecretsManagerKeyProvider,
+                             SSMParameterKeyProvider)
+from .FrozenCryptoConfig import FrozenCryptoConfig
 from .KMSCryptoConfigParser import KMSCryptoConfigParser
+from .LocalAWS import LocalAWS
+from .Profiler import DecryptTrace, Profiler
+from .SecretInterpolation import InterpolationCycleError, SecretInterpolation
 from .SSMCryptoConfigParser import SSMCryptoConfigParser
 
 __all__ = [
     'AESCryptoConfigParser',
     'AESCipher',
     'SSMCryptoConfigParser',
-    'KMSCryptoConfigParser']
+    'KMSCryptoConfigParser',
+    'FrozenCryptoConfig',
+    'KeyProvider',
+    'register_provider',
+    'unregister_provider',
+    'get_provider_class',
+    'provider_schemes',
+    'FileKeyProvider',
+    'EnvKeyProvider',
+    'LocalKeyProvider',
+    'SecretsManagerKeyProvider',
+    'SSMParameterKeyProvider',
+    'KMSKeyProvider',
+    'EnvelopeKeyProvider',
+    'LocalAWS',
+    'Profiler',
+    'DecryptTrace',
+    'SecretBuffer',
+    'KeyFile',
+    'InsecureKeyFileWarning',
+    'SecretInterpolation',
+    'InterpolationCycleError']
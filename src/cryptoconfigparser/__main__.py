@@ -0,0 +1,279 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# __author__ = 'Satoshi Imai'
+# __credits__ = ['Satoshi Imai']
+# __version__ = '0.9.0'
+# ---------------------------------------------------------------------------
+
+import argparse
+import json
+import sys
+import time
+from typing import List
+
+from . import KeyFile
+from .AESCryptoConfigParser import AESCryptoConfigParser
+from .Fleet import (CONFIG_PATTERNS, PARSERS, error_name, open_config,
+                    share_clients, walk_configs)
+from .Migration import (KMS_CONCURRENCY, MigrationTarget, Migrator,
+                        print_progress)
+from .Profiler import Profiler
+
+
+def open_parser(args: argparse.Namespace) -> AESCryptoConfigParser:
+    return open_config(args.config, args.encoding, args.parser, args.lazy,
+                       args.profile, args.region)
+    # end def
+
+
+def format_summary(profiler: Profiler) -> str:
+    loads = [trace for trace in profiler.traces if trace.kind == 'load']
+    summary = profiler.summary()
+    backends = summary['backends']
+    backends.pop('-', None)
+    count = summary['count'] - len(loads)
+
+    lines = []
+    for trace in loads:
+        lines.append(f'loaded in {trace.wall * 1e3:.1f} ms '
+                     f'({len(trace.calls)} calls: '
+                     f'{", ".join(trace.calls) or "-"})')
+        # end for
+    decrypt_wall = sum(stats['wall'] for stats in backends.values())
+    lines.append(
+        f'decrypted {count} options in {decrypt_wall * 1e3:.1f} ms: '
+        f'{summary["cache_hits"]} cache hits, '
+        f'{sum(stats["remote_calls"] for stats in backends.values())} '
+        f'backend calls, '
+        f'{sum(stats["errors"] for stats in backends.values())} errors')
+    if summary['untraced_calls']:
+        lines.append('untraced calls: ' + ', '.join(
+            f'{name} x{number}'
+            for name, number in summary['untraced_calls'].items()))
+        # end if
+
+    lines.append('')
+    lines.append(f'{"backend":<16}{"count":>7}{"hits":>7}{"calls":>7}'
+                 f'{"errors":>8}{"wall ms":>10}{"cpu ms":>10}')
+    for backend, stats in sorted(backends.items()):
+        lines.append(f'{backend:<16}{stats["count"]:>7}'
+                     f'{stats["cache_hits"]:>7}{stats["remote_calls"]:>7}'
+                     f'{stats["errors"]:>8}{stats["wall"] * 1e3:>10.1f}'
+                     f'{stats["cpu"] * 1e3:>10.1f}')
+        # end for
+
+    slowest = [entry for entry in summary['slowest']
+               if entry['kind'] != 'load']
+    if slowest:
+        lines.append('')
+        lines.append('slowest:')
+        for entry in slowest:
+            lines.append(f'  {entry["name"]:<32}{entry["backend"] or "-":<16}'
+                         f'{entry["wall"] * 1e3:>8.1f} ms  '
+                         f'{", ".join(entry["calls"])}')
+            # end for
+        # end if
+    return '\n'.join(lines)
+    # end def
+
+
+def profile(args: argparse.Namespace) -> int:
+    profiler = Profiler()
+    with profiler.activate():
+        with profiler.trace(None, None, 'load'):
+            parser = open_parser(args)
+            # end with
+        for section, option in parser.encrypted_options():
+            try:
+                parser.decrypt(section, option)
+            except Exception:
+                # recorded in the trace
+                pass
+                # end try
+            # end for
+        # end with
+
+    if args.format == 'summary':
+        report = format_summary(profiler)
+    elif args.format == 'chrome':
+        report = json.dumps(profiler.to_chrome_trace(), indent=2)
+    else:
+        report = json.dumps(profiler.to_json(), indent=2)
+        # end if
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+            # end with
+    else:
+        print(report)
+        # end if
+    return 0
+    # end def
+
+
+def migrate(args: argparse.Namespace) -> int:
+    if args.rewrap and not args.envelope_key_id:
+        print('--rewrap needs --envelope-key-id', file=sys.stderr)
+        return 2
+        # end if
+    target = MigrationTarget(args.key_file, args.key_format,
+                             args.deterministic, args.envelope_key_id,
+                             args.region, args.rewrap)
+    migrator = Migrator(
+        target, workers=args.workers, kms_concurrency=args.kms_concurrency,
+        state_path=args.state, encoding=args.encoding, parser=args.parser,
+        dry_run=args.dry_run, profile=args.profile, region=args.region,
+        legacy_bare=args.legacy_bare, progress=print_progress)
+    report = migrator.run(args.paths, args.pattern or CONFIG_PATTERNS)
+    for path, error in sorted(report.errors.items()):
+        print(f'{path}: {error}', file=sys.stderr)
+        # end for
+    print(f'{report.files} files: {report.migrated} migrated, '
+          f'{report.unchanged} unchanged, {report.resumed} resumed, '
+          f'{len(report.errors)} failed; {report.values} values '
+          f'in {report.elapsed:.1f}s' + (' (dry run)' if args.dry_run else ''))
+    return 1 if report.errors else 0
+    # end def
+
+
+def verify(args: argparse.Namespace) -> int:
+    # prints section.option and the error type of each value that does
+    # not decrypt, never a value
+    started = time.perf_counter()
+    clients = {}
+    files = checked = failed = 0
+    for path in walk_configs(args.paths, args.pattern or CONFIG_PATTERNS):
+        files += 1
+        try:
+            parser = open_config(path, args.encoding, args.parser,
+                                 profile=args.profile, region=args.region,
+                                 legacy_bare=args.legacy_bare)
+            options = parser.encrypted_options()
+            share_clients(parser, clients, {
+                parser.resolve_scheme(
+                    parser.get(section, option, raw=True))[0]
+                for section, option in options})
+            errors = parser.verify_all(options, args.workers)
+        except Exception as e:
+            print(f'{path}: {error_name(e)}')
+            failed += 1
+            continue
+            # end try
+        checked += len(options)
+        failed += len(errors)
+        for (section, option), error in sorted(errors.items()):
+            print(f'{path}: {section}.{option}: {error_name(error)}')
+            # end for
+        # end for
+    print(f'{files} files, {checked} values checked, {failed} failed '
+          f'in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    return 1 if failed else 0
+    # end def
+
+
+def add_parser_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('config', help='config file')
+    parser.add_argument('--parser', choices=['auto'] + list(PARSERS),
+                        default='auto', help='parser class (default: auto)')
+    parser.add_argument('--encoding', default=None)
+    parser.add_argument('--lazy', action='store_true',
+                        help='index sections and parse them on demand')
+    parser.add_argument('--aws-profile', dest='profile', default=None,
+                        help='AWS profile')
+    parser.add_argument('--region', default=None, help='AWS region')
+    # end def
+
+
+def build_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m cryptoconfigparser')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser(
+        'profile', help='load a config, decrypt every encrypted option '
+                        'and report where the time went')
+    add_parser_arguments(command)
+    command.add_argument('--format', choices=['summary', 'json', 'chrome'],
+                         default='summary')
+    command.add_argument('-o', '--output', default=None,
+                         help='write the report to a file')
+    command.set_defaults(handler=profile)
+
+    command = commands.add_parser(
+        'migrate', help='re-encrypt every encrypted option of many config '
+                        'files under a new key')
+    command.add_argument('paths', nargs='+', metavar='PATH',
+                         help='config files or directories')
+    targets = command.add_mutually_exclusive_group(required=True)
+    targets.add_argument('--key-file', default=None,
+                         help='re-encrypt under this key file')
+    targets.add_argument('--envelope-key-id', default=None,
+                         help='re-encrypt with a new KMS data key per file')
+    command.add_argument('--key-format', choices=KeyFile.KEY_FORMATS,
+                         default=KeyFile.KEY_FORMAT_TEXT)
+    command.add_argument('--deterministic', action='store_true',
+                         help='SIV ciphertexts; reruns leave files as they '
+                              'are')
+    command.add_argument('--rewrap', action='store_true',
+                         help='with --envelope-key-id: re-encrypt only the '
+                              'data key, leave the values as they are')
+    command.add_argument('--parser', choices=['auto'] + list(PARSERS),
+                         default='auto', help='parser class (default: auto)')
+    command.add_argument('--encoding', default=None)
+    command.add_argument('--aws-profile', dest='profile', default=None,
+                         help='AWS profile')
+    command.add_argument('--region', default=None, help='AWS region')
+    command.add_argument('--workers', type=int, default=None,
+                         help='worker processes (default: CPU count, '
+                              '0: in-process)')
+    command.add_argument('--kms-concurrency', type=int,
+                         default=KMS_CONCURRENCY,
+                         help='KMS decrypts in flight per worker')
+    command.add_argument('--state', default=None,
+                         help='state file for resuming an interrupted run')
+    command.add_argument('--pattern', action='append', default=None,
+                         help='file name pattern for directories '
+                              '(repeatable, default: *.ini *.conf *.cfg)')
+    command.add_argument('--dry-run', action='store_true',
+                         help='decrypt and re-encrypt but write nothing')
+    command.add_argument('--legacy-bare', action='store_true',
+                         help='also treat unprefixed values shaped like a '
+                              'ciphertext of the default backend as '
+                              'encrypted')
+    command.set_defaults(handler=migrate)
+
+    command = commands.add_parser(
+        'verify', help='check that every encrypted option decrypts; '
+                       'exits with 1 if any does not')
+    command.add_argument('paths', nargs='+', metavar='PATH',
+                         help='config files or directories')
+    command.add_argument('--parser', choices=['auto'] + list(PARSERS),
+                         default='auto', help='parser class (default: auto)')
+    command.add_argument('--encoding', default=None)
+    command.add_argument('--aws-profile', dest='profile', default=None,
+                         help='AWS profile')
+    command.add_argument('--region', default=None, help='AWS region')
+    command.add_argument('--workers', type=int,
+                         default=AESCryptoConfigParser.PREFETCH_WORKERS,
+                         help='decrypt threads per file')
+    command.add_argument('--legacy-bare', action='store_true',
+                         help='also treat unprefixed values shaped like a '
+                              'ciphertext of the default backend as '
+                              'encrypted')
+    command.add_argument('--pattern', action='append', default=None,
+                         help='file name pattern for directories '
+                              '(repeatable, default: *.ini *.conf *.cfg)')
+    command.set_defaults(handler=verify)
+    return parser
+    # end def
+
+
+def main(argv: List[str] = None) -> int:
+    args = build_argument_parser().parse_args(argv)
+    return args.handler(args)
+    # end def
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+    # end if
@@ -5,19 +5,31 @@
 # version = "0.9.0"
 # ---------------------------------------------------------------------------
 
+import asyncio
+import base64
+import codecs
+import dataclasses
+import hashlib
+import io
 import logging
+import os
 import random
 import shutil
 import string
 import sys
 import tempfile
+import threading
+import time
 from logging import Logger, StreamHandler
 from pathlib import Path
-from typing import Generator, Tuple
+from typing import Generator, Optional, Tuple
+from unittest.mock import patch
 
 import pytest
 
-from src.cryptoconfigparser import AESCipher, AESCryptoConfigParser
+from src.cryptoconfigparser import (AESCipher, AESCryptoConfigParser,
+                                    KeyFile, SecretBuffer)
+from src.cryptoconfigparser.__main__ import main
 
 
 @pytest.fixture(scope='session', autouse=True)
@@ -37,6 +49,7 @@ password={test_string[2]}
     with open(key_path, 'w') as file:
         file.write(test_string[0])
         # end with
+    os.chmod(key_path, 0o600)
 
     with open(config_path, 'w') as file:
         file.write(test_config)
@@ -102,6 +115,13 @@ def config_path(tempdir: Path) -> Generator[Path, None, None]:
     # end def
 
 
+def tamper(siv: str) -> str:
+    # still valid base64 of the same length, but the tag no longer matches
+    body = siv[len(AESCipher.SIV_PREFIX):]
+    return AESCipher.SIV_PREFIX + ('B' if body[0] == 'A' else 'A') + body[1:]
+    # end def
+
+
 @pytest.mark.run(order=10)
 def test_init(key_path: Path, config_path: Path, logger: Logger):
     logger.info('init')
@@ -192,3 +212,528 @@ def test_cipher(logger: Logger):
     cipher2 = AESCipher(key)
     assert data == cipher2.decrypt(encrypted.decode())
     # end def
+
+
+@pytest.mark.run(order=90)
+def test_decrypt_typed(
+        test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('decrypt_typed')
+
+    cipher = AESCipher(test_string[0])
+    my_config = AESCryptoConfigParser(config_path)
+    my_config.set('Test', 'port', cipher.encrypt('5432').decode())
+    my_config.set('Test', 'ratio', cipher.encrypt('0.5').decode())
+    my_config.set('Test', 'enabled', cipher.encrypt('yes').decode())
+    my_config.set('Test', 'creds', cipher.encrypt(
+        '{"user": "app", "roles": ["a", "b"]}').decode())
+
+    assert my_config.decrypt_str('Test', 'password') == test_string[1]
+    assert my_config.decrypt_int('Test', 'port') == 5432
+    assert my_config.decrypt_float('Test', 'ratio') == 0.5
+    assert my_config.decrypt_bool('Test', 'enabled') is True
+    assert my_config.decrypt_json('Test', 'creds')['roles'] == ['a', 'b']
+    assert my_config.decrypt_bytes(
+        'Test', 'password') == test_string[1].encode()
+    assert my_config.decrypt_int('Test', 'missing', fallback=1) == 1
+
+    with pytest.raises(ValueError):
+        my_config.decrypt_int('Test', 'password')
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=100)
+def test_decrypt_typed_cache(
+        test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('decrypt_typed_cache')
+
+    cipher = AESCipher(test_string[0])
+    my_config = AESCryptoConfigParser(config_path)
+    my_config.set('Test', 'creds', cipher.encrypt('{"user": "app"}').decode())
+
+    first = my_config.decrypt_json('Test', 'creds')
+    # the caller's copy can be changed without touching the cache
+    first['user'] = 'changed'
+    with patch.object(AESCipher, 'decrypt') as mock_decrypt:
+        second = my_config.decrypt_json('Test', 'creds')
+        assert second == {'user': 'app'}
+        assert second is not first
+        mock_decrypt.assert_not_called()
+        # end with
+
+    # a new ciphertext invalidates the entry
+    my_config.set('Test', 'creds', cipher.encrypt('{"user": "new"}').decode())
+    assert my_config.decrypt_json('Test', 'creds') == {'user': 'new'}
+    # end def
+
+
+@pytest.mark.run(order=110)
+def test_bind(test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('bind')
+
+    @dataclasses.dataclass
+    class Settings(object):
+        password: str
+        port: int
+        site: str = dataclasses.field(metadata={'encrypted': False})
+        timeout: Optional[float] = None
+        # end class
+
+    cipher = AESCipher(test_string[0])
+    my_config = AESCryptoConfigParser(config_path)
+    my_config.set('Test', 'port', cipher.encrypt('5432').decode())
+
+    settings = my_config.bind(Settings, 'Test')
+    assert settings == Settings(test_string[1], 5432, 'test.site')
+
+    my_config.set('Test', 'port', cipher.encrypt('not a number').decode())
+    with pytest.raises(ValueError) as e:
+        my_config.bind(Settings, 'Test')
+        # end with
+    assert 'Test.port: ValueError' in str(e.value)
+    assert 'not a number' not in str(e.value)
+    # end def
+
+
+@pytest.mark.run(order=120)
+def test_encrypted_options(
+        test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('encrypted_options')
+
+    my_config = AESCryptoConfigParser(config_path)
+    assert my_config.encrypted_options() == []
+    # bare ciphertexts only with the opt-in
+    my_config.legacy_bare = True
+    assert my_config.encrypted_options() == [('Test', 'password')]
+    my_config.legacy_bare = None
+
+    my_config.set('settings', 'encrypted_options', 'Test.password')
+    my_config.add_section('Other')
+    my_config.set('Other', 'token', f'file:{test_string[2]}')
+    my_config.set('Other', 'plain', 'plain')
+
+    assert my_config.encrypted_options() == [
+        ('Test', 'password'), ('Other', 'token')]
+    assert my_config.is_encrypted('Other', 'token')
+    assert not my_config.is_encrypted('Other', 'plain')
+
+    my_config.set('settings', 'encrypted_options', 'Test.*')
+    assert my_config.encrypted_options() == [
+        ('Test', 'site'), ('Test', 'password'), ('Other', 'token')]
+    # end def
+
+
+@pytest.mark.run(order=130)
+def test_prefetch(test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('prefetch')
+
+    cipher = AESCipher(test_string[0])
+    my_config = AESCryptoConfigParser(config_path)
+    my_config.add_section('Tenants')
+    for i in range(50):
+        my_config.set('Tenants', f'tenant{i}',
+                      'file:' + cipher.encrypt(f'secret{i}').decode())
+        # end for
+    # ciphertext shaped, but fails authentication
+    siv = cipher.encrypt('broken', AESCipher.MODE_SIV).decode()
+    my_config.set('Tenants', 'broken', 'file:' + tamper(siv))
+
+    result = my_config.prefetch(max_workers=4, chunk_size=8).result()
+
+    assert result.count == 50
+    assert list(result.errors.keys()) == [('Tenants', 'broken')]
+    assert result.elapsed > 0
+    with patch.object(AESCipher, 'decrypt') as mock_decrypt:
+        for i in range(50):
+            assert my_config.decrypt('Tenants', f'tenant{i}') == f'secret{i}'
+            # end for
+        mock_decrypt.assert_not_called()
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=140)
+def test_prefetch_awaitable(
+        test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('prefetch_awaitable')
+
+    my_config = AESCryptoConfigParser(config_path)
+
+    async def warm_up():
+        return await asyncio.wrap_future(
+            my_config.prefetch([('Test', 'password')]))
+        # end def
+
+    result = asyncio.run(warm_up())
+    assert result.count == 1
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+    # end def
+
+
+@pytest.mark.run(order=150)
+def test_from_memory(
+        test_string: Tuple[str], key_path: Path, logger: Logger):
+    logger.info('from_memory')
+
+    test_config = f'''
+[settings]
+key_file={str(key_path)}
+
+[Test]
+password={test_string[2]}
+'''
+
+    my_config = AESCryptoConfigParser.from_string(test_config)
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+    assert my_config.config_path is None
+
+    my_config = AESCryptoConfigParser.from_bytes(
+        test_config.encode('utf-8'), 'utf-8')
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+
+    my_config = AESCryptoConfigParser.from_fileobj(
+        io.BytesIO(test_config.encode('utf-8')))
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+
+    my_config = AESCryptoConfigParser.from_fileobj(io.StringIO(test_config))
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+    # end def
+
+
+@pytest.mark.run(order=160)
+def test_from_memory_with_key(
+        test_string: Tuple[str], key_path: Path, logger: Logger):
+    logger.info('from_memory_with_key')
+
+    with patch.object(codecs, 'open') as mock_open, \
+            patch.object(KeyFile, 'read_key') as mock_read_key:
+        my_config = AESCryptoConfigParser.from_dict(
+            {'settings': {'key_file': str(key_path)},
+             'Test': {'password': test_string[2]}},
+            key=test_string[0])
+        assert my_config.decrypt('Test', 'password') == test_string[1]
+
+        my_config = AESCryptoConfigParser.from_string(
+            f'[Test]\npassword={test_string[2]}\n',
+            key=test_string[0].encode())
+        assert my_config.decrypt('Test', 'password') == test_string[1]
+
+        mock_open.assert_not_called()
+        mock_read_key.assert_not_called()
+        # end with
+
+    my_config = AESCryptoConfigParser.from_string(
+        f'[Test]\npassword={test_string[2]}\n')
+    my_config.load_key(SecretBuffer.from_str(test_string[0]))
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+    # end def
+
+
+@pytest.mark.run(order=170)
+def test_deterministic_cipher(test_string: Tuple[str], logger: Logger):
+    logger.info('deterministic_cipher')
+
+    cipher = AESCipher(test_string[0], mode=AESCipher.MODE_SIV)
+    encrypted = cipher.encrypt(test_string[1])
+    assert encrypted == cipher.encrypt(test_string[1])
+    assert encrypted != cipher.encrypt(test_string[1] + 'x')
+    assert AESCipher.is_deterministic(encrypted)
+    assert not AESCipher.is_deterministic(test_string[2])
+
+    # detected on decrypt regardless of the mode the cipher was made with
+    assert AESCipher(test_string[0]).decrypt(encrypted) == test_string[1]
+    assert cipher.decrypt(test_string[2]) == test_string[1]
+    assert cipher.decrypt(cipher.encrypt('')) == ''
+
+    other = ''.join(reversed(test_string[0]))
+    with pytest.raises(ValueError):
+        AESCipher(other).decrypt(encrypted)
+        # end with
+
+    with pytest.raises(ValueError):
+        AESCipher(test_string[0], mode='ecb')
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=180)
+def test_deterministic_dedup(test_string: Tuple[str], logger: Logger):
+    logger.info('deterministic_dedup')
+
+    my_config = AESCryptoConfigParser.from_string(
+        '[settings]\ndeterministic=true\n', key=test_string[0])
+    assert my_config.deterministic
+    encrypted = my_config.encrypt_value(test_string[1])
+    assert encrypted == my_config.encrypt_value(test_string[1])
+    assert my_config.is_deterministic_value(encrypted)
+    assert not my_config.is_deterministic_value(
+        my_config.encrypt_value(test_string[1], deterministic=False))
+
+    for section in ('a', 'b', 'c'):
+        my_config.add_section(section)
+        my_config.set(section, 'password', encrypted)
+        # end for
+
+    provider = my_config.get_provider('file')
+    with patch.object(provider, 'decrypt',
+                      wraps=provider.decrypt) as mock_decrypt:
+        for section in ('a', 'b', 'c'):
+            assert my_config.decrypt(section, 'password') == test_string[1]
+            # end for
+        assert mock_decrypt.call_count == 1
+
+        my_config.clear_decrypt_cache()
+        result = my_config.prefetch(
+            [('a', 'password'), ('b', 'password'), ('c', 'password')]
+        ).result()
+        assert result.count == 3
+        assert mock_decrypt.call_count == 2
+        assert my_config.decrypt('c', 'password') == test_string[1]
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=190)
+def test_single_flight_key_load(
+        test_string: Tuple[str], key_path: Path, logger: Logger):
+    logger.info('single_flight_key_load')
+
+    KeyFile.clear_key_cache()
+    my_config = AESCryptoConfigParser.from_string(
+        f'[Test]\npassword={test_string[2]}\n')
+    # cold: no cipher until the first decrypt
+    my_config.key_file = key_path
+    read_key = KeyFile.read_key
+
+    def slow_read_key(*args, **kwargs):
+        time.sleep(0.05)
+        return read_key(*args, **kwargs)
+        # end def
+
+    barrier = threading.Barrier(64)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(my_config.decrypt('Test', 'password'))
+        # end def
+
+    with patch.object(KeyFile, 'read_key',
+                      side_effect=slow_read_key) as mock_read_key, \
+            patch.object(my_config, 'load_key_file',
+                         wraps=my_config.load_key_file) as mock_load:
+        threads = [threading.Thread(target=run) for i in range(64)]
+        for thread in threads:
+            thread.start()
+            # end for
+        for thread in threads:
+            thread.join()
+            # end for
+        # end with
+
+    assert results == [test_string[1]] * 64
+    assert mock_load.call_count == 1
+    assert mock_read_key.call_count == 1
+    # end def
+
+
+@pytest.mark.run(order=200)
+def test_verify_all(test_string: Tuple[str], key_path: Path, tempdir: Path,
+                    logger: Logger, capsys: pytest.CaptureFixture):
+    logger.info('verify_all')
+
+    cipher = AESCipher(test_string[0])
+    siv = cipher.encrypt(test_string[1], AESCipher.MODE_SIV).decode()
+    options = '\n'.join(
+        [f'option{i}=file:{cipher.encrypt(f"value{i}").decode()}'
+         for i in range(50)])
+    test_config = f'''[settings]
+key_file={str(key_path)}
+
+[Test]
+password=file:{test_string[2]}
+first=file:{siv}
+second=file:{siv}
+broken=file:{tamper(siv)}
+other_key=file:{AESCipher('x' * 32).encrypt(test_string[1]).decode()}
+{options}
+'''
+    my_config = AESCryptoConfigParser.from_string(test_config)
+    my_config.key_file = key_path
+    errors = my_config.verify_all(max_workers=4, chunk_size=8)
+    assert set(errors) == {('Test', 'broken'), ('Test', 'other_key')}
+
+    # nothing is cached
+    raw = my_config.get('Test', 'password', raw=True)
+    assert my_config._cache_lookup('Test', 'password', 'str', raw) \
+        == (False, None)
+    assert my_config.verify_all([('Test', 'first'), ('Test', 'second')]) \
+        == {}
+
+    config_path = tempdir.joinpath('verify.conf')
+    with open(config_path, 'w') as file:
+        file.write(test_config)
+        # end with
+    assert main(['verify', str(config_path)]) == 1
+    captured = capsys.readouterr()
+    assert captured.out.splitlines() == [
+        f'{config_path}: Test.broken: ValueError',
+        f'{config_path}: Test.other_key: ValueError']
+    assert test_string[1] not in captured.out + captured.err
+    assert captured.err.startswith('1 files, 55 values checked, 2 failed')
+
+    with open(config_path, 'w') as file:
+        file.write(test_config.replace(
+            f'broken=file:{tamper(siv)}', '').replace('other_key', '#'))
+        # end with
+    assert main(['verify', str(config_path)]) == 0
+    capsys.readouterr()
+
+    # a file that cannot be read fails instead of passing as empty
+    missing_path = tempdir.joinpath('missing.conf')
+    assert main(['verify', str(config_path), str(missing_path)]) == 1
+    captured = capsys.readouterr()
+    assert captured.out.splitlines() == [
+        f'{missing_path}: FileNotFoundError']
+    assert captured.err.startswith('2 files, 53 values checked, 1 failed')
+    # end def
+
+
+@pytest.mark.run(order=210)
+def test_verify_legacy(test_string: Tuple[str], key_path: Path, tempdir: Path,
+                       logger: Logger, capsys: pytest.CaptureFixture):
+    logger.info('verify_legacy')
+
+    # baseline format: bare ciphertexts without encrypted_options, and a
+    # plain URL that only looks like a file: value
+    cipher = AESCipher(test_string[0])
+    siv = cipher.encrypt(test_string[1], AESCipher.MODE_SIV).decode()
+    config_path = tempdir.joinpath('legacy.conf')
+    with open(config_path, 'w') as file:
+        file.write(f'''[settings]
+key_file={str(key_path)}
+
+[db]
+password={test_string[2]}
+broken={tamper(siv)}
+url=file:///var/data
+''')
+        # end with
+    # plain values shaped like ciphertexts
+    salt = base64.b64encode(bytes(range(32))).decode()
+    digest = hashlib.sha256(b'app').hexdigest()
+    plain_path = tempdir.joinpath('plain.conf')
+    with open(plain_path, 'w') as file:
+        file.write(f'''[settings]
+key_file={str(key_path)}
+
+[app]
+salt={salt}
+digest={digest}
+''')
+        # end with
+
+    # only prefixes and encrypted_options count by default
+    my_config = AESCryptoConfigParser(plain_path)
+    assert my_config.encrypted_options() == []
+    assert my_config.get('app', 'salt') == salt
+    assert my_config.get('app', 'digest') == digest
+    my_config = AESCryptoConfigParser(config_path)
+    assert my_config.encrypted_options() == []
+    assert main(['verify', str(config_path), str(plain_path)]) == 0
+    captured = capsys.readouterr()
+    assert captured.out == ''
+    assert captured.err.startswith('2 files, 0 values checked, 0 failed')
+
+    # bare ciphertexts with the opt-in
+    my_config.legacy_bare = True
+    assert my_config.encrypted_options() == [
+        ('db', 'password'), ('db', 'broken')]
+    assert not my_config.is_encrypted('db', 'url')
+    assert my_config.get('db', 'url') == 'file:///var/data'
+    assert my_config.decrypt('db', 'password') == test_string[1]
+    assert list(my_config.verify_all()) == [('db', 'broken')]
+
+    assert main(['verify', '--legacy-bare', str(config_path)]) == 1
+    captured = capsys.readouterr()
+    assert captured.out.splitlines() == [
+        f'{config_path}: db.broken: ValueError']
+    assert captured.err.startswith('1 files, 2 values checked, 1 failed')
+
+    # or with [settings] legacy_bare
+    my_config = AESCryptoConfigParser.from_string(
+        f'[settings]\nkey_file={key_path}\nlegacy_bare=true\n\n'
+        f'[db]\npassword={test_string[2]}\n')
+    assert my_config.encrypted_options() == [('db', 'password')]
+    # end def
+
+
+@pytest.mark.run(order=220)
+def test_decrypt_cache_bounds(
+        test_string: Tuple[str], key_path: Path, logger: Logger):
+    logger.info('decrypt_cache_bounds')
+
+    cipher = AESCipher(test_string[0])
+    options = '\n'.join(
+        f'option{i}=file:{cipher.encrypt(f"value{i}").decode()}'
+        for i in range(3))
+    my_config = AESCryptoConfigParser.from_string(
+        f'[settings]\nkey_file={key_path}\ndecrypt_cache_size=2\n\n'
+        f'[Test]\n{options}\n')
+    assert my_config.decrypt_cache_size == 2
+    for i in range(3):
+        assert my_config.decrypt('Test', f'option{i}') == f'value{i}'
+        # end for
+    # the least recently used entry is gone
+    raws = [my_config.get('Test', f'option{i}', raw=True) for i in range(3)]
+    assert my_config._cache_lookup('Test', 'option0', 'str', raws[0]) \
+        == (False, None)
+    assert my_config._cache_lookup('Test', 'option2', 'str', raws[2]) \
+        == (True, 'value2')
+
+    # entries expire after decrypt_cache_ttl
+    my_config.set('settings', 'decrypt_cache_ttl', '0')
+    assert my_config.decrypt('Test', 'option0') == 'value0'
+    assert my_config._cache_lookup('Test', 'option0', 'str', raws[0]) \
+        == (False, None)
+
+    # decrypt_secret() never reaches the cache
+    my_config.set('settings', 'decrypt_cache_ttl', '300')
+    my_config.clear_decrypt_cache()
+    with my_config.decrypt_secret('Test', 'option0') as secret:
+        assert secret.decode() == 'value0'
+        # end with
+    assert my_config._cache_lookup('Test', 'option0', 'str', raws[0]) \
+        == (False, None)
+    # end def
+
+
+@pytest.mark.run(order=230)
+def test_decrypt_cache_generation(
+        test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('decrypt_cache_generation')
+
+    my_config = AESCryptoConfigParser(config_path)
+    raw = my_config.get('Test', 'password', raw=True)
+    started = threading.Event()
+    release = threading.Event()
+    decrypt = AESCipher.decrypt
+
+    def slow_decrypt(cipher, enc):
+        started.set()
+        release.wait(5)
+        return decrypt(cipher, enc)
+        # end def
+
+    with patch.object(AESCipher, 'decrypt', slow_decrypt):
+        future = my_config.prefetch([('Test', 'password')])
+        assert started.wait(5)
+        # the key is replaced while the prefetch is decrypting
+        my_config.load_key('x' * 32)
+        release.set()
+        assert future.result().count == 1
+        # end with
+    # the stale plaintext is dropped
+    assert my_config._cache_lookup('Test', 'password', 'str', raw) \
+        == (False, None)
+    # end def
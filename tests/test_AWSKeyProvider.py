@@ -0,0 +1,215 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# author = 'Satoshi Imai'
+# credits = ['Satoshi Imai']
+# version = "0.9.0"
+# ---------------------------------------------------------------------------
+
+import logging
+import shutil
+import tempfile
+from logging import Logger, StreamHandler
+from pathlib import Path
+from typing import Dict, Generator
+
+import pytest
+
+from src.cryptoconfigparser import (AESCryptoConfigParser,
+                                    SSMParameterKeyProvider)
+
+
+class StubSSMClient(object):
+    # Parameter Store stand-in paging GetParametersByPath like the service
+
+    PAGE_SIZE = 10
+
+    def __init__(self, parameters: Dict[str, str]):
+        self.parameters = parameters
+        self.calls = []
+        # end def
+
+    def get_parameters(self, Names, WithDecryption=False):
+        self.calls.append(('get_parameters', Names))
+        return {
+            'Parameters': [{'Name': name, 'Value': self.parameters[name]}
+                           for name in Names if name in self.parameters],
+            'InvalidParameters': [name for name in Names
+                                  if name not in self.parameters]}
+        # end def
+
+    def get_paginator(self, operation_name: str):
+        stub = self
+
+        class Paginator(object):
+            def paginate(self, Path, Recursive=False, WithDecryption=False):
+                names = sorted(name for name in stub.parameters
+                               if name.startswith(Path.rstrip('/') + '/'))
+                for i in range(0, len(names), stub.PAGE_SIZE):
+                    stub.calls.append(('get_parameters_by_path', Path))
+                    yield {'Parameters': [
+                        {'Name': name, 'Value': stub.parameters[name]}
+                        for name in names[i:i + stub.PAGE_SIZE]]}
+                    # end for
+                # end def
+            # end class
+
+        return Paginator()
+        # end def
+    # end class
+
+
+@pytest.fixture(scope='session', autouse=True)
+def setup_and_teardown(config_path: Path):
+    # setup
+
+    options = '\n'.join([f'option{i}=ssm-param:' for i in range(25)])
+    test_config = f'''
+[settings]
+ssm_param_path=/app/prod/
+ssm_param_ttl=60
+
+[db]
+password=ssm-param:
+user=ssm-param:db/user
+outside=ssm-param:/shared/token
+
+[tenant]
+{options}
+'''
+
+    with open(config_path, 'w') as file:
+        file.write(test_config)
+        # end with
+
+    yield
+
+    # teardown
+    # end def
+
+
+@pytest.fixture(scope='module')
+def logger() -> Generator[Logger, None, None]:
+    log = logging.getLogger(__name__)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s')
+    s_handler = StreamHandler()
+    s_handler.setLevel(logging.INFO)
+    s_handler.setFormatter(formatter)
+    log.addHandler(s_handler)
+
+    yield log
+    # end def
+
+
+@pytest.fixture(scope='session')
+def tempdir() -> Generator[Path, None, None]:
+
+    tempdir = Path(tempfile.mkdtemp())
+    yield tempdir
+    if tempdir.exists():
+        shutil.rmtree(tempdir)
+        # end if
+    # end def
+
+
+@pytest.fixture(scope='session')
+def config_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('ssm_param.conf')
+    # end def
+
+
+@pytest.fixture
+def stub_client() -> Generator[StubSSMClient, None, None]:
+    parameters = {
+        '/app/prod/db/password': 'db password',
+        '/app/prod/db/user': 'db user',
+        '/shared/token': 'token'}
+    for i in range(25):
+        parameters[f'/app/prod/tenant/option{i}'] = f'value{i}'
+        # end for
+
+    yield StubSSMClient(parameters)
+    # end def
+
+
+@pytest.mark.run(order=10)
+def test_resolve(config_path: Path, logger: Logger):
+    logger.info('resolve')
+
+    my_config = AESCryptoConfigParser(config_path)
+    provider = my_config.get_provider(SSMParameterKeyProvider.SCHEME)
+
+    assert provider.root_path == '/app/prod'
+    assert provider.ttl == 60.0
+    assert provider.resolve('', 'db', 'password') == '/app/prod/db/password'
+    assert provider.resolve('db/user') == '/app/prod/db/user'
+    assert provider.resolve('/shared/token') == '/shared/token'
+    # end def
+
+
+@pytest.mark.run(order=20)
+def test_decrypt_loads_path_once(
+        config_path: Path, stub_client: StubSSMClient, logger: Logger):
+    logger.info('decrypt_loads_path_once')
+
+    my_config = AESCryptoConfigParser(config_path)
+    my_config.get_provider(SSMParameterKeyProvider.SCHEME).client = stub_client
+
+    assert my_config.decrypt('db', 'password') == 'db password'
+    assert my_config.decrypt('db', 'user') == 'db user'
+    for i in range(25):
+        assert my_config.decrypt('tenant', f'option{i}') == f'value{i}'
+        # end for
+
+    # 27 parameters in three pages
+    assert stub_client.calls == [
+        ('get_parameters_by_path', '/app/prod')] * 3
+    # end def
+
+
+@pytest.mark.run(order=30)
+def test_decrypt_options_mixes_path_and_names(
+        config_path: Path, stub_client: StubSSMClient, logger: Logger):
+    logger.info('decrypt_options_mixes_path_and_names')
+
+    my_config = AESCryptoConfigParser(config_path)
+    my_config.get_provider(SSMParameterKeyProvider.SCHEME).client = stub_client
+
+    decrypted = my_config.decrypt_options(
+        [('db', option) for option in my_config.options('db')])
+
+    assert decrypted[('db', 'outside')] == 'token'
+    assert decrypted[('db', 'password')] == 'db password'
+    assert ('get_parameters', ['/shared/token']) in stub_client.calls
+    # end def
+
+
+@pytest.mark.run(order=40)
+def test_ttl_expiry(
+        config_path: Path, stub_client: StubSSMClient, logger: Logger):
+    logger.info('ttl_expiry')
+
+    my_config = AESCryptoConfigParser(config_path)
+    my_config.set('settings', 'ssm_param_ttl', '0')
+    my_config.get_provider(SSMParameterKeyProvider.SCHEME).client = stub_client
+
+    assert my_config.decrypt('db', 'password') == 'db password'
+    stub_client.parameters['/app/prod/db/password'] = 'rotated'
+    assert my_config.decrypt('db', 'password') == 'rotated'
+    # end def
+
+
+@pytest.mark.run(order=50)
+def test_missing_parameter(
+        config_path: Path, stub_client: StubSSMClient, logger: Logger):
+    logger.info('missing_parameter')
+
+    my_config = AESCryptoConfigParser(config_path)
+    my_config.set('db', 'missing', 'ssm-param:')
+    my_config.get_provider(SSMParameterKeyProvider.SCHEME).client = stub_client
+
+    with pytest.raises(KeyError):
+        my_config.decrypt('db', 'missing')
+        # end with
+    # end def
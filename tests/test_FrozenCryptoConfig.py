@@ -0,0 +1,264 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# author = 'Satoshi Imai'
+# credits = ['Satoshi Imai']
+# version = "0.9.0"
+# ---------------------------------------------------------------------------
+
+import gc
+import logging
+import os
+import random
+import shutil
+import string
+import tempfile
+import weakref
+from configparser import NoOptionError, NoSectionError
+from logging import Logger, StreamHandler
+from pathlib import Path
+from typing import Generator, Tuple
+
+import pytest
+
+from src.cryptoconfigparser import (AESCipher, AESCryptoConfigParser,
+                                    FrozenCryptoConfig, LocalAWS,
+                                    SSMCryptoConfigParser)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def setup_and_teardown(key_path: Path, config_path: Path,
+                       test_string: Tuple[str]):
+    # setup
+
+    cipher = AESCipher(test_string[0])
+    test_config = f'''
+[settings]
+key_file={str(key_path)}
+encrypted_options=Test.password
+
+[Test]
+site=test.site
+password={test_string[2]}
+port=file:{cipher.encrypt('8080').decode()}
+enabled=file:{cipher.encrypt('yes').decode()}
+'''
+
+    with open(key_path, 'w') as file:
+        file.write(test_string[0])
+        # end with
+    os.chmod(key_path, 0o600)
+
+    with open(config_path, 'w') as file:
+        file.write(test_config)
+        # end with
+
+    yield
+
+    # teardown
+    # end def
+
+
+@pytest.fixture(scope='session')
+def test_string() -> Generator[Tuple[str], None, None]:
+
+    key = ''.join([random.choice(string.ascii_letters + string.digits)
+                   for i in range(32)])
+    data = ''.join([random.choice(string.ascii_letters + string.digits)
+                    for i in range(50)])
+
+    cipher = AESCipher(key)
+    encrypted = cipher.encrypt(data).decode()
+
+    yield (key, data, encrypted)
+    # end def
+
+
+@pytest.fixture(scope='module')
+def logger() -> Generator[Logger, None, None]:
+    log = logging.getLogger(__name__)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s')
+    s_handler = StreamHandler()
+    s_handler.setLevel(logging.INFO)
+    s_handler.setFormatter(formatter)
+    log.addHandler(s_handler)
+
+    yield log
+    # end def
+
+
+@pytest.fixture(scope='session')
+def tempdir() -> Generator[Path, None, None]:
+
+    tempdir = Path(tempfile.mkdtemp())
+    yield tempdir
+    if tempdir.exists():
+        shutil.rmtree(tempdir)
+        # end if
+    # end def
+
+
+@pytest.fixture(scope='session')
+def key_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('frozen.key')
+    # end def
+
+
+@pytest.fixture(scope='session')
+def config_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('frozen.conf')
+    # end def
+
+
+@pytest.mark.run(order=10)
+def test_read(config_path: Path, test_string: Tuple[str], logger: Logger):
+    logger.info('read')
+
+    my_config = AESCryptoConfigParser(config_path)
+    frozen = FrozenCryptoConfig(my_config)
+    assert frozen.sections() == my_config.sections()
+    assert frozen.options('Test') == my_config.options('Test')
+    assert frozen.has_section('Test')
+    assert frozen.has_option('Test', 'SITE')
+    assert not frozen.has_option('Test', 'missing')
+    assert frozen.get('Test', 'site') == 'test.site'
+    assert frozen.get('Test', 'password') == test_string[2]
+    assert frozen.get('Test', 'missing', fallback=None) is None
+    assert frozen.items('Test')[0] == ('site', 'test.site')
+    assert frozen.encrypted_options() == my_config.encrypted_options()
+
+    assert frozen.decrypt('Test', 'password') == test_string[1]
+    assert frozen.decrypt_int('Test', 'port') == 8080
+    assert frozen.decrypt_float('Test', 'port') == 8080.0
+    assert frozen.decrypt_bool('Test', 'enabled') is True
+    assert frozen.decrypt_int('Test', 'missing', fallback=0) == 0
+    with frozen.decrypt_secret('Test', 'password') as secret:
+        assert secret.decode() == test_string[1]
+        # end with
+
+    with pytest.raises(NoSectionError):
+        frozen.get('Missing', 'site')
+        # end with
+    with pytest.raises(NoOptionError):
+        frozen.decrypt('Test', 'missing')
+        # end with
+    with pytest.raises(ValueError):
+        frozen.decrypt('Test', 'site')
+        # end with
+    assert test_string[1] not in repr(frozen)
+
+    # compact: no per-instance dict, no reference to the parser
+    assert not hasattr(frozen, '__dict__')
+    parser_ref = weakref.ref(my_config)
+    del my_config
+    gc.collect()
+    assert parser_ref() is None
+    assert frozen.decrypt('Test', 'password') == test_string[1]
+    # end def
+
+
+@pytest.mark.run(order=20)
+def test_sharing(test_string: Tuple[str], logger: Logger):
+    logger.info('sharing')
+
+    cipher = AESCipher(test_string[0])
+    frozen = []
+    for i in range(3):
+        my_config = AESCryptoConfigParser.from_string(
+            f'[Test]\nsite=test.site\n'
+            f'password=file:{cipher.encrypt(f"value{i}").decode()}\n',
+            key=test_string[0])
+        frozen.append(FrozenCryptoConfig(my_config))
+        # end for
+    other = FrozenCryptoConfig(AESCryptoConfigParser.from_string(
+        f'[Test]\nsite=other.site\n'
+        f'password=file:{AESCipher("x" * 32).encrypt("other").decode()}\n',
+        key='x' * 32))
+
+    # one layout and one cipher for every config of the same shape and key
+    assert frozen[0].layout is frozen[2].layout
+    assert frozen[0].layout is other.layout
+    assert frozen[0].ciphers[0] is frozen[2].ciphers[0]
+    assert other.ciphers[0] is not frozen[0].ciphers[0]
+    # interned plain values
+    assert frozen[0].get('Test', 'site') is frozen[1].get('Test', 'site')
+    assert [config.decrypt('Test', 'password') for config in frozen] \
+        == ['value0', 'value1', 'value2']
+    assert other.decrypt('Test', 'password') == 'other'
+
+    # share() copies, so wiping the original leaves the shared one intact
+    shared = AESCipher.share(cipher)
+    assert shared is frozen[0].ciphers[0]
+    assert shared is not cipher
+    assert not hasattr(cipher, '__dict__')
+    cipher.wipe()
+    assert frozen[0].decrypt('Test', 'password') == 'value0'
+    # end def
+
+
+@pytest.mark.run(order=30)
+def test_secrets_manager(test_string: Tuple[str], logger: Logger):
+    logger.info('secrets_manager')
+
+    with LocalAWS(region='us-east-1', max_attempts=1) as aws:
+        aws.add_secret('prod/app', {'key': test_string[0]})
+        my_config = SSMCryptoConfigParser.from_string(f'''
+[settings]
+secret_name=prod/app
+encrypted_options=Test.password
+
+[Test]
+password={test_string[2]}
+''', region='us-east-1')
+        frozen = FrozenCryptoConfig(my_config)
+
+        my_config = SSMCryptoConfigParser.from_string(
+            '[Test]\npassword=ssm-param:/app/prod/password\n',
+            region='us-east-1')
+        with pytest.raises(ValueError) as error:
+            FrozenCryptoConfig(my_config)
+            # end with
+        assert 'Test.password' in str(error.value)
+        # end with
+
+    # the key was resolved when the snapshot was taken
+    assert frozen.decrypt('Test', 'password') == test_string[1]
+    # end def
+
+
+@pytest.mark.run(order=40)
+def test_legacy(key_path: Path, test_string: Tuple[str], logger: Logger):
+    logger.info('legacy')
+
+    # baseline format: a bare ciphertext without encrypted_options and a
+    # plain URL that only looks like a file: value
+    my_config = AESCryptoConfigParser.from_string(f'''
+[settings]
+key_file={str(key_path)}
+
+[db]
+password={test_string[2]}
+url=file:///var/data
+''')
+    # plain unless bare ciphertexts are opted in
+    assert FrozenCryptoConfig(my_config).get('db', 'password') \
+        == test_string[2]
+    my_config.legacy_bare = True
+    frozen = FrozenCryptoConfig(my_config)
+    assert frozen.encrypted_options() == [('db', 'password')]
+    assert frozen.decrypt('db', 'password') == test_string[1]
+    assert frozen.get('db', 'url') == 'file:///var/data'
+    with pytest.raises(ValueError):
+        frozen.decrypt('db', 'url')
+        # end with
+
+    with frozen.decrypt_secret('db', 'password') as secret:
+        assert secret.decode() == test_string[1]
+        # end with
+    assert frozen.decrypt_secret('db', 'missing', fallback=None) is None
+    with pytest.raises(NoOptionError):
+        frozen.decrypt_secret('db', 'missing')
+        # end with
+    # end def
@@ -6,6 +6,7 @@
 # ---------------------------------------------------------------------------
 
 import logging
+import os
 import random
 import shutil
 import string
@@ -19,7 +20,7 @@ from unittest.mock import Mock, patch
 import aws_encryption_sdk
 import pytest
 
-from src.cryptoconfigparser import AESCipher, KMSCryptoConfigParser
+from src.cryptoconfigparser import AESCipher, KMSCryptoConfigParser, LocalAWS
 
 
 @pytest.fixture(scope='session', autouse=True)
@@ -39,6 +40,7 @@ password={test_string[2]}
     with open(key_path, 'w') as file:
         file.write(test_string[0])
         # end with
+    os.chmod(key_path, 0o600)
 
     with open(comp_config_path, 'w') as file:
         file.write(test_config)
@@ -256,3 +258,62 @@ def test_encrypt(
 
     assert my_config.config_path == str(config_path)
     # end def
+
+
+@pytest.mark.run(order=100)
+def test_envelope(test_string: Tuple[str], logger: Logger):
+    logger.info('envelope')
+
+    with LocalAWS(region='us-east-1', max_attempts=1) as aws:
+        key_id = aws.create_key()
+        my_config = KMSCryptoConfigParser.from_string('[Test]\n')
+        data_key = my_config.generate_data_key(key_id)
+        assert my_config.get('settings', 'data_key') == data_key
+        assert my_config.get('settings', 'key_id') == key_id
+
+        encrypted = my_config.encrypt_envelope(test_string[1])
+        assert encrypted.startswith('envelope:gcm.')
+        # small next to an Encryption SDK message
+        assert len(encrypted) < 200
+        aws.reset_calls()
+
+        options = '\n'.join(
+            [f'option{i}={my_config.encrypt_envelope(f"value{i}")}'
+             for i in range(10)])
+        unprefixed = encrypted.partition(':')[2]
+        my_config = KMSCryptoConfigParser.from_string(f'''
+[settings]
+key_id={key_id}
+data_key={data_key}
+
+[Test]
+password={unprefixed}
+{options}
+''')
+        assert my_config.decrypt('Test', 'password') == test_string[1]
+        for i in range(10):
+            assert my_config.decrypt('Test', f'option{i}') == f'value{i}'
+            # end for
+        # one unwrap for the whole file
+        assert aws.calls == {'TrentService.Decrypt': 1}
+
+        new_key_id = aws.create_key()
+        rewrapped = my_config.rewrap_data_key(new_key_id)
+        assert rewrapped != data_key
+        assert my_config.get('settings', 'key_id') == new_key_id
+        assert aws.calls['TrentService.ReEncrypt'] == 1
+
+        reloaded = KMSCryptoConfigParser.from_string(
+            f'[settings]\nkey_id={new_key_id}\ndata_key={rewrapped}\n'
+            f'[Test]\npassword={encrypted}\n')
+        assert reloaded.decrypt('Test', 'password') == test_string[1]
+
+        # the old key no longer opens the rewrapped data key
+        reloaded = KMSCryptoConfigParser.from_string(
+            f'[settings]\nkey_id={key_id}\ndata_key={rewrapped}\n'
+            f'[Test]\npassword={encrypted}\n')
+        with pytest.raises(Exception):
+            reloaded.decrypt('Test', 'password')
+            # end with
+        # end with
+    # end def
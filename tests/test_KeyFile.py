@@ -0,0 +1,194 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# author = 'Satoshi Imai'
+# credits = ['Satoshi Imai']
+# version = "0.9.0"
+# ---------------------------------------------------------------------------
+
+import base64
+import logging
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import warnings
+from logging import Logger, StreamHandler
+from pathlib import Path
+from typing import Generator, Tuple
+from unittest.mock import patch
+
+import pytest
+
+from src.cryptoconfigparser import (AESCipher, AESCryptoConfigParser,
+                                    InsecureKeyFileWarning, KeyFile)
+
+
+@pytest.fixture(scope='session')
+def test_string() -> Generator[Tuple[str], None, None]:
+
+    key = ''.join([random.choice(string.ascii_letters + string.digits)
+                   for i in range(32)])
+    data = ''.join([random.choice(string.ascii_letters + string.digits)
+                    for i in range(50)])
+
+    cipher = AESCipher(key)
+    encrypted = cipher.encrypt(data).decode()
+
+    yield (key, data, encrypted)
+    # end def
+
+
+@pytest.fixture(scope='module')
+def logger() -> Generator[Logger, None, None]:
+    log = logging.getLogger(__name__)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s')
+    s_handler = StreamHandler()
+    s_handler.setLevel(logging.INFO)
+    s_handler.setFormatter(formatter)
+    log.addHandler(s_handler)
+
+    yield log
+    # end def
+
+
+@pytest.fixture
+def tempdir() -> Generator[Path, None, None]:
+
+    tempdir = Path(tempfile.mkdtemp())
+    KeyFile.clear_key_cache()
+    yield tempdir
+    KeyFile.clear_key_cache()
+    if tempdir.exists():
+        shutil.rmtree(tempdir)
+        # end if
+    # end def
+
+
+def write_key(path: Path, data: bytes, mode: int = 0o600):
+    with open(path, 'wb') as file:
+        file.write(data)
+        # end with
+    os.chmod(path, mode)
+    # end def
+
+
+@pytest.mark.run(order=10)
+def test_key_formats(
+        tempdir: Path, test_string: Tuple[str], logger: Logger):
+    logger.info('key_formats')
+
+    binary_key = os.urandom(32)
+    write_key(tempdir.joinpath('text.key'), test_string[0].encode() + b'\n')
+    write_key(tempdir.joinpath('binary.key'), binary_key)
+    write_key(tempdir.joinpath('base64.key'),
+              base64.b64encode(binary_key) + b'\n')
+
+    assert KeyFile.read_key(tempdir.joinpath('text.key')) == test_string[0]
+    assert KeyFile.read_key(
+        tempdir.joinpath('binary.key'), 'binary') == binary_key
+    assert KeyFile.read_key(
+        tempdir.joinpath('base64.key'), 'base64') == binary_key
+    with pytest.raises(ValueError):
+        KeyFile.read_key(tempdir.joinpath('text.key'), 'pem')
+        # end with
+
+    encrypted = AESCipher(binary_key).encrypt(test_string[1]).decode()
+    for key_format in ('binary', 'base64'):
+        my_config = AESCryptoConfigParser.from_string(f'''
+[settings]
+key_file={tempdir.joinpath(f"{key_format}.key")}
+key_format={key_format}
+
+[Test]
+password={encrypted}
+token=file:{tempdir.joinpath(f"{key_format}.key")}:{encrypted}
+''')
+        assert my_config.decrypt('Test', 'password') == test_string[1]
+        # file:<path>: keys follow [settings] key_format as well
+        assert my_config.decrypt('Test', 'token') == test_string[1]
+        # end for
+    # end def
+
+
+@pytest.mark.run(order=20)
+def test_key_cache(tempdir: Path, test_string: Tuple[str], logger: Logger):
+    logger.info('key_cache')
+
+    key_path = tempdir.joinpath('cached.key')
+    write_key(key_path, test_string[0].encode())
+    test_config = f'''
+[settings]
+key_file={key_path}
+
+[Test]
+password={test_string[2]}
+'''
+
+    with patch.object(KeyFile, 'read_key',
+                      wraps=KeyFile.read_key) as mock_read_key:
+        parsers = [AESCryptoConfigParser.from_string(test_config)
+                   for i in range(10)]
+        for my_config in parsers:
+            assert my_config.decrypt('Test', 'password') == test_string[1]
+            # end for
+        assert mock_read_key.call_count == 1
+        # one key read, but a cipher per parser: wiping one leaves the
+        # others and later parsers intact
+        assert len({id(my_config.get_cipher())
+                    for my_config in parsers}) == 10
+        parsers[0].get_cipher().wipe()
+        assert parsers[1].decrypt_secret('Test', 'password').decode() \
+            == test_string[1]
+        my_config = AESCryptoConfigParser.from_string(test_config)
+        assert my_config.decrypt('Test', 'password') == test_string[1]
+        assert mock_read_key.call_count == 1
+
+        # a replaced key file is read again
+        other_key = ''.join(reversed(test_string[0]))
+        write_key(key_path, other_key.encode() + b'\n')
+        my_config = AESCryptoConfigParser.from_string(
+            f'[settings]\nkey_file={key_path}\n[Test]\npassword='
+            f'{AESCipher(other_key).encrypt(test_string[1]).decode()}\n')
+        assert my_config.decrypt('Test', 'password') == test_string[1]
+        assert mock_read_key.call_count == 2
+        # end with
+
+    # the cached key is zeroed when the file changes and when the cache
+    # is cleared; ciphers already handed out keep their own copy
+    (_, data), = KeyFile._CACHE.values()
+    assert data == bytearray(other_key.encode())
+    write_key(key_path, test_string[0].encode())
+    my_config = AESCryptoConfigParser.from_string(test_config)
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+    assert data == bytearray(len(data))
+    (_, data), = KeyFile._CACHE.values()
+    KeyFile.clear_key_cache()
+    assert data == bytearray(len(data))
+    assert my_config.get_cipher().decrypt(test_string[2]) == test_string[1]
+    # end def
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='POSIX permissions')
+@pytest.mark.run(order=30)
+def test_permission_check(
+        tempdir: Path, test_string: Tuple[str], logger: Logger):
+    logger.info('permission_check')
+
+    key_path = tempdir.joinpath('open.key')
+    write_key(key_path, test_string[0].encode(), 0o644)
+
+    with pytest.warns(InsecureKeyFileWarning):
+        KeyFile.load_cipher(key_path, AESCipher)
+        # end with
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        # checked once per file and mode
+        KeyFile.load_cipher(key_path, AESCipher)
+        os.chmod(key_path, 0o600)
+        assert KeyFile.check_permissions(str(key_path))
+        # end with
+    # end def
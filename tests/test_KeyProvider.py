@@ -0,0 +1,252 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# author = 'Satoshi Imai'
+# credits = ['Satoshi Imai']
+# version = "0.9.0"
+# ---------------------------------------------------------------------------
+
+import json
+import logging
+import os
+import random
+import shutil
+import string
+import tempfile
+from logging import Logger, StreamHandler
+from pathlib import Path
+from typing import Generator, Tuple
+from unittest.mock import Mock, patch
+
+import boto3
+import pytest
+
+from src.cryptoconfigparser import (AESCipher, AESCryptoConfigParser,
+                                    KeyProvider, LocalKeyProvider,
+                                    get_provider_class, provider_schemes,
+                                    register_provider, unregister_provider)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def setup_and_teardown(key_path: Path, other_key_path: Path, config_path: Path,
+                       test_string: Tuple[str]):
+    # setup
+
+    other_cipher = AESCipher(test_string[3])
+    LocalKeyProvider.add_key('unit', test_string[0])
+    os.environ['TEST_PROVIDER_KEY'] = test_string[3]
+
+    test_config = f'''
+[settings]
+key_file={str(key_path)}
+
+[Test]
+site=test.site
+password={test_string[2]}
+file_password=file:{test_string[2]}
+other_password=file:{str(other_key_path)}:{other_cipher.encrypt(test_string[1]).decode()}
+env_password=env:TEST_PROVIDER_KEY:{other_cipher.encrypt(test_string[1]).decode()}
+local_password={LocalKeyProvider.encrypt('unit', test_string[1])}
+secret_a=secretsmanager:team-a:{test_string[2]}
+secret_b=secretsmanager:team-b:{other_cipher.encrypt(test_string[1]).decode()}
+parameter=ssm-param:/app/password
+'''
+
+    with open(key_path, 'w') as file:
+        file.write(test_string[0])
+        # end with
+    os.chmod(key_path, 0o600)
+
+    with open(other_key_path, 'w') as file:
+        file.write(test_string[3])
+        # end with
+    os.chmod(other_key_path, 0o600)
+
+    with open(config_path, 'w') as file:
+        file.write(test_config)
+        # end with
+
+    yield
+
+    # teardown
+    LocalKeyProvider.remove_key('unit')
+    os.environ.pop('TEST_PROVIDER_KEY', None)
+    # end def
+
+
+@pytest.fixture(scope='session')
+def test_string() -> Generator[Tuple[str], None, None]:
+
+    key = ''.join([random.choice(string.ascii_letters + string.digits)
+                   for i in range(32)])
+    data = ''.join([random.choice(string.ascii_letters + string.digits)
+                    for i in range(50)])
+    other_key = ''.join([random.choice(string.ascii_letters + string.digits)
+                         for i in range(32)])
+
+    cipher = AESCipher(key)
+    encrypted = cipher.encrypt(data).decode()
+
+    yield (key, data, encrypted, other_key)
+    # end def
+
+
+@pytest.fixture(scope='module')
+def logger() -> Generator[Logger, None, None]:
+    log = logging.getLogger(__name__)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s')
+    s_handler = StreamHandler()
+    s_handler.setLevel(logging.INFO)
+    s_handler.setFormatter(formatter)
+    log.addHandler(s_handler)
+
+    yield log
+    # end def
+
+
+@pytest.fixture(scope='session')
+def tempdir() -> Generator[Path, None, None]:
+
+    tempdir = Path(tempfile.mkdtemp())
+    yield tempdir
+    if tempdir.exists():
+        shutil.rmtree(tempdir)
+        # end if
+    # end def
+
+
+@pytest.fixture(scope='session')
+def key_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('provider.key')
+    # end def
+
+
+@pytest.fixture(scope='session')
+def other_key_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('provider_other.key')
+    # end def
+
+
+@pytest.fixture(scope='session')
+def config_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('provider.conf')
+    # end def
+
+
+@pytest.mark.run(order=10)
+def test_registry(logger: Logger):
+    logger.info('registry')
+
+    for scheme in ['file', 'env', 'local',
+                   'secretsmanager', 'ssm-param', 'kms']:
+        assert scheme in provider_schemes()
+        assert get_provider_class(scheme).SCHEME == scheme
+        # end for
+
+    with pytest.raises(KeyError):
+        get_provider_class('unknown')
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=20)
+def test_decrypt_local_backends(
+        test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('decrypt_local_backends')
+
+    my_config = AESCryptoConfigParser(config_path)
+
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+    assert my_config.decrypt('Test', 'file_password') == test_string[1]
+    assert my_config.decrypt('Test', 'other_password') == test_string[1]
+    assert my_config.decrypt('Test', 'env_password') == test_string[1]
+    assert my_config.decrypt('Test', 'local_password') == test_string[1]
+    # end def
+
+
+@pytest.mark.run(order=30)
+def test_register_provider(config_path: Path, logger: Logger):
+    logger.info('register_provider')
+
+    @register_provider('upper')
+    class UpperKeyProvider(KeyProvider):
+        def decrypt(self, payload: str,
+                    section: str = None, option: str = None) -> str:
+            return payload.upper()
+            # end def
+        # end class
+
+    try:
+        my_config = AESCryptoConfigParser(config_path)
+        my_config.set('Test', 'custom', 'upper:abc')
+
+        assert my_config.decrypt('Test', 'custom') == 'ABC'
+        assert isinstance(my_config.get_provider('upper'), UpperKeyProvider)
+    finally:
+        unregister_provider('upper')
+        # end try
+    # end def
+
+
+@pytest.mark.run(order=40)
+def test_decrypt_options_batches_secrets(
+        test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('decrypt_options_batches_secrets')
+
+    mock_client = Mock()
+    mock_client.batch_get_secret_value.return_value = {
+        'SecretValues': [
+            {'Name': 'team-a',
+             'SecretString': json.dumps({'key': test_string[0]})},
+            {'Name': 'team-b',
+             'SecretString': json.dumps({'key': test_string[3]})}],
+        'Errors': []}
+    mock_client.get_parameters.return_value = {
+        'Parameters': [{'Name': '/app/password', 'Value': 'parameter'}]}
+
+    mock_my_session = Mock()
+    mock_my_session.client.return_value = mock_client
+
+    with patch.object(boto3.session, 'Session', return_value=mock_my_session):
+        my_config = AESCryptoConfigParser(config_path)
+        decrypted = my_config.decrypt_options([
+            ('Test', 'password'),
+            ('Test', 'secret_a'),
+            ('Test', 'secret_b'),
+            ('Test', 'parameter')])
+        # end with
+
+    assert decrypted[('Test', 'password')] == test_string[1]
+    assert decrypted[('Test', 'secret_a')] == test_string[1]
+    assert decrypted[('Test', 'secret_b')] == test_string[1]
+    assert decrypted[('Test', 'parameter')] == 'parameter'
+    mock_client.batch_get_secret_value.assert_called_once()
+    mock_client.get_parameters.assert_called_once()
+    # end def
+
+
+@pytest.mark.run(order=50)
+def test_setting(config_path: Path, logger: Logger):
+    logger.info('setting')
+
+    my_config = AESCryptoConfigParser(config_path)
+    my_config.set('settings', 'encoding', 'from-settings')
+    my_config.set('settings', 'sections', 'from-settings')
+    my_config.set('settings', 'region', 'us-west-2')
+    provider = my_config.get_provider('file')
+
+    # parser attributes and methods outside PARSER_SETTINGS are not read
+    assert provider.setting('encoding') == 'from-settings'
+    assert provider.setting('sections') == 'from-settings'
+    assert provider.setting('decrypt', 'fallback') == 'fallback'
+    assert provider.setting('region') == 'us-west-2'
+
+    # listed properties still win when the parser has them
+    my_config.region = 'ap-northeast-1'
+    assert provider.setting('region') == 'ap-northeast-1'
+    my_config.region = lambda: 'not a setting'
+    assert provider.setting('region') == 'us-west-2'
+    # end def
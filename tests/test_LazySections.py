@@ -0,0 +1,286 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# author = 'Satoshi Imai'
+# credits = ['Satoshi Imai']
+# version = "0.9.0"
+# ---------------------------------------------------------------------------
+
+import configparser
+import logging
+import os
+import random
+import shutil
+import string
+import tempfile
+from logging import Logger, StreamHandler
+from pathlib import Path
+from typing import Generator, Tuple
+
+import pytest
+
+from src.cryptoconfigparser import AESCipher, AESCryptoConfigParser
+from src.cryptoconfigparser.LazySections import SectionIndex
+
+
+@pytest.fixture(scope='session', autouse=True)
+def setup_and_teardown(key_path: Path, config_path: Path,
+                       duplicate_config_path: Path, test_string: Tuple[str]):
+    # setup
+
+    tenants = '\n'.join([
+        f'[tenant{i}]\nname=tenant {i}\nnote=first line\n  second line\n'
+        for i in range(1000)])
+    test_config = f'''
+[DEFAULT]
+region=ap-northeast-1
+
+[settings]
+key_file={str(key_path)}
+
+{tenants}
+[Test]
+site=test.site
+password={test_string[2]}
+'''
+
+    with open(key_path, 'w') as file:
+        file.write(test_string[0])
+        # end with
+    os.chmod(key_path, 0o600)
+
+    with open(config_path, 'w') as file:
+        file.write(test_config)
+        # end with
+
+    with open(duplicate_config_path, 'w') as file:
+        file.write('[a]\nx=1\n[b]\ny=2\n[a]\nz=3\n')
+        # end with
+
+    yield
+
+    # teardown
+    # end def
+
+
+@pytest.fixture(scope='session')
+def test_string() -> Generator[Tuple[str], None, None]:
+
+    key = ''.join([random.choice(string.ascii_letters + string.digits)
+                   for i in range(32)])
+    data = ''.join([random.choice(string.ascii_letters + string.digits)
+                    for i in range(50)])
+
+    cipher = AESCipher(key)
+    encrypted = cipher.encrypt(data).decode()
+
+    yield (key, data, encrypted)
+    # end def
+
+
+@pytest.fixture(scope='module')
+def logger() -> Generator[Logger, None, None]:
+    log = logging.getLogger(__name__)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s')
+    s_handler = StreamHandler()
+    s_handler.setLevel(logging.INFO)
+    s_handler.setFormatter(formatter)
+    log.addHandler(s_handler)
+
+    yield log
+    # end def
+
+
+@pytest.fixture(scope='session')
+def tempdir() -> Generator[Path, None, None]:
+
+    tempdir = Path(tempfile.mkdtemp())
+    yield tempdir
+    if tempdir.exists():
+        shutil.rmtree(tempdir)
+        # end if
+    # end def
+
+
+@pytest.fixture(scope='session')
+def key_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('lazy.key')
+    # end def
+
+
+@pytest.fixture(scope='session')
+def config_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('lazy.conf')
+    # end def
+
+
+@pytest.fixture(scope='session')
+def duplicate_config_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('duplicate.conf')
+    # end def
+
+
+@pytest.mark.run(order=10)
+def test_lazy_matches_eager(config_path: Path, logger: Logger):
+    logger.info('lazy_matches_eager')
+
+    eager = AESCryptoConfigParser(config_path)
+    lazy = AESCryptoConfigParser(config_path, lazy=True)
+
+    assert lazy.lazy
+    assert isinstance(lazy._sections, SectionIndex)
+    assert lazy.sections() == eager.sections()
+    assert lazy.get('tenant10', 'note') == eager.get('tenant10', 'note')
+    assert lazy.get('tenant10', 'region') == 'ap-northeast-1'
+    assert lazy['tenant999']['name'] == 'tenant 999'
+    assert lazy.has_option('Test', 'site')
+    assert not lazy.has_section('DEFAULT')
+    assert not lazy.has_section('missing')
+    with pytest.raises(configparser.NoSectionError):
+        lazy.get('missing', 'name')
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=20)
+def test_lazy_cache_is_bounded(config_path: Path, logger: Logger):
+    logger.info('lazy_cache_is_bounded')
+
+    lazy = AESCryptoConfigParser(config_path, lazy=True)
+    # only [settings] has been parsed to find the key file
+    assert lazy._sections.cached_count == 1
+
+    for i in range(1000):
+        assert lazy.get(f'tenant{i}', 'name') == f'tenant {i}'
+        # end for
+    assert lazy._sections.cached_count == AESCryptoConfigParser.LAZY_CACHE_SIZE
+    # end def
+
+
+@pytest.mark.run(order=30)
+def test_lazy_changes_are_pinned(config_path: Path, logger: Logger):
+    logger.info('lazy_changes_are_pinned')
+
+    lazy = AESCryptoConfigParser(config_path, lazy=True)
+    lazy.set('tenant0', 'name', 'changed')
+    lazy.add_section('added')
+    lazy.set('added', 'name', 'added')
+    lazy.remove_section('tenant1')
+
+    for i in range(2, 1000):
+        lazy.get(f'tenant{i}', 'name')
+        # end for
+
+    assert lazy.get('tenant0', 'name') == 'changed'
+    assert lazy.get('added', 'name') == 'added'
+    assert not lazy.has_section('tenant1')
+    assert lazy.sections()[-1] == 'added'
+    # end def
+
+
+@pytest.mark.run(order=40)
+def test_lazy_decrypt(
+        test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('lazy_decrypt')
+
+    lazy = AESCryptoConfigParser(config_path, lazy=True)
+
+    assert lazy.decrypt('Test', 'password') == test_string[1]
+    # end def
+
+
+@pytest.mark.run(order=50)
+def test_lazy_duplicate_section(
+        duplicate_config_path: Path, logger: Logger):
+    logger.info('lazy_duplicate_section')
+
+    with pytest.raises(configparser.DuplicateSectionError):
+        AESCryptoConfigParser(duplicate_config_path, lazy=True)
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=60)
+def test_lazy_headers(tempdir: Path, logger: Logger):
+    logger.info('lazy_headers')
+
+    # as configparser's SECTCRE: anything after the closing bracket is
+    # ignored, and commented out headers are not headers
+    config_path = tempdir.joinpath('headers.conf')
+    with open(config_path, 'w') as file:
+        file.write('[a]\nx=1\n[b] ; note\ny=2\n;[c]\n[d]]\r\nz=3\n')
+        # end with
+    eager = AESCryptoConfigParser(config_path)
+    lazy = AESCryptoConfigParser(config_path, lazy=True)
+    assert lazy.sections() == eager.sections() == ['a', 'b', 'd]']
+    assert lazy.get('b', 'y') == eager.get('b', 'y') == '2'
+    assert lazy.get('d]', 'z') == '3'
+    # end def
+
+
+@pytest.mark.run(order=70)
+def test_lazy_encodings(tempdir: Path, logger: Logger):
+    logger.info('lazy_encodings')
+
+    config_path = tempdir.joinpath('bom.conf')
+    with open(config_path, 'w', encoding='utf-8-sig') as file:
+        file.write('[a]\nname=été\n[b]\nx=1\n')
+        # end with
+    lazy = AESCryptoConfigParser(config_path, 'utf-8-sig', lazy=True)
+    assert isinstance(lazy._sections, SectionIndex)
+    assert lazy.sections() == ['a', 'b']
+    assert lazy.get('a', 'name') == 'été'
+
+    # not ASCII compatible: parsed eagerly
+    config_path = tempdir.joinpath('utf16.conf')
+    with open(config_path, 'w', encoding='utf-16') as file:
+        file.write('[a]\nname=été\n[b]\nx=1\n')
+        # end with
+    assert not SectionIndex.supports('utf-16')
+    lazy = AESCryptoConfigParser(config_path, 'utf-16', lazy=True)
+    assert not isinstance(lazy._sections, SectionIndex)
+    assert lazy.sections() == ['a', 'b']
+    assert lazy.get('a', 'name') == 'été'
+
+    # a missing file gives an empty parser, as without lazy
+    lazy = AESCryptoConfigParser(tempdir.joinpath('missing.conf'), lazy=True)
+    assert not isinstance(lazy._sections, SectionIndex)
+    assert lazy.sections() == []
+    # end def
+
+
+@pytest.mark.run(order=80)
+def test_lazy_read_is_pinned(config_path: Path, logger: Logger):
+    logger.info('lazy_read_is_pinned')
+
+    lazy = AESCryptoConfigParser(config_path, lazy=True)
+    assert lazy.get('tenant0', 'name') == 'tenant 0'
+    lazy.read_string('[tenant0]\nextra=added\n[tenant1]\nextra=added\n')
+
+    for i in range(2, 1000):
+        lazy.get(f'tenant{i}', 'name')
+        # end for
+    assert lazy.get('tenant0', 'extra') == 'added'
+    assert lazy.get('tenant1', 'extra') == 'added'
+    assert lazy.get('tenant1', 'name') == 'tenant 1'
+    # end def
+
+
+@pytest.mark.run(order=90)
+def test_lazy_reset_defaults(config_path: Path, tempdir: Path,
+                             logger: Logger):
+    logger.info('lazy_reset_defaults')
+
+    other_path = tempdir.joinpath('no_defaults.conf')
+    with open(other_path, 'w') as file:
+        file.write('[a]\nx=1\n')
+        # end with
+    lazy = AESCryptoConfigParser(config_path, lazy=True)
+    assert lazy.get('tenant0', 'region') == 'ap-northeast-1'
+    lazy.reset_config(str(other_path))
+    assert lazy.sections() == ['a']
+    assert not lazy.has_option('a', 'region')
+    # end def
@@ -0,0 +1,176 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# author = 'Satoshi Imai'
+# credits = ['Satoshi Imai']
+# version = "0.9.0"
+# ---------------------------------------------------------------------------
+
+import logging
+import random
+import string
+import time
+from logging import Logger, StreamHandler
+from typing import Generator, Tuple
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+from src.cryptoconfigparser import (AESCipher, AESCryptoConfigParser,
+                                    KMSCryptoConfigParser, LocalAWS,
+                                    SSMCryptoConfigParser)
+
+
+@pytest.fixture(scope='session')
+def test_string() -> Generator[Tuple[str], None, None]:
+
+    key = ''.join([random.choice(string.ascii_letters + string.digits)
+                   for i in range(32)])
+    data = ''.join([random.choice(string.ascii_letters + string.digits)
+                    for i in range(50)])
+
+    cipher = AESCipher(key)
+    encrypted = cipher.encrypt(data).decode()
+
+    yield (key, data, encrypted)
+    # end def
+
+
+@pytest.fixture(scope='module')
+def logger() -> Generator[Logger, None, None]:
+    log = logging.getLogger(__name__)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s')
+    s_handler = StreamHandler()
+    s_handler.setLevel(logging.INFO)
+    s_handler.setFormatter(formatter)
+    log.addHandler(s_handler)
+
+    yield log
+    # end def
+
+
+@pytest.fixture
+def aws() -> Generator[LocalAWS, None, None]:
+    with LocalAWS(region='us-east-1', max_attempts=1, seed=0) as aws:
+        yield aws
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=10)
+def test_secrets_manager_batch(
+        aws: LocalAWS, test_string: Tuple[str], logger: Logger):
+    logger.info('secrets_manager_batch')
+
+    other_key = ''.join(reversed(test_string[0]))
+    aws.add_secret('prod/a', {'key': test_string[0]})
+    aws.add_secret('prod/b', {'key': other_key})
+
+    my_config = SSMCryptoConfigParser.from_string(f'''
+[settings]
+secrets=a=prod/a, b=prod/b
+
+[Test]
+first=a:{test_string[2]}
+second=b:{AESCipher(other_key).encrypt(test_string[1]).decode()}
+''', region='us-east-1')
+
+    assert my_config.decrypt('Test', 'first') == test_string[1]
+    assert my_config.decrypt('Test', 'second') == test_string[1]
+    assert aws.calls == {'secretsmanager.BatchGetSecretValue': 1}
+    # end def
+
+
+@pytest.mark.run(order=20)
+def test_parameter_store(aws: LocalAWS, logger: Logger):
+    logger.info('parameter_store')
+
+    for i in range(25):
+        aws.add_parameter(f'/app/tenant/option{i}', f'value{i}')
+        # end for
+    aws.add_parameter('/shared/token', 'token')
+    options = '\n'.join([f'option{i}=ssm-param:' for i in range(25)])
+
+    my_config = AESCryptoConfigParser.from_string(f'''
+[settings]
+ssm_param_path=/app
+region=us-east-1
+
+[tenant]
+{options}
+token=ssm-param:/shared/token
+''')
+
+    decrypted = my_config.decrypt_options(
+        [('tenant', option) for option in my_config.options('tenant')])
+    assert decrypted[('tenant', 'option24')] == 'value24'
+    assert decrypted[('tenant', 'token')] == 'token'
+    # 25 parameters in three pages, plus one GetParameters
+    assert aws.calls == {'AmazonSSM.GetParametersByPath': 3,
+                         'AmazonSSM.GetParameters': 1}
+    # end def
+
+
+@pytest.mark.run(order=30)
+def test_kms_round_trip(
+        aws: LocalAWS, test_string: Tuple[str], logger: Logger):
+    logger.info('kms_round_trip')
+
+    key_id = aws.create_key()
+    my_config = KMSCryptoConfigParser.from_string(
+        f'[settings]\nkey_id={key_id}\n')
+    encrypted, _ = my_config.encrypt(test_string[1])
+    my_config.add_section('Test')
+    my_config.set('Test', 'password', encrypted)
+
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+    assert aws.calls == {'TrentService.GenerateDataKey': 1,
+                         'TrentService.Decrypt': 1}
+
+    client = boto3.client('kms')
+    blob = client.encrypt(KeyId=key_id, Plaintext=b'data')['CiphertextBlob']
+    other_key_id = aws.create_key()
+    blob = client.re_encrypt(
+        CiphertextBlob=blob,
+        DestinationKeyId=other_key_id)['CiphertextBlob']
+    response = client.decrypt(CiphertextBlob=blob)
+    assert response['Plaintext'] == b'data'
+    assert response['KeyId'] == other_key_id
+    with pytest.raises(ClientError) as error:
+        client.decrypt(CiphertextBlob=blob, KeyId=key_id)
+        # end with
+    assert error.value.response['Error']['Code'] == 'IncorrectKeyException'
+    # end def
+
+
+@pytest.mark.run(order=40)
+def test_fault_injection(
+        aws: LocalAWS, test_string: Tuple[str], logger: Logger):
+    logger.info('fault_injection')
+
+    aws.add_secret('prod/a', {'key': test_string[0]})
+    client = boto3.client('secretsmanager')
+
+    aws.inject_error('secretsmanager.GetSecretValue',
+                     'ResourceNotFoundException', 400)
+    with pytest.raises(ClientError) as error:
+        client.get_secret_value(SecretId='prod/a')
+        # end with
+    assert error.value.response['Error']['Code'] == \
+        'ResourceNotFoundException'
+    assert client.get_secret_value(SecretId='prod/a')['Name'] == 'prod/a'
+
+    aws.throttle_rate = 1.0
+    with pytest.raises(ClientError) as error:
+        client.get_secret_value(SecretId='prod/a')
+        # end with
+    assert error.value.response['Error']['Code'] == 'ThrottlingException'
+    aws.throttle_rate = 0.0
+
+    aws.latency = 0.1
+    started = time.perf_counter()
+    client.get_secret_value(SecretId='prod/a')
+    assert time.perf_counter() - started >= 0.1
+    assert aws.calls['secretsmanager.GetSecretValue'] == 4
+    # end def
@@ -0,0 +1,454 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# author = 'Satoshi Imai'
+# credits = ['Satoshi Imai']
+# version = "0.9.0"
+# ---------------------------------------------------------------------------
+
+import logging
+import os
+import random
+import shutil
+import string
+import tempfile
+from logging import Logger, StreamHandler
+from pathlib import Path
+from typing import Generator, Tuple
+from unittest.mock import call, patch
+
+import pytest
+
+from src.cryptoconfigparser import (AESCipher, AESCryptoConfigParser,
+                                    KMSCryptoConfigParser, LocalAWS, Migration)
+from src.cryptoconfigparser.__main__ import main
+from src.cryptoconfigparser.KeyProvider import split_scheme
+from src.cryptoconfigparser.Migration import (MigrationTarget, Migrator,
+                                              migrate_file, rewrite_values,
+                                              target_cipher)
+
+
+@pytest.fixture(scope='session')
+def test_string() -> Generator[Tuple[str], None, None]:
+
+    key = ''.join([random.choice(string.ascii_letters + string.digits)
+                   for i in range(32)])
+    new_key = ''.join([random.choice(string.ascii_letters + string.digits)
+                       for i in range(32)])
+    data = ''.join([random.choice(string.ascii_letters + string.digits)
+                    for i in range(50)])
+
+    yield (key, new_key, data)
+    # end def
+
+
+@pytest.fixture(scope='module')
+def logger() -> Generator[Logger, None, None]:
+    log = logging.getLogger(__name__)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s')
+    s_handler = StreamHandler()
+    s_handler.setLevel(logging.INFO)
+    s_handler.setFormatter(formatter)
+    log.addHandler(s_handler)
+
+    yield log
+    # end def
+
+
+@pytest.fixture
+def tempdir() -> Generator[Path, None, None]:
+
+    tempdir = Path(tempfile.mkdtemp())
+    yield tempdir
+    if tempdir.exists():
+        shutil.rmtree(tempdir)
+        # end if
+    # end def
+
+
+@pytest.fixture
+def fleet(tempdir: Path, test_string: Tuple[str]) -> Path:
+    # three configs under the old key, one of them in a sub directory
+    old_key_path = tempdir.joinpath('old.key')
+    new_key_path = tempdir.joinpath('new.key')
+    for path, key in ((old_key_path, test_string[0]),
+                      (new_key_path, test_string[1])):
+        with open(path, 'w') as file:
+            file.write(key)
+            # end with
+        os.chmod(path, 0o600)
+        # end for
+
+    cipher = AESCipher(test_string[0])
+    configs = tempdir.joinpath('configs')
+    configs.joinpath('sub').mkdir(parents=True)
+    for i, name in enumerate(['a.conf', 'b.ini', 'sub/c.cfg']):
+        with open(configs.joinpath(name), 'w') as file:
+            file.write(f'''# service {i}
+[settings]
+key_file={old_key_path}
+encrypted_options=Test.password
+
+[Test]
+site=test{i}.site
+; rotated every year
+password={cipher.encrypt(f'{test_string[2]}{i}').decode()}
+token=file:{cipher.encrypt(f'token{i}').decode()}
+''')
+            # end with
+        # end for
+    with open(configs.joinpath('notes.txt'), 'w') as file:
+        file.write('not a config\n')
+        # end with
+    return configs
+    # end def
+
+
+def tamper(siv: str) -> str:
+    # still valid base64 of the same length, but the tag no longer matches
+    body = siv[len(AESCipher.SIV_PREFIX):]
+    return AESCipher.SIV_PREFIX + ('B' if body[0] == 'A' else 'A') + body[1:]
+    # end def
+
+
+def assert_migrated(configs: Path, test_string: Tuple[str]):
+    for i, name in enumerate(['a.conf', 'b.ini', 'sub/c.cfg']):
+        my_config = AESCryptoConfigParser(configs.joinpath(name))
+        assert my_config.key_file == str(
+            configs.parent.joinpath('new.key'))
+        assert my_config.decrypt('Test', 'password') == f'{test_string[2]}{i}'
+        assert my_config.decrypt('Test', 'token') == f'token{i}'
+        # end for
+    # end def
+
+
+@pytest.mark.run(order=10)
+def test_rewrite_values(logger: Logger):
+    logger.info('rewrite_values')
+
+    text = ('# header\r\n[Test]\r\n; comment\r\npassword = old \r\n'
+            'Other: keep\r\n')
+    rewritten, applied = rewrite_values(
+        text, {('Test', 'password'): 'new', ('Test', 'other'): 'changed'},
+        {'key_file': '/new.key'})
+    assert applied == 2
+    assert rewritten == ('[settings]\r\nkey_file=/new.key\r\n\r\n'
+                         '# header\r\n[Test]\r\n; comment\r\n'
+                         'password = new \r\nOther: changed\r\n')
+
+    text = '[settings]\nkey_file=/old.key\n\n[Test]\npassword=old\n'
+    rewritten, applied = rewrite_values(
+        text, {}, {'key_file': '/new.key', 'deterministic': 'true'})
+    assert applied == 0
+    assert rewritten == ('[settings]\ndeterministic=true\n'
+                         'key_file=/new.key\n\n[Test]\npassword=old\n')
+    # end def
+
+
+@pytest.mark.run(order=20)
+def test_migrate_key_file(fleet: Path, test_string: Tuple[str],
+                          logger: Logger):
+    logger.info('migrate_key_file')
+
+    new_key_path = str(fleet.parent.joinpath('new.key'))
+    target = MigrationTarget(new_key_path, deterministic=True)
+    report = Migrator(target, workers=0).run([fleet])
+    assert report.files == 3
+    assert report.migrated == 3
+    assert report.values == 6
+    assert report.errors == {}
+    assert_migrated(fleet, test_string)
+
+    with open(fleet.joinpath('a.conf')) as file:
+        text = file.read()
+        # end with
+    assert text.startswith('# service 0\n[settings]\ndeterministic=true\n')
+    assert '; rotated every year\npassword=siv.' in text
+    assert 'token=file:siv.' in text
+
+    # deterministic ciphertexts under the same key: nothing to write
+    versions = [os.stat(fleet.joinpath(name)).st_mtime_ns
+                for name in ('a.conf', 'b.ini', 'sub/c.cfg')]
+    report = Migrator(target, workers=0).run([fleet])
+    assert report.migrated == 0
+    assert report.unchanged == 3
+    assert versions == [os.stat(fleet.joinpath(name)).st_mtime_ns
+                        for name in ('a.conf', 'b.ini', 'sub/c.cfg')]
+
+    dry_run = migrate_file(str(fleet.joinpath('a.conf')),
+                           MigrationTarget(new_key_path), dry_run=True)
+    assert dry_run.status == 'migrated'
+    with open(fleet.joinpath('a.conf')) as file:
+        assert file.read() == text
+        # end with
+
+    # a missing path is reported like any other failing file
+    missing_path = str(fleet.joinpath('missing.conf'))
+    report = Migrator(target, workers=0).run([fleet, missing_path])
+    assert report.files == 4
+    assert report.unchanged == 3
+    assert report.errors == {missing_path: 'FileNotFoundError'}
+    # end def
+
+
+@pytest.mark.run(order=30)
+def test_resume(fleet: Path, tempdir: Path, test_string: Tuple[str],
+                logger: Logger):
+    logger.info('resume')
+
+    state_path = tempdir.joinpath('migrate.state')
+    target = MigrationTarget(str(tempdir.joinpath('new.key')))
+    progress = []
+    migrator = Migrator(target, workers=0, state_path=state_path,
+                        progress=progress.append)
+    report = migrator.run([fleet])
+    assert report.migrated == 3
+    assert report.resumed == 0
+    assert progress[-1].startswith('3/3 files, 6 values, ')
+
+    # a finished run is not repeated
+    report = migrator.run([fleet])
+    assert report.resumed == 3
+    assert report.migrated == 0
+
+    # a file changed after it was recorded is done again
+    config_path = fleet.joinpath('b.ini')
+    with open(config_path, 'a') as file:
+        file.write('# edited\n')
+        # end with
+    report = migrator.run([fleet])
+    assert report.resumed == 2
+    assert report.migrated == 1
+    assert_migrated(fleet, test_string)
+    # end def
+
+
+@pytest.mark.run(order=40)
+def test_process_pool(fleet: Path, tempdir: Path, test_string: Tuple[str],
+                      logger: Logger):
+    logger.info('process_pool')
+
+    broken_path = fleet.joinpath('broken.conf')
+    siv = AESCipher(test_string[0]).encrypt(
+        test_string[2], AESCipher.MODE_SIV).decode()
+    with open(broken_path, 'w') as file:
+        file.write(f'[settings]\nkey_file={tempdir.joinpath("old.key")}\n\n'
+                   f'[Test]\npassword=file:{tamper(siv)}\n')
+        # end with
+    text = broken_path.read_text()
+
+    target = MigrationTarget(str(tempdir.joinpath('new.key')))
+    report = Migrator(target, workers=2).run([fleet])
+    assert report.files == 4
+    assert report.migrated == 3
+    # the location and exception type only, never the value
+    assert report.errors == {str(broken_path): 'Test.password: ValueError'}
+    assert tamper(siv) not in str(report)
+    assert broken_path.read_text() == text
+    assert_migrated(fleet, test_string)
+    # end def
+
+
+@pytest.mark.run(order=50)
+def test_kms(tempdir: Path, test_string: Tuple[str], logger: Logger):
+    logger.info('kms')
+
+    with LocalAWS(region='us-east-1', max_attempts=1) as aws:
+        key_id = aws.create_key()
+        my_config = KMSCryptoConfigParser.from_string(
+            f'[settings]\nkey_id={key_id}\n')
+        options = '\n'.join(
+            f'option{i}=kms:{my_config.encrypt(f"value{i}")[0]}'
+            for i in range(8))
+        config_path = tempdir.joinpath('kms.conf')
+        with open(config_path, 'w') as file:
+            file.write(f'[settings]\nkey_id={key_id}\n\n[Test]\n{options}\n')
+            # end with
+        aws.reset_calls()
+
+        # KMS -> key file, decrypts pipelined
+        key_path = tempdir.joinpath('new.key')
+        with open(key_path, 'w') as file:
+            file.write(test_string[1])
+            # end with
+        os.chmod(key_path, 0o600)
+        result = migrate_file(str(config_path),
+                              MigrationTarget(str(key_path)),
+                              kms_concurrency=4)
+        assert result.status == 'migrated'
+        assert result.values == 8
+        assert aws.calls == {'TrentService.Decrypt': 8}
+        my_config = KMSCryptoConfigParser(config_path)
+        for i in range(8):
+            assert my_config.get('Test', f'option{i}').startswith('file:')
+            assert my_config.decrypt('Test', f'option{i}') == f'value{i}'
+            # end for
+
+        # key file -> envelope, one data key for the file
+        aws.reset_calls()
+        result = migrate_file(str(config_path),
+                              MigrationTarget(envelope_key_id=key_id))
+        assert result.status == 'migrated'
+        assert aws.calls == {'TrentService.GenerateDataKey': 1}
+        my_config = KMSCryptoConfigParser(config_path)
+        for i in range(8):
+            assert my_config.get('Test', f'option{i}').startswith(
+                'envelope:gcm.')
+            assert my_config.decrypt('Test', f'option{i}') == f'value{i}'
+            # end for
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=55)
+def test_kms_profile(logger: Logger):
+    logger.info('kms_profile')
+
+    # the KMS client of --envelope-key-id honours --aws-profile and is
+    # cached per profile and region
+    key_id = 'arn:aws:kms:eu-west-1:123456789012:key/test'
+    my_config = AESCryptoConfigParser.from_string('[settings]\n')
+    target = MigrationTarget(envelope_key_id=key_id)
+    with patch.object(Migration.boto3.session, 'Session') as mock_session, \
+            patch.dict(Migration._KMS_CLIENTS, clear=True):
+        client = mock_session.return_value.client.return_value
+        client.generate_data_key.return_value = {
+            'Plaintext': bytes(32), 'CiphertextBlob': b'blob'}
+        target_cipher(my_config, target, 'app')
+        target_cipher(my_config, target, 'app')
+        target_cipher(my_config, target, 'other')
+        assert mock_session.call_args_list == [
+            call(profile_name='app'), call(profile_name='other')]
+        mock_session.return_value.client.assert_called_with(
+            'kms', region_name='eu-west-1')
+        assert set(Migration._KMS_CLIENTS) == {
+            ('app', 'eu-west-1'), ('other', 'eu-west-1')}
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=60)
+def test_cli(fleet: Path, tempdir: Path, test_string: Tuple[str],
+             logger: Logger, capsys: pytest.CaptureFixture):
+    logger.info('cli')
+
+    new_key_path = str(tempdir.joinpath('new.key'))
+    assert main(['migrate', str(fleet), '--key-file', new_key_path,
+                 '--workers', '0', '--dry-run']) == 0
+    assert '3 migrated' in capsys.readouterr().out
+    assert main(['migrate', str(fleet), '--key-file', new_key_path,
+                 '--workers', '0', '--pattern', '*.conf']) == 0
+    captured = capsys.readouterr()
+    assert captured.out.startswith('1 files: 1 migrated')
+    assert '1/1 files' in captured.err
+
+    siv = AESCipher(test_string[1]).encrypt(
+        test_string[2], AESCipher.MODE_SIV).decode()
+    with open(fleet.joinpath('broken.ini'), 'w') as file:
+        file.write(f'[settings]\nkey_file={new_key_path}\n\n'
+                   f'[Test]\npassword=file:{tamper(siv)}\n')
+        # end with
+    assert main(['migrate', str(fleet), '--key-file', new_key_path,
+                 '--workers', '0']) == 1
+    assert 'broken.ini: Test.password: ValueError' in capsys.readouterr().err
+    # end def
+
+
+@pytest.mark.run(order=70)
+def test_legacy(tempdir: Path, test_string: Tuple[str], logger: Logger,
+                capsys: pytest.CaptureFixture):
+    logger.info('legacy')
+
+    # baseline format: a bare ciphertext without encrypted_options and a
+    # plain URL that only looks like a file: value
+    old_key_path = tempdir.joinpath('old.key')
+    new_key_path = tempdir.joinpath('new.key')
+    for path, key in ((old_key_path, test_string[0]),
+                      (new_key_path, test_string[1])):
+        with open(path, 'w') as file:
+            file.write(key)
+            # end with
+        os.chmod(path, 0o600)
+        # end for
+    config_path = tempdir.joinpath('legacy.conf')
+    with open(config_path, 'w') as file:
+        file.write(f'''[settings]
+key_file={old_key_path}
+
+[db]
+password={AESCipher(test_string[0]).encrypt(test_string[2]).decode()}
+url=file:///var/data
+''')
+        # end with
+
+    # bare ciphertexts are left alone unless asked for
+    assert main(['migrate', str(config_path), '--key-file',
+                 str(new_key_path), '--workers', '0']) == 0
+    assert capsys.readouterr().out.startswith('1 files: 0 migrated')
+    assert AESCryptoConfigParser(config_path).key_file == str(old_key_path)
+
+    assert main(['migrate', str(config_path), '--key-file',
+                 str(new_key_path), '--workers', '0', '--legacy-bare']) == 0
+    assert capsys.readouterr().out.startswith('1 files: 1 migrated')
+    my_config = AESCryptoConfigParser(config_path)
+    assert my_config.key_file == str(new_key_path)
+    # re-encrypted in place, still unprefixed
+    password = my_config.get('db', 'password')
+    assert split_scheme(password)[0] is None
+    assert AESCipher(test_string[1]).decrypt(password) == test_string[2]
+    assert my_config.get('db', 'url') == 'file:///var/data'
+    # end def
+
+
+@pytest.mark.run(order=80)
+def test_rewrap(tempdir: Path, test_string: Tuple[str], logger: Logger,
+                capsys: pytest.CaptureFixture):
+    logger.info('rewrap')
+
+    with LocalAWS(region='us-east-1', max_attempts=1) as aws:
+        key_id = aws.create_key()
+        my_config = KMSCryptoConfigParser.from_string(
+            f'[settings]\nkey_id={key_id}\n')
+        data_key = my_config.generate_data_key()
+        options = '\n'.join(
+            f'option{i}={my_config.encrypt_envelope(f"value{i}")}'
+            for i in range(4))
+        config_path = tempdir.joinpath('envelope.conf')
+        with open(config_path, 'w') as file:
+            file.write(f'[settings]\n# rotated yearly\nkey_id={key_id}\n'
+                       f'data_key={data_key}\n\n[Test]\n{options}\n')
+            # end with
+        text = config_path.read_text()
+
+        # only the data key is re-encrypted, on disk
+        new_key_id = aws.create_key()
+        aws.reset_calls()
+        result = migrate_file(str(config_path), MigrationTarget(
+            envelope_key_id=new_key_id, rewrap=True))
+        assert result.status == 'migrated'
+        assert (result.values, result.unchanged) == (0, 4)
+        assert aws.calls == {'TrentService.ReEncrypt': 1}
+        my_config = KMSCryptoConfigParser(config_path)
+        assert my_config.key_id == new_key_id
+        assert my_config.data_key != data_key
+        assert '# rotated yearly' in config_path.read_text()
+        for i in range(4):
+            assert my_config.get('Test', f'option{i}') \
+                == KMSCryptoConfigParser.from_string(text).get(
+                    'Test', f'option{i}')
+            assert my_config.decrypt('Test', f'option{i}') == f'value{i}'
+            # end for
+
+        # and from the command line
+        other_key_id = aws.create_key()
+        assert main(['migrate', str(config_path), '--envelope-key-id',
+                     other_key_id, '--rewrap', '--workers', '0']) == 0
+        assert capsys.readouterr().out.startswith('1 files: 1 migrated')
+        my_config = KMSCryptoConfigParser(config_path)
+        assert my_config.key_id == other_key_id
+        assert my_config.decrypt('Test', 'option0') == 'value0'
+        # end with
+
+    assert main(['migrate', str(config_path), '--key-file',
+                 str(config_path), '--rewrap']) == 2
+    # end def
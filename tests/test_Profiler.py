@@ -0,0 +1,218 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# author = 'Satoshi Imai'
+# credits = ['Satoshi Imai']
+# version = "0.9.0"
+# ---------------------------------------------------------------------------
+
+import json
+import logging
+import os
+import random
+import shutil
+import string
+import tempfile
+from logging import Logger, StreamHandler
+from pathlib import Path
+from typing import Generator, Tuple
+
+import pytest
+
+from src.cryptoconfigparser import (AESCipher, AESCryptoConfigParser,
+                                    LocalAWS, Profiler, SSMCryptoConfigParser)
+from src.cryptoconfigparser.__main__ import main
+
+
+@pytest.fixture(scope='session', autouse=True)
+def setup_and_teardown(key_path: Path, config_path: Path,
+                       test_string: Tuple[str]):
+    # setup
+
+    test_config = f'''
+[settings]
+key_file={str(key_path)}
+encrypted_options=Test.password
+
+[Test]
+site=test.site
+password={test_string[2]}
+token=file:{test_string[2]}
+'''
+
+    with open(key_path, 'w') as file:
+        file.write(test_string[0])
+        # end with
+    os.chmod(key_path, 0o600)
+
+    with open(config_path, 'w') as file:
+        file.write(test_config)
+        # end with
+
+    yield
+
+    # teardown
+    # end def
+
+
+@pytest.fixture(scope='session')
+def test_string() -> Generator[Tuple[str], None, None]:
+
+    key = ''.join([random.choice(string.ascii_letters + string.digits)
+                   for i in range(32)])
+    data = ''.join([random.choice(string.ascii_letters + string.digits)
+                    for i in range(50)])
+
+    cipher = AESCipher(key)
+    encrypted = cipher.encrypt(data).decode()
+
+    yield (key, data, encrypted)
+    # end def
+
+
+@pytest.fixture(scope='module')
+def logger() -> Generator[Logger, None, None]:
+    log = logging.getLogger(__name__)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s')
+    s_handler = StreamHandler()
+    s_handler.setLevel(logging.INFO)
+    s_handler.setFormatter(formatter)
+    log.addHandler(s_handler)
+
+    yield log
+    # end def
+
+
+@pytest.fixture(scope='session')
+def tempdir() -> Generator[Path, None, None]:
+
+    tempdir = Path(tempfile.mkdtemp())
+    yield tempdir
+    if tempdir.exists():
+        shutil.rmtree(tempdir)
+        # end if
+    # end def
+
+
+@pytest.fixture(scope='session')
+def key_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('profile.key')
+    # end def
+
+
+@pytest.fixture(scope='session')
+def config_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('profile.conf')
+    # end def
+
+
+@pytest.mark.run(order=10)
+def test_trace(config_path: Path, test_string: Tuple[str], logger: Logger):
+    logger.info('trace')
+
+    profiler = Profiler()
+    with profiler.activate():
+        # the key file is read outside any trace
+        my_config = AESCryptoConfigParser(config_path)
+        assert my_config.profiler is profiler
+        # end with
+    assert profiler.untraced_calls == {'file.read': 1}
+
+    # the parser does not keep the profiler once the context ends
+    assert my_config.profiler is None
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+    assert profiler.traces == []
+
+    my_config.clear_decrypt_cache()
+    my_config.profiler = profiler
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+    assert my_config.decrypt('Test', 'password') == test_string[1]
+    with pytest.raises(ValueError):
+        my_config.decrypt_int('Test', 'token')
+        # end with
+
+    # one trace per call, typed calls included
+    first, second, outer = profiler.traces
+    assert first.name == 'Test.password'
+    assert first.backend == 'file'
+    assert not first.cache_hit
+    assert first.calls == ()
+    assert first.bytes_in == len(test_string[2])
+    assert first.bytes_out == len(test_string[1])
+    assert first.wall > 0 and first.cpu >= 0
+    assert second.cache_hit and second.calls == ()
+    assert outer.kind == 'int' and outer.error == 'ValueError'
+    assert outer.backend == 'file' and not outer.cache_hit
+
+    summary = profiler.summary()
+    assert summary['count'] == 3
+    assert summary['untraced_calls'] == {'file.read': 1}
+    assert summary['backends']['file']['errors'] == 1
+    # end def
+
+
+@pytest.mark.run(order=20)
+def test_remote_attribution(test_string: Tuple[str], logger: Logger):
+    logger.info('remote_attribution')
+
+    profiler = Profiler()
+    with LocalAWS(region='us-east-1', max_attempts=1) as aws, \
+            profiler.activate():
+        aws.add_secret('prod/app', {'key': test_string[0]})
+        aws.add_parameter('/app/token', 'token')
+        with profiler.trace(None, None, 'load'):
+            my_config = SSMCryptoConfigParser.from_string(f'''
+[settings]
+secret_name=prod/app
+region=us-east-1
+
+[Test]
+password={test_string[2]}
+token=ssm-param:/app/token
+''', region='us-east-1')
+            # end with
+        assert my_config.profiler is profiler
+        assert my_config.decrypt('Test', 'password') == test_string[1]
+        assert my_config.decrypt('Test', 'token') == 'token'
+        # end with
+
+    load, password, token = profiler.traces
+    assert load.calls == ('secretsmanager.GetSecretValue',)
+    assert password.backend == 'secretsmanager' and password.calls == ()
+    assert token.backend == 'ssm-param'
+    assert token.calls == ('ssm.GetParameters',)
+
+    chrome = profiler.to_chrome_trace()
+    assert [event['name'] for event in chrome['traceEvents']] == \
+        ['load', 'Test.password', 'Test.token']
+    assert all(event['ph'] == 'X' for event in chrome['traceEvents'])
+    # end def
+
+
+@pytest.mark.run(order=30)
+def test_cli(config_path: Path, tempdir: Path, test_string: Tuple[str],
+             capsys, logger: Logger):
+    logger.info('cli')
+
+    assert main(['profile', str(config_path)]) == 0
+    output = capsys.readouterr().out
+    assert 'decrypted 2 options' in output
+    assert test_string[1] not in output
+
+    report_path = tempdir.joinpath('profile.json')
+    assert main(['profile', str(config_path), '--format', 'json',
+                 '-o', str(report_path)]) == 0
+    with open(report_path) as file:
+        report = json.load(file)
+        # end with
+    assert [trace['kind'] for trace in report['traces']] == \
+        ['load', 'str', 'str']
+
+    assert main(['profile', str(config_path), '--format', 'chrome',
+                 '-o', str(report_path)]) == 0
+    with open(report_path) as file:
+        assert len(json.load(file)['traceEvents']) == 3
+        # end with
+    # end def
@@ -7,11 +7,13 @@
 
 import json
 import logging
+import os
 import random
 import shutil
 import string
 import sys
 import tempfile
+import threading
 from logging import Logger, StreamHandler
 from pathlib import Path
 from typing import Generator, Tuple
@@ -20,7 +22,12 @@ from unittest.mock import Mock, patch
 import boto3
 import pytest
 
-from src.cryptoconfigparser import AESCipher, SSMCryptoConfigParser
+from src.cryptoconfigparser import (AESCipher, LocalAWS,
+                                    SecretsManagerKeyProvider,
+                                    SSMCryptoConfigParser)
+from src.cryptoconfigparser.__main__ import main
+from src.cryptoconfigparser.AWSKeyProvider import fetch_secret_strings
+from src.cryptoconfigparser.Fleet import share_clients
 
 
 @pytest.fixture(scope='session', autouse=True)
@@ -40,6 +47,7 @@ password={test_string[2]}
     with open(key_path, 'w') as file:
         file.write(test_string[0])
         # end with
+    os.chmod(key_path, 0o600)
 
     with open(comp_config_path, 'w') as file:
         file.write(test_config)
@@ -254,3 +262,201 @@ def test_load_secret(
     assert my_config.profile == 'dummy_profile'
     assert my_config.region == 'dummy_region'
     # end def
+
+
+@pytest.mark.run(order=90)
+def test_parse_secrets(logger: Logger):
+    logger.info('parse_secrets')
+
+    secrets = SecretsManagerKeyProvider.parse_secrets(
+        'team_a, team_b=prod/team-b,,')
+
+    assert secrets == {'team_a': 'team_a', 'team_b': 'prod/team-b'}
+    # end def
+
+
+@pytest.mark.run(order=100)
+def test_decrypt_with_secrets(
+        test_string: Tuple[str], tempdir: Path, logger: Logger):
+    logger.info('decrypt_with_secrets')
+
+    key_b = ''.join([random.choice(string.ascii_letters + string.digits)
+                     for i in range(32)])
+    encrypted_b = AESCipher(key_b).encrypt('team b secret').decode()
+
+    multi_config_path = tempdir.joinpath('multi_secret.conf')
+    with open(multi_config_path, 'w') as file:
+        file.write(f'''
+[settings]
+secret_name=default_secret
+secrets=a=team-a,b=team-b
+
+[Test]
+password={test_string[2]}
+password_a=a:{test_string[2]}
+password_b=b:{encrypted_b}
+''')
+        # end with
+
+    mock_client = Mock()
+    mock_client.batch_get_secret_value.return_value = {
+        'SecretValues': [
+            {'Name': 'default_secret',
+             'SecretString': json.dumps({'key': test_string[0]})},
+            {'Name': 'team-a',
+             'SecretString': json.dumps({'key': test_string[0]})},
+            {'Name': 'team-b',
+             'SecretString': json.dumps({'key': key_b})}],
+        'Errors': []}
+
+    mock_my_session = Mock()
+    mock_my_session.client.return_value = mock_client
+
+    with patch.object(boto3.session, 'Session', return_value=mock_my_session):
+        my_config = SSMCryptoConfigParser(multi_config_path)
+
+        assert my_config.decrypt('Test', 'password') == test_string[1]
+        assert my_config.decrypt('Test', 'password_a') == test_string[1]
+        assert my_config.decrypt('Test', 'password_b') == 'team b secret'
+        # end with
+
+    assert my_config.secrets == {'a': 'team-a', 'b': 'team-b'}
+    mock_client.batch_get_secret_value.assert_called_once()
+    mock_client.get_secret_value.assert_not_called()
+    # end def
+
+
+@pytest.mark.run(order=110)
+def test_fetch_secret_strings_without_batch(
+        test_string: Tuple[str], logger: Logger):
+    logger.info('fetch_secret_strings_without_batch')
+
+    mock_client = Mock(spec=['get_secret_value'])
+    mock_client.get_secret_value.side_effect = lambda SecretId: {
+        'SecretString': json.dumps({'key': SecretId})}
+
+    secret_strings = fetch_secret_strings(mock_client, ['a', 'b', 'a', 'c'])
+
+    assert mock_client.get_secret_value.call_count == 3
+    assert json.loads(secret_strings['c']) == {'key': 'c'}
+    # end def
+
+
+@pytest.mark.run(order=115)
+def test_secret_without_key(test_string: Tuple[str], logger: Logger):
+    logger.info('secret_without_key')
+
+    mock_client = Mock(spec=['get_secret_value'])
+    mock_client.get_secret_value.side_effect = lambda SecretId: {
+        'binary': {'SecretBinary': test_string[0].encode()},
+        'other': {'SecretString': json.dumps({'password': 'x'})}}[SecretId]
+
+    my_config = SSMCryptoConfigParser.from_string(
+        f'[Test]\nbinary=secretsmanager:binary:{test_string[2]}\n'
+        f'other=secretsmanager:other:{test_string[2]}\n',
+        region='us-east-1')
+    my_config.get_provider(
+        SecretsManagerKeyProvider.SCHEME).client = mock_client
+    for option in ('binary', 'other'):
+        with pytest.raises(ValueError) as error:
+            my_config.decrypt('Test', option)
+            # end with
+        assert f'secret {option} has no SecretString' in str(error.value)
+        # end for
+    # end def
+
+
+@pytest.mark.run(order=120)
+def test_single_flight_secret_load(test_string: Tuple[str], logger: Logger):
+    logger.info('single_flight_secret_load')
+
+    with LocalAWS(region='us-east-1', latency=0.05, max_attempts=1) as aws:
+        aws.add_secret('prod/app', {'key': test_string[0]})
+        my_config = SSMCryptoConfigParser.from_string(f'''
+[settings]
+secret_name=prod/app
+
+[Test]
+password={test_string[2]}
+''', region='us-east-1')
+        # cold: drop the secret loaded at construction
+        my_config.reset_providers()
+        aws.reset_calls()
+
+        barrier = threading.Barrier(64)
+        results = []
+
+        def run():
+            barrier.wait()
+            results.append(my_config.decrypt('Test', 'password'))
+            # end def
+
+        threads = [threading.Thread(target=run) for i in range(64)]
+        for thread in threads:
+            thread.start()
+            # end for
+        for thread in threads:
+            thread.join()
+            # end for
+
+        assert results == [test_string[1]] * 64
+        assert aws.calls == {'secretsmanager.GetSecretValue': 1}
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=130)
+def test_verify_shared_clients(test_string: Tuple[str], tempdir: Path,
+                               logger: Logger,
+                               capsys: pytest.CaptureFixture):
+    logger.info('verify_shared_clients')
+
+    with LocalAWS(region='us-east-1', max_attempts=1) as aws:
+        aws.add_secret('prod/app', {'key': test_string[0]})
+        for i in range(30):
+            aws.add_parameter(f'/app/prod/value{i}', f'value{i}')
+            # end for
+        options = '\n'.join(
+            [f'option{i}=ssm-param:/app/prod/value{i}' for i in range(30)])
+        verify_path = tempdir.joinpath('verify')
+        verify_path.mkdir()
+        for name, extra in (('a.conf', ''),
+                            ('b.conf', 'missing=ssm-param:/app/prod/none')):
+            with open(verify_path.joinpath(name), 'w') as file:
+                file.write(f'''[settings]
+secret_name=prod/app
+encrypted_options=Test.password
+
+[Test]
+password={test_string[2]}
+{options}
+{extra}
+''')
+                # end with
+            # end for
+
+        configs = [SSMCryptoConfigParser(verify_path.joinpath(name),
+                                         region='us-east-1')
+                   for name in ('a.conf', 'b.conf')]
+        clients = {}
+        for my_config in configs:
+            share_clients(my_config, clients, ['ssm-param', 'secretsmanager'])
+            # end for
+        assert set(clients) == {('ssm', None, 'us-east-1'),
+                                ('secretsmanager', None, 'us-east-1')}
+        assert configs[0].get_provider('ssm-param').client \
+            is configs[1].get_provider('ssm-param').client
+        assert configs[0].verify_all() == {}
+
+        aws.reset_calls()
+        assert main(['verify', str(verify_path), '--workers', '4',
+                     '--region', 'us-east-1']) == 1
+        captured = capsys.readouterr()
+        assert captured.out == \
+            f'{verify_path.joinpath("b.conf")}: Test.missing: KeyError\n'
+        assert captured.err.startswith('2 files, 63 values checked, 1 failed')
+        assert 'value' not in captured.out
+        # batched: one GetParameters per chunk, not one call per value
+        assert aws.calls['AmazonSSM.GetParameters'] < 20
+        # end with
+    # end def
@@ -0,0 +1,183 @@
+# coding:utf-8
+# ---------------------------------------------------------------------------
+# author = 'Satoshi Imai'
+# credits = ['Satoshi Imai']
+# version = "0.9.0"
+# ---------------------------------------------------------------------------
+
+import logging
+import os
+import random
+import shutil
+import string
+import tempfile
+from logging import Logger, StreamHandler
+from pathlib import Path
+from typing import Generator, Tuple
+
+import pytest
+
+from src.cryptoconfigparser import (AESCipher, AESCryptoConfigParser,
+                                    SecretBuffer)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def setup_and_teardown(key_path: Path, config_path: Path,
+                       test_string: Tuple[str]):
+    # setup
+
+    test_config = f'''
+[settings]
+key_file={str(key_path)}
+
+[Test]
+password={test_string[2]}
+'''
+
+    with open(key_path, 'w') as file:
+        file.write(test_string[0])
+        # end with
+    os.chmod(key_path, 0o600)
+
+    with open(config_path, 'w') as file:
+        file.write(test_config)
+        # end with
+
+    yield
+
+    # teardown
+    # end def
+
+
+@pytest.fixture(scope='session')
+def test_string() -> Generator[Tuple[str], None, None]:
+
+    key = ''.join([random.choice(string.ascii_letters + string.digits)
+                   for i in range(32)])
+    data = ''.join([random.choice(string.ascii_letters + string.digits)
+                    for i in range(50)])
+
+    cipher = AESCipher(key)
+    encrypted = cipher.encrypt(data).decode()
+
+    yield (key, data, encrypted)
+    # end def
+
+
+@pytest.fixture(scope='module')
+def logger() -> Generator[Logger, None, None]:
+    log = logging.getLogger(__name__)
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s')
+    s_handler = StreamHandler()
+    s_handler.setLevel(logging.INFO)
+    s_handler.setFormatter(formatter)
+    log.addHandler(s_handler)
+
+    yield log
+    # end def
+
+
+@pytest.fixture(scope='session')
+def tempdir() -> Generator[Path, None, None]:
+
+    tempdir = Path(tempfile.mkdtemp())
+    yield tempdir
+    if tempdir.exists():
+        shutil.rmtree(tempdir)
+        # end if
+    # end def
+
+
+@pytest.fixture(scope='session')
+def key_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('secret_buffer.key')
+    # end def
+
+
+@pytest.fixture(scope='session')
+def config_path(tempdir: Path) -> Generator[Path, None, None]:
+
+    yield tempdir.joinpath('secret_buffer.conf')
+    # end def
+
+
+@pytest.mark.run(order=10)
+def test_wipe(logger: Logger):
+    logger.info('wipe')
+
+    buffer = SecretBuffer.from_str('secret', 'utf-8')
+    raw = buffer.raw()
+    assert len(buffer) == 6
+    assert buffer == b'secret'
+    assert 'secret' not in repr(buffer)
+
+    with buffer:
+        assert buffer.decode('utf-8') == 'secret'
+        # end with
+
+    assert len(buffer) == 0
+    assert bytes(raw) == bytes(6)
+    # end def
+
+
+@pytest.mark.run(order=20)
+def test_truncate(logger: Logger):
+    logger.info('truncate')
+
+    buffer = SecretBuffer.from_bytes(b'secret\x02\x02')
+    raw = buffer.raw()
+    buffer.truncate(6)
+
+    assert buffer.tobytes() == b'secret'
+    assert bytes(raw[6:]) == bytes(2)
+    with pytest.raises(ValueError):
+        buffer.truncate(7)
+        # end with
+    # end def
+
+
+@pytest.mark.run(order=30)
+def test_lock(logger: Logger):
+    logger.info('lock')
+
+    # mlock is best effort and may be refused by the platform limits
+    with SecretBuffer(64, lock=True) as buffer:
+        assert buffer.locked in (True, False)
+        # end with
+    assert not buffer.locked
+    # end def
+
+
+@pytest.mark.run(order=40)
+def test_cipher_decrypt_into(test_string: Tuple[str], logger: Logger):
+    logger.info('cipher_decrypt_into')
+
+    cipher = AESCipher(test_string[0])
+
+    with cipher.decrypt_into(test_string[2]) as buffer:
+        assert buffer.decode() == test_string[1]
+        # end with
+
+    # a zeroed key no longer yields the plaintext
+    cipher.wipe()
+    try:
+        assert cipher.decrypt(test_string[2]) != test_string[1]
+    except ValueError:
+        pass
+        # end try
+    # end def
+
+
+@pytest.mark.run(order=50)
+def test_decrypt_secret(
+        test_string: Tuple[str], config_path: Path, logger: Logger):
+    logger.info('decrypt_secret')
+
+    my_config = AESCryptoConfigParser(config_path)
+
+    with my_config.decrypt_secret('Test', 'password') as buffer:
+        assert buffer == test_string[1].encode()
+        # end with
+    # end def